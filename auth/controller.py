@@ -1,35 +1,39 @@
 from fastapi import Request
 import uuid
 from datetime import datetime
-from .dbschema import User, BlacklistedTokens
+from sqlalchemy.exc import IntegrityError
+from .dbschema import User
 from fastapi.encoders import jsonable_encoder
-from crud.crud import get_user_by_email, get_user_by_id, get_blacklisted_token
-from utils.pass_utils import hash_password, compare_password_and_hash
+from crud.crud import get_user_by_email, get_user_by_id, get_blacklisted_token, invalidate_cached_user
+from utils.pass_utils import hash_password_async, compare_password_and_hash_async, verify_and_update_password_async
 from utils.user_utils import generate_username
+from utils.blacklist_utils import blacklist_token, revocation_filter, revoke_all_user_tokens
 from utils.token_utils import (
     create_access_token,
     create_password_reset_token,
-    verify_password_reset_token,
+    decode_password_reset_token,
     create_verify_email_token,
-    verify_email_verification_token,
+    decode_email_verification_token,
+    invalidate_access_token,
 )
 from utils.email_utils import (
     generate_reset_password_email,
-    send_mail,
     generate_verification_email,
 )
+from utils.email_queue_utils import recent_emails
+from utils.outbox_utils import outbox_email, outbox_dispatcher
 
 
-def create_new_user(user, session):
+async def create_new_user(user, session):
     """
     Creates a new user in the database.
 
     Parameters:
         user (User): The user object containing the user's information.
-        session (Session): The database session to execute the query.
+        session (AsyncSession): The database session to execute the query.
 
     Returns:
-        dict: A dictionary containing the user's ID and the data returned by the send_mail function.
+        dict: A dictionary containing the user's ID and the result of queueing the verification email.
               If an error occurs, a dictionary with an 'error' key is returned.
 
     Raises:
@@ -37,10 +41,11 @@ def create_new_user(user, session):
     """
 
     try:
-        user_exists = get_user_by_email(user.email, session)
+        # Checked on the primary, as a lagging replica would let a duplicate through
+        user_exists = await get_user_by_email(user.email, session, use_replica=False)
         if user_exists is not None:
             raise ValueError("User already exists.")
-        user.password = hash_password(user.password)
+        user.password = await hash_password_async(user.password)
         new_user = User(**user.dict())
         new_user.username = generate_username(new_user.first_name, new_user.last_name)
         new_user.created_at = datetime.now()
@@ -50,51 +55,70 @@ def create_new_user(user, session):
             email_to=new_user.email, email=new_user.email, token=token
         )
 
-        data = send_mail(
-            email_to=new_user.email,
-            subject=email_to_send.subject,
-            html_content=email_to_send.html_content,
-        )
-
+        # The email is committed with the user, so it is sent even if the process dies right after
         session.add(new_user)
-        session.commit()
-        session.refresh(new_user)
+        session.add(
+            outbox_email(
+                email_to=new_user.email,
+                subject=email_to_send.subject,
+                html_content=email_to_send.html_content,
+            )
+        )
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Registered by a concurrent request since the check above
+            await session.rollback()
+            raise ValueError("User already exists.")
+        await session.refresh(new_user)
+        await invalidate_cached_user(new_user)
+        outbox_dispatcher.notify()
+        data = {"success": "Email queued for delivery"}
+        recent_emails.set(f"verify-email:{new_user.id}", data)
         return {"id": new_user.id, "data": data}
     except ValueError as e:
         return {"error": str(e)}
 
 
-def log_user_in(user, session):
+async def log_user_in(user, session):
     """
     Logs in a user by checking if the user exists in the database and if the provided password matches the hashed password stored in the database. If the user exists and the password is correct, a JWT access token is generated and returned. If the user does not exist or the password is incorrect, a dictionary with an 'error' key is returned.
 
     Parameters:
         user (User): The user object containing the email and password of the user to be logged in.
-        session (Session): The database session to execute the query.
+        session (AsyncSession): The database session to execute the query.
 
     Returns:
         str: The JWT access token if the user exists and the password is correct.
         dict: A dictionary with an 'error' key if the user does not exist or the password is incorrect.
     """
     try:
-        user_exists = get_user_by_email(user.email, session)
+        # Read from the primary and skip the cache, so a password changed elsewhere takes effect at once
+        user_exists = await get_user_by_email(user.email, session, use_replica=False, use_cache=False)
         if user_exists is None:
             raise ValueError("User does not exist.")
-        if not compare_password_and_hash(user.password, user_exists.password):
+        is_password_valid, new_hash = await verify_and_update_password_async(user.password, user_exists.password)
+        if not is_password_valid:
             raise ValueError("Password is incorrect.")
-        token = create_access_token(jsonable_encoder(user_exists.id))
+        if new_hash is not None:
+            # The stored hash predates the current hashing policy
+            user_exists.password = new_hash
+            session.add(user_exists)
+            await session.commit()
+            await invalidate_cached_user(user_exists)
+        token = create_access_token(jsonable_encoder(user_exists.id), user_exists.token_version)
         return {"Access_token": token, "is_active": user_exists.is_active}
     except ValueError as e:
         return {"error": str(e)}
 
 
-def password_recovery(email, session):
+async def password_recovery(email, session):
     """
     Recovers the password for a user with the given email.
 
     Args:
         email (str): The email of the user whose password is being recovered.
-        session (Session): The database session to execute the query.
+        session (AsyncSession): The database session to execute the query.
 
     Returns:
         dict or str: If the password recovery is successful, returns the response data.
@@ -105,20 +129,32 @@ def password_recovery(email, session):
 
     """
     try:
-        user_exists = get_user_by_email(email, session)
+        # The reset token carries token_version, so it is signed from the primary row
+        user_exists = await get_user_by_email(email, session, use_replica=False, use_cache=False)
         if user_exists is None:
             raise ValueError("User does not exist.")
-        token = create_password_reset_token(jsonable_encoder(user_exists.id))
+        dedupe_key = f"password-reset:{user_exists.id}"
+        data = recent_emails.get(dedupe_key)
+        if data is not None:
+            return data
+        token = create_password_reset_token(jsonable_encoder(user_exists.id), user_exists.token_version)
 
         email_to_send = generate_reset_password_email(
             email_to=user_exists.email, email=email, token=token
         )
 
-        data = send_mail(
-            email_to=user_exists.email,
-            subject=email_to_send.subject,
-            html_content=email_to_send.html_content,
+        # Like the registration email, it goes through the outbox so a restart cannot lose it
+        session.add(
+            outbox_email(
+                email_to=user_exists.email,
+                subject=email_to_send.subject,
+                html_content=email_to_send.html_content,
+            )
         )
+        await session.commit()
+        outbox_dispatcher.notify()
+        data = {"success": "Email queued for delivery"}
+        recent_emails.set(dedupe_key, data)
 
         return data
 
@@ -126,7 +162,7 @@ def password_recovery(email, session):
         return {"error": str(e)}
 
 
-def passwd_reset(new_password, session, token):
+async def passwd_reset(new_password, session, token):
     """
     Resets the password for a user based on a provided token.
 
@@ -140,45 +176,42 @@ def passwd_reset(new_password, session, token):
               A dictionary with an 'error' key if there is an issue during the password reset process.
     """
     try:
-        is_token_blacklisted = get_blacklisted_token(token, session)
-        if is_token_blacklisted:
-            raise ValueError("Token already blacklisted")
         password_to_change = new_password.new_password
-        token_data = verify_password_reset_token(token)
+        token_data = decode_password_reset_token(token)
         if token_data is None:
             raise ValueError("Invalid token.")
-        user_exists = get_user_by_id(token_data, session)
+        user_exists = await get_user_by_id(token_data["data"], session, use_replica=False, use_cache=False)
         if user_exists is None:
             raise ValueError("User does not exist.")
+        if token_data.get("ver", 0) != user_exists.token_version:
+            # The token was issued before the last reset or logout-all
+            raise ValueError("Invalid token.")
         if user_exists.is_active == False:
             raise ValueError("User is not active.")
-        is_password_invalid = compare_password_and_hash(
+        is_password_invalid = await compare_password_and_hash_async(
             password_to_change, user_exists.password
         )
         if is_password_invalid:
             raise ValueError("Password cannot be the same as current password")
-        hash_new_password = hash_password(password_to_change)
+        hash_new_password = await hash_password_async(password_to_change)
         user_exists.password = hash_new_password
         user_exists.updated_at = datetime.now()
-        session.add(user_exists)
-        session.commit()
-        session.refresh(user_exists)
-        blacklisted_token = BlacklistedTokens(token=token)
-        session.add(blacklisted_token)
-        session.commit()
-        session.refresh(blacklisted_token)
+        # Bumping the version retires this reset token and every session issued before it.
+        # Only one of several concurrent uses of the token gets to bump it.
+        if not await revoke_all_user_tokens(user_exists, session, expected_version=token_data.get("ver", 0)):
+            raise ValueError("Invalid token.")
         return {"message": "Password reset successful"}
     except ValueError as e:
         return {"error": str(e)}
 
 
-def send_verification_email(token_data, id, session):
+async def send_verification_email(token_data, id, session):
     """
     Sends a verification email to the user with the given ID.
 
     Parameters:
         id (str): The ID of the user.
-        session (Session): The database session to execute the query.
+        session (AsyncSession): The database session to execute the query.
 
     Returns:
         dict : If the verification email is sent successfully, returns the response data.
@@ -194,27 +227,39 @@ def send_verification_email(token_data, id, session):
             raise ValueError("Unauthorized User")
         format_id_to_uuid = str(uuid.UUID(id))
         print(format_id_to_uuid)
-        user_exists = get_user_by_id(format_id_to_uuid, session)
+        # The verification token carries token_version, so it is signed from the primary row
+        user_exists = await get_user_by_id(format_id_to_uuid, session, use_replica=False, use_cache=False)
         if user_exists is None:
             raise ValueError("User does not exist.")
         if user_exists.is_active == True:
             raise ValueError("User is already active.")
-        token = create_verify_email_token(jsonable_encoder(user_exists.email))
+        dedupe_key = f"verify-email:{user_exists.id}"
+        data = recent_emails.get(dedupe_key)
+        if data is not None:
+            return data
+        token = create_verify_email_token(jsonable_encoder(user_exists.email), user_exists.token_version)
         email_to_send = generate_verification_email(
             email_to=user_exists.email, email=user_exists.email, token=token
         )
 
-        data = send_mail(
-            email_to=user_exists.email,
-            subject=email_to_send.subject,
-            html_content=email_to_send.html_content,
+        # Like the registration email, it goes through the outbox so a restart cannot lose it
+        session.add(
+            outbox_email(
+                email_to=user_exists.email,
+                subject=email_to_send.subject,
+                html_content=email_to_send.html_content,
+            )
         )
+        await session.commit()
+        outbox_dispatcher.notify()
+        data = {"success": "Email queued for delivery"}
+        recent_emails.set(dedupe_key, data)
         return data
     except ValueError as e:
         return {"error": str(e)}
 
 
-def verify_user_email(token, session):
+async def verify_user_email(token, session):
     """
     Verify the user's email based on the provided token.
 
@@ -227,41 +272,71 @@ def verify_user_email(token, session):
         If an error occurs, a dictionary with an error key is returned.
     """
     try:
-        is_token_blacklisted = get_blacklisted_token(token, session)
+        is_token_blacklisted = await get_blacklisted_token(token, session)
         if is_token_blacklisted:
             raise ValueError("Token already blacklisted")
-        token_data = verify_email_verification_token(token)
+        token_data = decode_email_verification_token(token)
         if token_data is None:
             raise ValueError("Invalid token.")
-        user_exists = get_user_by_email(token_data, session)
+        user_exists = await get_user_by_email(token_data["data"], session, use_replica=False, use_cache=False)
         if user_exists is None:
             raise ValueError("User does not exist.")
+        if token_data.get("ver", 0) != user_exists.token_version:
+            raise ValueError("Invalid token.")
         if user_exists.is_active == True:
             raise ValueError("User is already active.")
         user_exists.is_active = True
         user_exists.updated_at = datetime.now()
         session.add(user_exists)
-        session.commit()
-        session.refresh(user_exists)
-        blacklisted_token = BlacklistedTokens(token=token)
+        await session.commit()
+        await session.refresh(user_exists)
+        await invalidate_cached_user(user_exists)
+        blacklisted_token = blacklist_token(token)
         session.add(blacklisted_token)
-        session.commit()
-        session.refresh(blacklisted_token)
+        await session.commit()
+        await session.refresh(blacklisted_token)
+        revocation_filter.add(blacklisted_token)
         return {"message": "Email verified successfully"}
     except ValueError as e:
         return {"error": str(e)}
 
 
-def log_user_out(token, session):
+async def log_user_out(token, session):
     try:
-        is_token_blacklisted = get_blacklisted_token(token, session)
+        is_token_blacklisted = await get_blacklisted_token(token, session)
         if is_token_blacklisted:
             raise ValueError("Token already blacklisted")
 
-        blacklisted_token = BlacklistedTokens(token=token)
+        blacklisted_token = blacklist_token(token)
         session.add(blacklisted_token)
-        session.commit()
-        session.refresh(blacklisted_token)
+        await session.commit()
+        await session.refresh(blacklisted_token)
+        revocation_filter.add(blacklisted_token)
+        invalidate_access_token(token)
         return {"message": "Logged out successfully"}
     except ValueError as e:
         return {"error": str(e)}
+
+
+async def log_user_out_everywhere(token_data, session):
+    """
+    Logs a user out of every session by revoking all tokens issued to them so far.
+
+    Parameters:
+        token_data (str): The ID of the authenticated user.
+        session (AsyncSession): The database session to execute the query.
+
+    Returns:
+        dict: A dictionary with a message key if the tokens were revoked.
+              A dictionary with an 'error' key if the user does not exist.
+    """
+    try:
+        if token_data is None:
+            raise ValueError("Unauthorized User")
+        user_exists = await get_user_by_id(token_data, session, use_replica=False, use_cache=False)
+        if user_exists is None:
+            raise ValueError("User does not exist.")
+        await revoke_all_user_tokens(user_exists, session)
+        return {"message": "Logged out of all sessions successfully"}
+    except ValueError as e:
+        return {"error": str(e)}
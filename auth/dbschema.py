@@ -1,5 +1,5 @@
 from uuid import UUID, uuid4
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Index
 from datetime import datetime
 
 
@@ -35,6 +35,9 @@ class User(SQLModel, table=True):
     # Flag indicating if the user is disabled
     is_disabled: bool = Field(default=False)
 
+    # Version stamped into the user's tokens; bumping it revokes every token issued before
+    token_version: int = Field(default=0, nullable=False)
+
     # Time when the user was created
     created_at: datetime = Field(default_factory=None, nullable=False)
 
@@ -51,8 +54,52 @@ class BlacklistedTokens(SQLModel, table=True):
     # UUID primary key
     id: UUID = Field(default_factory=uuid4, primary_key=True, index=True)
 
-    # Token
-    token: str
+    # SHA-256 hex digest of the token, so lookups hit a fixed-size unique index
+    token_hash: str = Field(unique=True, index=True, max_length=64)
+
+    # Time when the token expires; the row can be purged after this
+    expires_at: datetime = Field(index=True, nullable=False)
 
     # Time when the token was blacklisted
-    created_at: datetime = Field(default_factory=datetime.now, nullable=False)
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.now, nullable=False)
+
+
+class EmailOutbox(SQLModel, table=True):
+    """
+    SQL Model representing an outbound email waiting to be delivered.
+
+    Rows are written in the same transaction as the change that triggers the email and
+    drained by the outbox dispatcher, so an email is never lost to a crash or a failed send.
+    """
+
+    __table_args__ = (Index("ix_emailoutbox_status_next_attempt_at", "status", "next_attempt_at"),)
+
+    # UUID primary key
+    id: UUID = Field(default_factory=uuid4, primary_key=True, index=True)
+
+    # Recipient, subject and rendered HTML body
+    email_to: str
+    subject: str
+    html_content: str
+
+    # "pending", "delivered" or "dead" once every attempt has failed
+    status: str = Field(default="pending", max_length=16, nullable=False)
+
+    # Number of delivery attempts so far
+    attempts: int = Field(default=0, nullable=False)
+
+    # Earliest time of the next delivery attempt
+    next_attempt_at: datetime = Field(default_factory=datetime.now, nullable=False)
+
+    # Dispatcher run holding the row, and until when; an expired claim can be taken over
+    claim_id: UUID | None = Field(default=None, index=True)
+    claimed_until: datetime | None = None
+
+    # Error of the last failed attempt
+    last_error: str | None = None
+
+    # Time when the email was queued
+    created_at: datetime = Field(default_factory=datetime.now, nullable=False)
+
+    # Time when the email was delivered
+    delivered_at: datetime | None = None
@@ -0,0 +1,16 @@
+"""
+Fills in the settings the benchmarks do not use, so they run without a .env file.
+Import this before anything from utils.
+"""
+import os
+
+for name in (
+    "ACCESS_TOKEN_SECRET_KEY",
+    "PASSWORD_RESET_TOKEN_SECRET_KEY",
+    "VERIFY_EMAIL_TOKEN_SECRET_KEY",
+    "EMAILS_FROM_MAIL",
+    "OPENAI_API_KEY",
+    "SMTP_PASS",
+):
+    os.environ.setdefault(name, "benchmark")
+os.environ.setdefault("ORIGINS", '["*"]')
@@ -0,0 +1,138 @@
+"""
+Measures /users/me/chat throughput and latency offline, with the fake model
+provider, for full replies and for replies streamed as Server-Sent Events, and
+checks that every chat turn was persisted.
+
+The app runs in-process against a SQLite file in a temporary directory, with the
+response cache off so every prompt reaches the provider.
+
+Usage:
+    python -m benchmarks.chat_benchmark [--users 20] [--requests 10] [--latency 0.2] [--tokens-per-second 200]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import benchmarks.benchmark_env
+import httpx
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def timing_first_body(app, first_bodies: list[float]):
+    # The test transport hands the client the whole body at once, so the first piece is timed in the app
+    async def timed_app(scope, receive, send):
+        start = time.perf_counter()
+        timed = False
+
+        async def timed_send(message):
+            nonlocal timed
+            if message["type"] == "http.response.body" and message.get("body") and not timed:
+                first_bodies.append(time.perf_counter() - start)
+                timed = True
+            await send(message)
+
+        await app(scope, receive, timed_send)
+
+    return timed_app
+
+
+async def run(app, tokens: list[str], requests: int, stream: bool) -> dict:
+    latencies = []
+    first_bodies = []
+    failures = 0
+
+    async def user(client: httpx.AsyncClient, number: int, token: str):
+        nonlocal failures
+        headers = {"Authorization": f"Bearer {token}"}
+        for request in range(requests):
+            body = {"query": f"Meal plan {stream} {number} {request}"}
+            start = time.perf_counter()
+            response = await client.post(f"/api/v1/users/me/chat?stream={str(stream).lower()}", headers=headers, json=body)
+            latencies.append(time.perf_counter() - start)
+            failures += response.status_code != 200 or (stream and "event: done" not in response.text)
+
+    transport = httpx.ASGITransport(app=timing_first_body(app, first_bodies))
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(client, number, token) for number, token in enumerate(tokens)))
+        elapsed = time.perf_counter() - start
+    return {
+        "requests_per_second": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": percentile(latencies, 0.99),
+        "first_body_p50": statistics.median(first_bodies),
+        "failed": failures,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    args = parser.parse_args()
+
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # The settings are read on import, and the app logs to data-log/ under the working directory
+        os.chdir(directory)
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{directory}/benchmark.sqlite"
+        os.environ["LLM_PROVIDER"] = "fake"
+        os.environ["LLM_FAKE_LATENCY"] = str(args.latency)
+        os.environ["LLM_FAKE_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+        os.environ["CHAT_RESPONSE_CACHE"] = "false"
+        os.environ["LLM_QUEUE_SIZE"] = str(args.users * 2)
+        os.environ["LLM_QUEUE_TIMEOUT"] = "600"
+        if args.max_concurrency is not None:
+            os.environ["LLM_MAX_CONCURRENCY"] = str(args.max_concurrency)
+
+        from sqlmodel import select, func
+        from auth.dbschema import User
+        from users.dbschema import Chats
+        from utils.db_utils import async_session
+        from utils.llm_gateway_utils import llm_gateway
+        from utils.token_utils import create_access_token
+        import main as app_main
+
+        async with app_main.lifespan(app_main.app):
+            now = datetime.now()
+            users = [
+                User(
+                    first_name="Bench", last_name="Mark", username=f"bench{n}", email=f"bench{n}@example.com",
+                    password="-", created_at=now, updated_at=now,
+                )
+                for n in range(args.users)
+            ]
+            async with async_session() as session:
+                session.add_all(users)
+                await session.commit()
+            tokens = [create_access_token(str(user.id), user.token_version) for user in users]
+
+            print(f"fake provider: {args.latency * 1000:.0f} ms to first token, {args.tokens_per_second:.0f} tokens/s, "
+                  f"{llm_gateway.max_concurrency} concurrent model calls")
+            for label, stream in (("full reply", False), ("streamed", True)):
+                result = await run(app_main.app, tokens, args.requests, stream)
+                print(
+                    f"{label:>12}: {result['requests_per_second']:8.1f} requests/s, "
+                    f"p50 {result['p50'] * 1000:8.1f} ms, p99 {result['p99'] * 1000:8.1f} ms, "
+                    f"first byte p50 {result['first_body_p50'] * 1000:8.1f} ms, failed {result['failed']}"
+                )
+            async with async_session() as session:
+                persisted = (await session.exec(select(func.count()).select_from(Chats))).one()
+            expected = 2 * 2 * args.users * args.requests
+            print(f"persisted {persisted} of {expected} chat messages")
+        os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+"""
+Measures email template renders per second when each render reads and compiles
+the template from disk, and when it uses the shared, precompiled environment.
+
+Usage:
+    python -m benchmarks.email_template_benchmark [--renders 2000]
+"""
+import argparse
+import time
+
+import benchmarks.benchmark_env
+from jinja2 import Template
+from utils.email_utils import EMAIL_TEMPLATES_DIR, precompile_email_templates, render_email_template
+
+
+CONTEXT = {
+    "project_name": "Eat Right",
+    "username": "john@example.com",
+    "email": "john@example.com",
+    "valid_minutes": 60,
+    "link": "http://localhost:3000/api/v1/verify-email?token=benchmark",
+}
+
+
+def render_from_disk(template_name: str, context: dict) -> str:
+    # What render_email_template used to do on every email
+    template_str = (EMAIL_TEMPLATES_DIR / template_name).read_text()
+    return Template(template_str).render(context)
+
+
+def renders_per_second(render, template_name: str, renders: int) -> float:
+    start = time.perf_counter()
+    for _ in range(renders):
+        render(template_name, CONTEXT)
+    return renders / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=2000)
+    args = parser.parse_args()
+    precompile_email_templates()
+    for template_name in ("verify_email.html", "reset_password.html"):
+        assert render_from_disk(template_name, CONTEXT) == render_email_template(template_name, CONTEXT)
+        before = renders_per_second(render_from_disk, template_name, args.renders)
+        after = renders_per_second(render_email_template, template_name, args.renders)
+        print(
+            f"{template_name:>20}: compile per render {before:10.0f}/s, "
+            f"precompiled {after:10.0f}/s ({after / before:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measures login latency under concurrent load with password verification run
+inline on the event loop and on the password worker pool.
+
+Each simulated login verifies a bcrypt hash; a cheap request that only touches
+the event loop runs alongside to show how long other routes are held up.
+
+Usage:
+    python -m benchmarks.login_latency_benchmark [--logins 50]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import benchmarks.benchmark_env
+from utils.pass_utils import hash_password, compare_password_and_hash, compare_password_and_hash_async
+
+
+PASSWORD = "Password123$"
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(offload: bool, logins: int, hashed: str) -> dict:
+    login_latencies = []
+    probe_latencies = []
+
+    async def login():
+        start = time.perf_counter()
+        await asyncio.sleep(0)
+        if offload:
+            await compare_password_and_hash_async(PASSWORD, hashed)
+        else:
+            compare_password_and_hash(PASSWORD, hashed)
+        login_latencies.append(time.perf_counter() - start)
+
+    async def probe():
+        for _ in range(logins):
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            probe_latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(probe(), *(login() for _ in range(logins)))
+    return {
+        "login_p50": statistics.median(login_latencies),
+        "login_p99": percentile(login_latencies, 0.99),
+        "probe_p99": percentile(probe_latencies, 0.99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=50)
+    args = parser.parse_args()
+    hashed = hash_password(PASSWORD)
+    for label, offload in (("inline", False), ("worker pool", True)):
+        result = await run(offload, args.logins, hashed)
+        print(
+            f"{label:>12}: login p50 {result['login_p50'] * 1000:8.1f} ms, "
+            f"login p99 {result['login_p99'] * 1000:8.1f} ms, "
+            f"other requests p99 {result['probe_p99'] * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""
+Measures concurrent chat-row write throughput against a SQLite file with the
+default settings and with the SQLite performance profile enabled.
+
+Usage:
+    python -m benchmarks.sqlite_write_benchmark [--writers 50] [--writes 20]
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+import benchmarks.benchmark_env
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from utils.config_utils import settings
+from utils.db_utils import PoolMetrics, SerializedWriteSession, build_engine
+from users.dbschema import Chats
+
+
+async def run(profile: bool, writers: int, writes: int) -> dict:
+    settings.SQLITE_PERFORMANCE_PROFILE = profile
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite+aiosqlite:///{directory}/benchmark.sqlite"
+        engine = build_engine(url, PoolMetrics())
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        session_maker = async_sessionmaker(
+            engine,
+            class_=SerializedWriteSession if profile else AsyncSession,
+            expire_on_commit=False,
+        )
+        failures = 0
+
+        async def writer(number: int):
+            nonlocal failures
+            for _ in range(writes):
+                try:
+                    async with session_maker() as session:
+                        session.add(Chats(user_id=str(number), message="benchmark", sender="user"))
+                        await session.commit()
+                except Exception:
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(writer(number) for number in range(writers)))
+        elapsed = time.perf_counter() - start
+        await engine.dispose()
+    committed = writers * writes - failures
+    return {"committed": committed, "failed": failures, "rows_per_second": committed / elapsed}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=50)
+    parser.add_argument("--writes", type=int, default=20)
+    args = parser.parse_args()
+    for label, profile in (("default", False), ("performance profile", True)):
+        result = await run(profile, args.writers, args.writes)
+        print(
+            f"{label:>20}: {result['rows_per_second']:8.1f} rows/s, "
+            f"{result['committed']} committed, {result['failed']} failed"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
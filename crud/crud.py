@@ -1,73 +1,502 @@
-from sqlmodel import Session, select
-from auth.dbschema import User, BlacklistedTokens
-from users.dbschema import Chats 
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+from uuid import uuid4
+from sqlmodel import select, tuple_, delete, update, func, or_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from auth.dbschema import User, BlacklistedTokens, EmailOutbox
+from users.dbschema import Chats, ChatResponseCache
+from utils.config_utils import settings
+from utils.cache_utils import MemoryCacheBackend, SharedCacheBackend
+from utils.token_utils import token_digest
 
 
+def build_user_cache():
+    """
+    Build the user lookup cache for the configured backend.
+
+    Returns:
+        MemoryCacheBackend | SharedCacheBackend: The cache of user rows.
+    """
+    if settings.USER_CACHE_BACKEND == "shared":
+        # Only needed for the shared backend, so redis stays an optional dependency
+        import redis.asyncio as redis
+
+        return SharedCacheBackend(redis.from_url(settings.REDIS_URL), ttl=settings.USER_CACHE_TTL, prefix="user:")
+    # Other workers cannot evict this process's entries, so a bumped token_version may go
+    # unseen here for as long as an entry lives; bound that like the revocation filter's lag
+    ttl = min(settings.USER_CACHE_TTL, settings.REVOCATION_SYNC_INTERVAL)
+    return MemoryCacheBackend(maxsize=settings.USER_CACHE_SIZE, ttl=ttl)
+
+
+# Column values of recently read users, stored under their id, email and username.
+# Writers must call invalidate_cached_user after committing a change to a user.
+user_cache = build_user_cache()
+
+
+def user_cache_keys(id, email, username) -> set[str]:
+    return {f"id:{id}", f"email:{email}", f"username:{username}"}
 
-def get_user_by_email(email: str, session: Session):
+
+async def cache_user(user: User):
+    """
+    Cache a user's column values under its id, email and username.
+
+    Args:
+        user (User): The user to cache.
+    """
+    data = user.model_dump()
+    for key in user_cache_keys(user.id, user.email, user.username):
+        await user_cache.set(key, data)
+
+
+async def invalidate_cached_user(user: User):
+    """
+    Drop a user from the lookup cache, including keys of its previous email and username.
+
+    Args:
+        user (User): The user that was created or changed.
+    """
+    keys = user_cache_keys(user.id, user.email, user.username)
+    cached = await user_cache.get(f"id:{user.id}")
+    if cached is not None:
+        keys |= user_cache_keys(cached["id"], cached["email"], cached["username"])
+    await user_cache.delete(*keys)
+
+
+async def get_cached_user(key: str, statement, session: AsyncSession, use_cache: bool = True):
+    """
+    Look a user up in the cache, running the statement and caching its result on a miss.
+
+    A cached user is attached to the session without a query, so callers can update it
+    just like a loaded one. Without use_cache the statement always runs and overwrites any
+    copy the session already holds; use that for checks that guard a write, whose outcome
+    must not depend on a copy that can be up to USER_CACHE_TTL old.
+
+    Args:
+        key (str): The cache key of the lookup.
+        statement: The select statement that loads the user.
+        session (AsyncSession): The database session to execute the query.
+        use_cache (bool): Whether the user may come from the cache.
+
+    Returns:
+        User | None: The user, or None if it does not exist.
+    """
+    if not use_cache:
+        return (await session.exec(statement.execution_options(populate_existing=True))).first()
+    cached = await user_cache.get(key)
+    if cached is not None:
+        user = User.model_validate(cached)
+        # Keep the session's own copy, which may carry unflushed changes
+        existing = session.identity_map.get(identity_key(User, user.id))
+        if existing is not None:
+            return existing
+        make_transient_to_detached(user)
+        session.add(user)
+        return user
+    user = (await session.exec(statement)).first()
+    if user is not None:
+        await cache_user(user)
+    return user
+
+
+
+async def get_user_by_email(email: str, session: AsyncSession, use_replica: bool = True, use_cache: bool = True):
     """
     Retrieve a user by their email from the database.
 
     Args:
         email (str): The email of the user to retrieve.
-        session (Session): The database session to execute the query.
+        session (AsyncSession): The database session to execute the query.
+        use_replica (bool): Whether the read may be served by a read replica.
+        use_cache (bool): Whether the user may come from the user lookup cache.
 
     Returns:
         User: The user object retrieved based on the email.
     """
-    statement = select(User).where(User.email == email)
-    result = session.exec(statement).first()
-    return result
+    statement = select(User).where(User.email == email).execution_options(use_replica=use_replica)
+    return await get_cached_user(f"email:{email}", statement, session, use_cache)
 
 
-def get_user_by_id(id, session: Session):
+async def get_user_by_id(id, session: AsyncSession, use_replica: bool = True, use_cache: bool = True):
     """
     Retrieve a user from the database by their ID.
 
     Parameters:
         id (str): The ID of the user to retrieve.
-        session (Session): The database session to execute the query.
+        session (AsyncSession): The database session to execute the query.
+        use_replica (bool): Whether the read may be served by a read replica.
+        use_cache (bool): Whether the user may come from the user lookup cache.
 
     Returns:
         User
     """
-    statement = select(User).where(User.id == id)
-    result = session.exec(statement).first()
-    return result
+    statement = select(User).where(User.id == id).execution_options(use_replica=use_replica)
+    return await get_cached_user(f"id:{id}", statement, session, use_cache)
 
-def get_user_by_username(username: str, session: Session):
+async def get_user_by_username(username: str, session: AsyncSession, use_replica: bool = True, use_cache: bool = True):
     """
     Retrieve a user by their username from the database.
 
     Args:
         username (str): The username of the user to retrieve.
-        session (Session): The database session to execute the query.
+        session (AsyncSession): The database session to execute the query.
+        use_replica (bool): Whether the read may be served by a read replica.
+        use_cache (bool): Whether the user may come from the user lookup cache.
 
     Returns:
         User: The user object retrieved based on the username.
     """
-    statement = select(User).where(User.username == username)
-    result = session.exec(statement).first()
+    statement = select(User).where(User.username == username).execution_options(use_replica=use_replica)
+    return await get_cached_user(f"username:{username}", statement, session, use_cache)
+
+
+async def bump_token_version(user_id, session: AsyncSession, expected_version: int | None = None) -> bool:
+    """
+    Increment a user's token version in a single UPDATE, without committing.
+
+    The increment happens in the database, so concurrent bumps are never lost. With
+    expected_version the row only changes if it still has that version, which lets
+    exactly one of several concurrent uses of a one-time token succeed.
+
+    Args:
+        user_id: The ID of the user.
+        session (AsyncSession): The database session to execute the update.
+        expected_version (int | None): The version the user must still have.
+
+    Returns:
+        bool: True if the version was bumped.
+    """
+    statement = (
+        update(User)
+        .where(User.id == user_id)
+        .values(token_version=User.token_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if expected_version is not None:
+        statement = statement.where(User.token_version == expected_version)
+    result = await session.exec(statement)
+    return result.rowcount == 1
+
+async def get_blacklisted_token(token: str, session: AsyncSession):
+    """
+    Retrieve the blacklist entry of a token, looked up by its digest.
+
+    Args:
+        token (str): The encoded token.
+        session (AsyncSession): The database session to execute the query.
+
+    Returns:
+        BlacklistedTokens | None: The blacklist entry, if the token has been revoked.
+    """
+    statement = select(BlacklistedTokens).where(BlacklistedTokens.token_hash == token_digest(token))
+    result = (await session.exec(statement)).first()
     return result
 
-def get_blacklisted_token(token: str, session: Session):
-    statement = select(BlacklistedTokens).where(BlacklistedTokens.token == token)
-    result = session.exec(statement).first()
+
+async def get_blacklisted_tokens_since(since, session: AsyncSession):
+    """
+    Retrieve the unexpired blacklist entries created after a point in time.
+
+    Args:
+        since (datetime | None): Only entries created after this time are returned; None returns all of them.
+        session (AsyncSession): The database session to execute the query.
+
+    Returns:
+        List[Row]: The token_hash, expires_at and created_at of each entry.
+    """
+    statement = select(BlacklistedTokens.token_hash, BlacklistedTokens.expires_at, BlacklistedTokens.created_at).where(
+        BlacklistedTokens.expires_at >= datetime.now()
+    )
+    if since is not None:
+        statement = statement.where(BlacklistedTokens.created_at > since)
+    result = (await session.exec(statement)).all()
     return result
 
 
+async def delete_expired_blacklisted_tokens(session: AsyncSession, batch_size: int):
+    """
+    Delete one batch of blacklist entries whose tokens have expired.
 
-def get_chat_history(id, session: Session):
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        batch_size (int): The maximum number of entries to delete.
+
+    Returns:
+        int: The number of entries deleted.
+    """
+    expired = (
+        select(BlacklistedTokens.id)
+        .where(BlacklistedTokens.expires_at < datetime.now())
+        .limit(batch_size)
+    )
+    statement = delete(BlacklistedTokens).where(BlacklistedTokens.id.in_(expired))
+    result = await session.exec(statement)
+    await session.commit()
+    return result.rowcount
+
+
+async def claim_outbox_emails(session: AsyncSession, batch_size: int, lease: float):
+    """
+    Claim a batch of outbox emails that are due for delivery.
+
+    Claimed rows are stamped with a claim ID and a lease, so concurrent dispatchers
+    never take the same row; rows whose lease ran out (their dispatcher died) are due again.
+
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        batch_size (int): The maximum number of emails to claim.
+        lease (float): Seconds the claim is held for.
+
+    Returns:
+        List[EmailOutbox]: The claimed emails.
     """
-    Retrieve the chat history of a user from the database.
+    now = datetime.now()
+    claim_id = uuid4()
+    due = (
+        select(EmailOutbox.id)
+        .where(
+            EmailOutbox.status == "pending",
+            EmailOutbox.next_attempt_at <= now,
+            or_(EmailOutbox.claimed_until == None, EmailOutbox.claimed_until < now),
+        )
+        .order_by(EmailOutbox.next_attempt_at)
+        .limit(batch_size)
+    )
+    statement = (
+        update(EmailOutbox)
+        .where(
+            EmailOutbox.id.in_(due),
+            or_(EmailOutbox.claimed_until == None, EmailOutbox.claimed_until < now),
+        )
+        .values(claim_id=claim_id, claimed_until=now + timedelta(seconds=lease))
+    )
+    await session.exec(statement)
+    await session.commit()
+    result = await session.exec(select(EmailOutbox).where(EmailOutbox.claim_id == claim_id))
+    emails = list(result.all())
+    # End the read transaction so no connection is held while the emails are sent
+    await session.commit()
+    return emails
+
+
+async def renew_outbox_claim(session: AsyncSession, claim_id, lease: float) -> int:
+    """
+    Extend the lease of the outbox emails still held under a claim.
+
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        claim_id: The claim to renew.
+        lease (float): Seconds the claim is held for from now.
+
+    Returns:
+        int: The number of emails still held.
+    """
+    statement = (
+        update(EmailOutbox)
+        .where(EmailOutbox.claim_id == claim_id)
+        .values(claimed_until=datetime.now() + timedelta(seconds=lease))
+    )
+    result = await session.exec(statement)
+    await session.commit()
+    return result.rowcount
+
+
+async def release_outbox_email(session: AsyncSession, email_id, claim_id, **values) -> bool:
+    """
+    Record the outcome of sending an outbox email and release its claim, without committing.
+
+    Nothing changes if the email is no longer held under the claim, e.g. because the
+    lease ran out and another dispatcher claimed it.
+
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        email_id: The ID of the email.
+        claim_id: The claim the email was sent under.
+        **values: The columns to update.
+
+    Returns:
+        bool: True if the email was still held and was updated.
+    """
+    statement = (
+        update(EmailOutbox)
+        .where(EmailOutbox.id == email_id, EmailOutbox.claim_id == claim_id)
+        .values(claim_id=None, claimed_until=None, **values)
+    )
+    result = await session.exec(statement)
+    return result.rowcount == 1
+
+
+async def count_pending_outbox_emails(session: AsyncSession):
+    """
+    Count the outbox emails that have not been delivered yet.
+
+    Args:
+        session (AsyncSession): The database session to execute the query.
+
+    Returns:
+        int: The number of pending emails.
+    """
+    statement = select(func.count()).select_from(EmailOutbox).where(EmailOutbox.status == "pending")
+    return (await session.exec(statement)).one()
+
+
+async def get_cached_chat_response(key: str, session: AsyncSession):
+    """
+    Retrieve an unexpired cached model reply.
+
+    This is a plain read; the caller records the use and flushes it later with
+    touch_cached_chat_responses.
+
+    Args:
+        key (str): The cache key of the prompt.
+        session (AsyncSession): The database session to execute the query.
+
+    Returns:
+        ChatResponseCache | None: The cached reply, or None if there is none or it expired.
+    """
+    statement = select(ChatResponseCache).where(
+        ChatResponseCache.key == key, ChatResponseCache.expires_at > datetime.now()
+    )
+    return (await session.exec(statement)).first()
+
+
+async def touch_cached_chat_responses(session: AsyncSession, last_used: dict[str, datetime]):
+    """
+    Record when cached replies were last used, in one batched UPDATE.
+
+    Keys whose entry has been deleted in the meantime are skipped.
+
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        last_used (dict[str, datetime]): The time each cache key was last used.
+    """
+    if not last_used:
+        return
+    table = ChatResponseCache.__table__
+    statement = (
+        update(table)
+        .where(table.c.key == bindparam("touched_key"))
+        .values(last_used_at=bindparam("touched_at"))
+    )
+    await session.execute(statement, [{"touched_key": key, "touched_at": at} for key, at in last_used.items()])
+    await session.commit()
+
+
+# INSERT constructs of the backends that support INSERT ... ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+async def save_cached_chat_response(entry: ChatResponseCache, session: AsyncSession):
+    """
+    Insert or replace a cached model reply in one statement, so concurrent writers of the same key do not conflict.
+
+    Args:
+        entry (ChatResponseCache): The reply to cache.
+        session (AsyncSession): The database session to execute the query.
+    """
+    values = entry.model_dump()
+    insert = UPSERT_INSERTS.get(session.get_bind().dialect.name)
+    if insert is None:
+        # No upsert on this backend; the caller treats a conflicting insert as a skipped cache write
+        session.add(ChatResponseCache(**values))
+        await session.commit()
+        return
+    statement = insert(ChatResponseCache).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[ChatResponseCache.key],
+        set_={column: statement.excluded[column] for column in values if column != "key"},
+    )
+    await session.exec(statement)
+    await session.commit()
+
+
+async def delete_stale_chat_responses(session: AsyncSession, batch_size: int, max_rows: int):
+    """
+    Delete one batch of expired cached replies, or of the least recently used ones beyond max_rows.
+
+    Args:
+        session (AsyncSession): The database session to execute the query.
+        batch_size (int): The maximum number of entries to delete.
+        max_rows (int): The number of entries the cache may keep.
+
+    Returns:
+        int: The number of entries deleted.
+    """
+    expired = select(ChatResponseCache.key).where(ChatResponseCache.expires_at <= datetime.now()).limit(batch_size)
+    result = await session.exec(delete(ChatResponseCache).where(ChatResponseCache.key.in_(expired)))
+    deleted = result.rowcount
+    if deleted < batch_size:
+        total = (await session.exec(select(func.count()).select_from(ChatResponseCache))).one()
+        excess = min(total - max_rows, batch_size - deleted)
+        if excess > 0:
+            least_recent = (
+                select(ChatResponseCache.key).order_by(ChatResponseCache.last_used_at).limit(excess)
+            )
+            result = await session.exec(delete(ChatResponseCache).where(ChatResponseCache.key.in_(least_recent)))
+            deleted += result.rowcount
+    await session.commit()
+    return deleted
+
+
+async def get_chat_history(id, session: AsyncSession, before=None, after=None, limit: int = 50):
+    """
+    Retrieve a page of the chat history of a user from the database.
+
+    Messages are ordered by (created_at, id) and selected by keyset, so the cost of a
+    page does not depend on how far into the history it is.
 
     Parameters:
         id (str): The ID of the user to retrieve the chat history for.
-        session (Session): The database session to execute the query.
+        session (AsyncSession): The database session to execute the query.
+        before (tuple[datetime, UUID] | None): Only return messages older than this position.
+        after (tuple[datetime, UUID] | None): Only return messages newer than this position.
+        limit (int): The maximum number of messages to return.
 
     Returns:
-        List[Chats]: The list of chat messages for the user.
+        tuple[List[Chats], bool]: The messages in chronological order, and whether more
+            messages exist beyond the page in the direction being read.
     """
+    position = tuple_(Chats.created_at, Chats.id)
     statement = select(Chats).where(Chats.user_id == id)
-    result = session.exec(statement).all()
-    return result
\ No newline at end of file
+    if before is not None:
+        statement = statement.where(position < before).order_by(Chats.created_at.desc(), Chats.id.desc())
+    else:
+        if after is not None:
+            statement = statement.where(position > after)
+        statement = statement.order_by(Chats.created_at, Chats.id)
+    statement = statement.limit(limit + 1).execution_options(use_replica=True)
+    result = list((await session.exec(statement)).all())
+    has_more = len(result) > limit
+    result = result[:limit]
+    if before is not None:
+        result.reverse()
+    return result, has_more
+
+
+async def stream_chat_history(id, session: AsyncSession, batch_size: int = 500):
+    """
+    Stream the full chat history of a user from the database in batches.
+
+    Rows are read through a server-side cursor as plain mappings, so only one batch
+    is held in memory at a time however long the history is.
+
+    Parameters:
+        id (str): The ID of the user to stream the chat history for.
+        session (AsyncSession): The database session to execute the query.
+        batch_size (int): The number of messages fetched per round-trip.
+
+    Yields:
+        List[RowMapping]: The next batch of chat messages in chronological order.
+    """
+    statement = (
+        select(Chats.id, Chats.user_id, Chats.message, Chats.sender, Chats.created_at)
+        .where(Chats.user_id == id)
+        .order_by(Chats.created_at, Chats.id)
+        .execution_options(use_replica=True, yield_per=batch_size)
+    )
+    result = await session.stream(statement)
+    async for batch in result.mappings().partitions():
+        yield batch
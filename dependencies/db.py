@@ -1,7 +1,17 @@
-from sqlmodel import Session
-from utils.db_utils import engine
+from utils.db_utils import async_session
 
 
-def get_session():
-    with Session(engine) as session:
-        return session
\ No newline at end of file
+async def get_session():
+    """
+    Provides a database session scoped to a single request.
+
+    Nothing is committed here: controllers commit explicitly once a request has been
+    validated, and report failures by returning an error rather than raising. Whatever
+    is left uncommitted when the route returns is rolled back as the session closes,
+    which also returns its connection to the pool.
+
+    Yields:
+        AsyncSession: The session for the current request.
+    """
+    async with async_session() as session:
+        yield session
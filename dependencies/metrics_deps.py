@@ -0,0 +1,19 @@
+import secrets
+from fastapi import Header, HTTPException
+from typing import Annotated
+from utils.config_utils import settings
+
+
+async def verify_metrics_token(authorization: Annotated[str | None, Header()] = None):
+    """
+    Allows a request to the metrics routes only if it carries the metrics token.
+
+    Args:
+        authorization (str | None): The Authorization header, expected as "Bearer <METRICS_TOKEN>".
+
+    Raises:
+        HTTPException: 401 if the token is missing or wrong.
+    """
+    expected = f"Bearer {settings.METRICS_TOKEN}"
+    if settings.METRICS_TOKEN is None or authorization is None or not secrets.compare_digest(authorization, expected):
+        raise HTTPException(status_code=401, detail="Invalid metrics token.")
@@ -1,11 +1,13 @@
 from fastapi.security import OAuth2PasswordBearer
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from dependencies.db import get_session
 from utils.config_utils import settings
-from crud.crud import get_blacklisted_token
+from utils.blacklist_utils import is_token_revoked
 from fastapi import Depends
 from typing import Annotated
-from utils.token_utils import verify_access_token
+from auth.dbschema import User
+from crud.crud import get_user_by_id
+from utils.token_utils import decode_access_token
 
 
 
@@ -14,20 +16,44 @@ from utils.token_utils import verify_access_token
 # instance of the `OAuth2PasswordBearer` class from the `fastapi.security` module. This instance is
 # used for handling OAuth2 authentication with a password bearer token.
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], session: Annotated[Session, Depends(get_session)]):
+async def get_current_auth_user(token: Annotated[str, Depends(oauth2_scheme)], session: Annotated[AsyncSession, Depends(get_session)]):
     """
-    Retrieves the current user based on the provided token after verifying access.
-    
+    Resolves the authenticated user once per request.
+
+    The user comes from the user lookup cache when possible and is attached to the request's
+    session, so controllers can read and update it without querying for it again.
+
     Args:
         token (Annotated[str, Depends(oauth2_scheme)]): The token used for user verification.
-    
+        session (Annotated[AsyncSession, Depends(get_session)]): The database session of the request.
+
+    Returns:
+        User | None: The authenticated user, or None if the token is invalid, revoked or stale.
+    """
+    if await is_token_revoked(token, session):
+        return None
+    payload = decode_access_token(token)
+    if payload is None:
+        return None
+    user = await get_user_by_id(payload["data"], session, use_replica=False)
+    if user is None:
+        return None
+    # Tokens issued before the user's last password reset or "log out everywhere" are stale
+    if payload.get("ver", 0) != user.token_version:
+        return None
+    return user
+
+
+async def get_current_user(auth_user: Annotated[User | None, Depends(get_current_auth_user)]):
+    """
+    Retrieves the ID of the current user based on the provided token after verifying access.
+
+    Args:
+        auth_user (Annotated[User | None, Depends(get_current_auth_user)]): The authenticated user.
+
     Returns:
-        The current user if the token is valid.
+        The ID of the current user if the token is valid.
     """
-    is_token_blacklisted = get_blacklisted_token(token, session)
-    if is_token_blacklisted is not None:
+    if auth_user is None:
         return None
-    data = verify_access_token(token)
-    return data
-    
-    
\ No newline at end of file
+    return str(auth_user.id)
@@ -1,12 +1,21 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from auth import auth_route
 from users import user_route
+from metrics import metrics_route
 from utils.config_utils import settings
 from sqlmodel import SQLModel
-from utils.db_utils import engine
+from utils.db_utils import engine, read_engines
+from utils.chat_writer_utils import chat_writer
+from utils.email_queue_utils import email_queue
+from utils.outbox_utils import outbox_dispatcher
+from utils.response_cache_utils import response_cache
+from utils.smtp_pool_utils import smtp_pool
+from utils.email_utils import precompile_email_templates
+from utils.blacklist_utils import purge_expired_tokens_periodically, revocation_filter, sync_revocation_filter_periodically
 from starlette.middleware.base import BaseHTTPMiddleware
 from middleware.log_middleware import log_middleware
 
@@ -16,8 +25,31 @@ async def lifespan(app: FastAPI):
     """
     A function that is called on startup. It creates all metadata for the SQLModel using the provided engine.
     """
-    SQLModel.metadata.create_all(engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    if settings.CHAT_WRITE_BEHIND:
+        await chat_writer.start()
+    precompile_email_templates()
+    await email_queue.start()
+    await outbox_dispatcher.start()
+    await revocation_filter.sync()
+    purge_task = asyncio.create_task(purge_expired_tokens_periodically())
+    revocation_sync_task = asyncio.create_task(sync_revocation_filter_periodically())
+    response_cache_purge_task = asyncio.create_task(
+        response_cache.purge_periodically(settings.CHAT_RESPONSE_CACHE_PURGE_INTERVAL)
+    )
     yield
+    purge_task.cancel()
+    revocation_sync_task.cancel()
+    response_cache_purge_task.cancel()
+    if settings.CHAT_WRITE_BEHIND:
+        await chat_writer.stop()
+    await outbox_dispatcher.stop()
+    await email_queue.stop(timeout=settings.EMAIL_QUEUE_SHUTDOWN_TIMEOUT)
+    smtp_pool.close()
+    await engine.dispose()
+    for read_engine in read_engines:
+        await read_engine.dispose()
 
 
 app = FastAPI(
@@ -47,3 +79,5 @@ app.add_middleware(
 app.add_middleware(BaseHTTPMiddleware, dispatch=log_middleware)
 app.include_router(auth_route.router, prefix=settings.API_V1_STR)
 app.include_router(user_route.router, prefix=settings.API_V1_STR)
+if settings.METRICS_TOKEN is not None:
+    app.include_router(metrics_route.router, prefix=settings.API_V1_STR)
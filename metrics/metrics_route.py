@@ -0,0 +1,87 @@
+from fastapi import APIRouter, Depends
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Annotated
+from dependencies.db import get_session
+from dependencies.metrics_deps import verify_metrics_token
+from utils.db_utils import engine, pool_metrics, read_engines, read_pool_metrics, get_pool_stats
+from utils.token_utils import access_token_cache
+import crud.crud as crud
+from utils.email_queue_utils import email_queue, recent_emails
+from utils.smtp_pool_utils import smtp_pool
+from utils.outbox_utils import outbox_dispatcher
+from utils.response_cache_utils import response_cache
+from users.controller import chat_flights
+from utils.llm_gateway_utils import llm_gateway
+
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"], dependencies=[Depends(verify_metrics_token)])
+
+
+@router.get("/db-pool")
+async def db_pool_stats():
+    """
+    Get the connection pool statistics of the primary and read replica engines.
+
+    Returns:
+        dict: The pool size, checked out and idle connections, overflow and checkout wait times per engine.
+    """
+    return {
+        "primary": get_pool_stats(engine, pool_metrics),
+        "replicas": [get_pool_stats(read_engine, metrics) for read_engine, metrics in zip(read_engines, read_pool_metrics)],
+    }
+
+
+@router.get("/caches")
+async def cache_stats():
+    """
+    Get the size and hit, miss and eviction counts of the caches.
+
+    Returns:
+        dict: The statistics of each cache, keyed by cache name.
+    """
+    return {
+        "access_tokens": access_token_cache.stats(),
+        # Read through the module so a backend swapped in at runtime is reported
+        "users": crud.user_cache.stats(),
+        "recent_emails": recent_emails.stats(),
+        "chat_responses": response_cache.stats(),
+    }
+
+
+@router.get("/email-queue")
+async def email_queue_stats():
+    """
+    Get the depth of the outbound email queue, its delivery counts and the SMTP connection pool.
+
+    Returns:
+        dict: The worker count, queued and retrying messages, sent and failed attempts, dead letters
+            and the idle, opened and reused SMTP connections.
+    """
+    return {**email_queue.stats(), "smtp_pool": smtp_pool.stats()}
+
+
+@router.get("/email-outbox")
+async def email_outbox_stats(session: Annotated[AsyncSession, Depends(get_session)]):
+    """
+    Get the number of undelivered outbox emails and the dispatcher's delivery counts.
+
+    Args:
+        session (AsyncSession): The database session to execute the query.
+
+    Returns:
+        dict: The pending emails and the delivered, failed and dead counts.
+    """
+    pending = await crud.count_pending_outbox_emails(session)
+    return {"pending": pending, **outbox_dispatcher.stats()}
+
+
+@router.get("/llm")
+async def llm_stats():
+    """
+    Get the statistics of the calls made to the language model.
+
+    Returns:
+        dict: The model calls made, the requests that shared another request's call and the calls in progress,
+            and the gateway's running and queued calls, rejections and queue wait times.
+    """
+    return {"single_flight": chat_flights.stats(), "gateway": llm_gateway.stats()}
@@ -0,0 +1,78 @@
+"""Hash blacklisted tokens and record their expiry
+
+Revision ID: 3c1f0a9d5e7b
+Revises: e92b6e67d0c2
+Create Date: 2026-10-17 10:02:19.574310
+
+"""
+from typing import Sequence, Union
+import hashlib
+from datetime import datetime, timedelta
+
+from alembic import op
+import jwt
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1f0a9d5e7b'
+down_revision: Union[str, None] = 'e92b6e67d0c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def token_expiry(token: str) -> datetime:
+    try:
+        return datetime.fromtimestamp(jwt.decode(token, options={"verify_signature": False})["exp"])
+    except Exception:
+        return datetime.now() + timedelta(days=180)
+
+
+def blacklist_columns() -> set[str]:
+    # Only tables that still store raw tokens in a "token" column are converted
+    inspector = sa.inspect(op.get_bind())
+    if 'blacklistedtokens' not in inspector.get_table_names():
+        return set()
+    return {column['name'] for column in inspector.get_columns('blacklistedtokens')}
+
+
+def upgrade() -> None:
+    if 'token' not in blacklist_columns():
+        return
+    with op.batch_alter_table('blacklistedtokens') as batch_op:
+        batch_op.add_column(sa.Column('token_hash', sqlmodel.sql.sqltypes.AutoString(length=64), nullable=True))
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+
+    bind = op.get_bind()
+    seen = set()
+    for id, token in bind.execute(sa.text('SELECT id, token FROM blacklistedtokens')).fetchall():
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        if token_hash in seen:
+            bind.execute(sa.text('DELETE FROM blacklistedtokens WHERE id = :id'), {'id': id})
+            continue
+        seen.add(token_hash)
+        bind.execute(
+            sa.text('UPDATE blacklistedtokens SET token_hash = :token_hash, expires_at = :expires_at WHERE id = :id'),
+            {'token_hash': token_hash, 'expires_at': token_expiry(token), 'id': id},
+        )
+
+    with op.batch_alter_table('blacklistedtokens') as batch_op:
+        batch_op.alter_column('token_hash', existing_type=sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False)
+        batch_op.alter_column('expires_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.drop_column('token')
+        batch_op.create_index(batch_op.f('ix_blacklistedtokens_token_hash'), ['token_hash'], unique=True)
+        batch_op.create_index(batch_op.f('ix_blacklistedtokens_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    # Digests cannot be turned back into tokens, so revocations are dropped.
+    if 'token_hash' not in blacklist_columns():
+        return
+    op.execute('DELETE FROM blacklistedtokens')
+    with op.batch_alter_table('blacklistedtokens') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_blacklistedtokens_expires_at'))
+        batch_op.drop_index(batch_op.f('ix_blacklistedtokens_token_hash'))
+        batch_op.drop_column('expires_at')
+        batch_op.drop_column('token_hash')
+        batch_op.add_column(sa.Column('token', sqlmodel.sql.sqltypes.AutoString(), nullable=False))
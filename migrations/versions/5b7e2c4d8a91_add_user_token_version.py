@@ -0,0 +1,41 @@
+"""Add user token_version
+
+Revision ID: 5b7e2c4d8a91
+Revises: 3c1f0a9d5e7b
+Create Date: 2026-10-17 14:05:12.518930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e2c4d8a91'
+down_revision: Union[str, None] = '3c1f0a9d5e7b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Existing users start at version 0, which is what tokens without a "ver" claim are checked against
+def token_version_state() -> tuple[bool, bool]:
+    inspector = sa.inspect(op.get_bind())
+    if 'user' not in inspector.get_table_names():
+        return False, False
+    columns = {column['name'] for column in inspector.get_columns('user')}
+    return True, 'token_version' in columns
+
+
+def upgrade() -> None:
+    table_exists, column_exists = token_version_state()
+    if table_exists and not column_exists:
+        op.add_column('user', sa.Column('token_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    _, column_exists = token_version_state()
+    if column_exists:
+        with op.batch_alter_table('user') as batch_op:
+            batch_op.drop_column('token_version')
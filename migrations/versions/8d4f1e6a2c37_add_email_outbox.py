@@ -0,0 +1,56 @@
+"""Add email outbox
+
+Revision ID: 8d4f1e6a2c37
+Revises: 5b7e2c4d8a91
+Create Date: 2026-10-17 16:41:03.207415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d4f1e6a2c37'
+down_revision: Union[str, None] = '5b7e2c4d8a91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def outbox_exists() -> bool:
+    return 'emailoutbox' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade() -> None:
+    if outbox_exists():
+        return
+    op.create_table(
+        'emailoutbox',
+        sa.Column('id', sqlmodel.sql.sqltypes.GUID(), nullable=False),
+        sa.Column('email_to', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('subject', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('html_content', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('status', sqlmodel.sql.sqltypes.AutoString(length=16), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('claim_id', sqlmodel.sql.sqltypes.GUID(), nullable=True),
+        sa.Column('claimed_until', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('delivered_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_emailoutbox_id'), 'emailoutbox', ['id'], unique=False)
+    op.create_index(op.f('ix_emailoutbox_claim_id'), 'emailoutbox', ['claim_id'], unique=False)
+    op.create_index('ix_emailoutbox_status_next_attempt_at', 'emailoutbox', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    if not outbox_exists():
+        return
+    op.drop_index('ix_emailoutbox_status_next_attempt_at', table_name='emailoutbox')
+    op.drop_index(op.f('ix_emailoutbox_claim_id'), table_name='emailoutbox')
+    op.drop_index(op.f('ix_emailoutbox_id'), table_name='emailoutbox')
+    op.drop_table('emailoutbox')
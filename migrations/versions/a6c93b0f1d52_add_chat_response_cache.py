@@ -0,0 +1,48 @@
+"""Add chat response cache
+
+Revision ID: a6c93b0f1d52
+Revises: 8d4f1e6a2c37
+Create Date: 2026-10-17 18:22:47.930164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6c93b0f1d52'
+down_revision: Union[str, None] = '8d4f1e6a2c37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def cache_exists() -> bool:
+    return 'chatresponsecache' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade() -> None:
+    if cache_exists():
+        return
+    op.create_table(
+        'chatresponsecache',
+        sa.Column('key', sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False),
+        sa.Column('model', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('reply', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('last_used_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('key'),
+    )
+    op.create_index(op.f('ix_chatresponsecache_last_used_at'), 'chatresponsecache', ['last_used_at'], unique=False)
+    op.create_index(op.f('ix_chatresponsecache_expires_at'), 'chatresponsecache', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    if not cache_exists():
+        return
+    op.drop_index(op.f('ix_chatresponsecache_expires_at'), table_name='chatresponsecache')
+    op.drop_index(op.f('ix_chatresponsecache_last_used_at'), table_name='chatresponsecache')
+    op.drop_table('chatresponsecache')
@@ -0,0 +1,40 @@
+"""Add chats user_id created_at index
+
+Revision ID: e92b6e67d0c2
+Revises: 81e8993df55d
+Create Date: 2026-10-17 09:12:44.381205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e92b6e67d0c2'
+down_revision: Union[str, None] = '81e8993df55d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Serves the chat history pages, which filter on user_id and order by created_at
+def chats_index_state() -> tuple[bool, bool]:
+    inspector = sa.inspect(op.get_bind())
+    if 'chats' not in inspector.get_table_names():
+        return False, False
+    indexes = {index['name'] for index in inspector.get_indexes('chats')}
+    return True, 'ix_chats_user_id_created_at' in indexes
+
+
+def upgrade() -> None:
+    table_exists, index_exists = chats_index_state()
+    if table_exists and not index_exists:
+        op.create_index('ix_chats_user_id_created_at', 'chats', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    _, index_exists = chats_index_state()
+    if index_exists:
+        op.drop_index('ix_chats_user_id_created_at', table_name='chats')
@@ -0,0 +1,187 @@
+"""
+Shared fixtures for the test suite.
+
+The settings, engines and caches are built when utils is first imported, so the
+environment is filled in here before anything from the app is imported: a SQLite
+database in a temporary directory, the fake model provider and cheap password hashes.
+The app runs in-process through httpx.ASGITransport on one event loop for the session.
+"""
+import asyncio
+import os
+import tempfile
+from uuid import uuid4
+
+import pytest
+
+directory = tempfile.mkdtemp(prefix="eat-right-tests-")
+# The app logs to data-log/ under the working directory
+os.chdir(directory)
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{directory}/test.sqlite"
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["LLM_FAKE_LATENCY"] = "0"
+os.environ["METRICS_TOKEN"] = "test"
+os.environ["BCRYPT_ROUNDS"] = "4"
+# Background rounds would show up in the query counts, so they are left to the tests to run
+os.environ["REVOCATION_SYNC_INTERVAL"] = "3600"
+for name in (
+    "ACCESS_TOKEN_SECRET_KEY",
+    "PASSWORD_RESET_TOKEN_SECRET_KEY",
+    "VERIFY_EMAIL_TOKEN_SECRET_KEY",
+    "OPENAI_API_KEY",
+    "SMTP_PASS",
+):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("EMAILS_FROM_MAIL", "tests@example.com")
+os.environ.setdefault("ORIGINS", '["*"]')
+
+import socket
+
+import httpx
+from aiosmtpd.controller import Controller
+from sqlalchemy import event
+
+
+@pytest.fixture(scope="session")
+def run():
+    """
+    Run a coroutine on the event loop shared by the whole session.
+    """
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def sent_emails() -> list[dict]:
+    """
+    Emails the app tried to send, collected instead of going out over SMTP.
+    """
+    return []
+
+
+@pytest.fixture(scope="session")
+def app(run, sent_emails):
+    """
+    The app with its lifespan running and outbound email captured in sent_emails.
+
+    The outbox dispatcher is stopped once started, so registration emails stay in
+    the outbox until a test calls outbox_dispatcher.dispatch().
+    """
+    from utils.email_queue_utils import email_queue
+    from utils.outbox_utils import outbox_dispatcher
+    import main
+
+    def send(email_to: str, subject: str, html_content: str) -> dict:
+        sent_emails.append({"email_to": email_to, "subject": subject})
+        return {"success": "Email successfully sent"}
+
+    email_queue.sender = send
+    email_queue.batch_sender = lambda emails: [send(**email) for email in emails]
+    outbox_dispatcher.sender = email_queue.batch_sender
+
+    lifespan = main.lifespan(main.app)
+    run(lifespan.__aenter__())
+    run(outbox_dispatcher.stop())
+    yield main.app
+    run(lifespan.__aexit__(None, None, None))
+
+
+@pytest.fixture(scope="session")
+def client(run, app):
+    """
+    An HTTP client that calls the app in-process.
+    """
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+    yield client
+    run(client.aclose())
+
+
+@pytest.fixture
+def new_user() -> dict:
+    """
+    Registration details of a user no other test uses.
+
+    Usernames are built from the names and a number below 1000, so the last name is
+    made unique too; names only allow letters.
+    """
+    name = uuid4().hex[:12].translate(str.maketrans("0123456789", "ghijklmnop"))
+    return {"first_name": "Test", "last_name": name, "email": f"{name}@example.com", "password": "Password123$"}
+
+
+@pytest.fixture
+def auth_headers(run, client, new_user) -> dict:
+    """
+    Register a new user, log them in and return the headers that authenticate as them.
+    """
+
+    async def register_and_log_in():
+        await client.post("/api/v1/auth/register", json=new_user)
+        credentials = {"email": new_user["email"], "password": new_user["password"]}
+        response = await client.post("/api/v1/auth/login", json=credentials)
+        return response.json()["detail"]["Access_token"]
+
+    return {"Authorization": f"Bearer {run(register_and_log_in())}"}
+
+
+@pytest.fixture
+def queries():
+    """
+    Record the SQL statements run on the primary database while the test is running.
+    """
+    from utils.db_utils import engine
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+class SMTPHandler:
+    """
+    A local SMTP server's handler that keeps what it accepts.
+
+    Recipients in refused are rejected for good, and a recipient in failures gets
+    that many temporary errors before its message is accepted.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.refused: set[str] = set()
+        self.failures: dict[str, int] = {}
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refused:
+            return "550 5.1.1 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        for address in envelope.rcpt_tos:
+            if self.failures.get(address, 0) > 0:
+                self.failures[address] -= 1
+                return "451 4.3.0 Try again later"
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+    def recipients(self) -> list[str]:
+        return [address for envelope in self.messages for address in envelope.rcpt_tos]
+
+
+@pytest.fixture
+def smtp_server():
+    """
+    A plaintext SMTP server on localhost, yielding its handler with the port it listens on.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    handler = SMTPHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    handler.port = port
+    yield handler
+    controller.stop()
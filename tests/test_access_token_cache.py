@@ -0,0 +1,42 @@
+"""
+The verified access token cache: logout evicts a token and expired tokens are never served from it.
+"""
+import asyncio
+import time
+
+import jwt
+
+from utils.config_utils import settings
+from utils.token_utils import access_token_cache, decode_access_token
+
+
+def bearer(auth_headers: dict) -> str:
+    return auth_headers["Authorization"].removeprefix("Bearer ")
+
+
+def test_logout_evicts_the_cached_token(run, client, auth_headers):
+    assert run(client.get("/api/v1/users/me/profile", headers=auth_headers)).status_code == 200
+    assert bearer(auth_headers) in access_token_cache.entries
+
+    response = run(client.post("/api/v1/auth/logout", headers=auth_headers))
+    assert response.status_code == 200
+    assert bearer(auth_headers) not in access_token_cache.entries
+
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 401
+
+
+def test_expired_token_is_not_served_from_the_cache(run, client, auth_headers):
+    # The same claims as the logged in token, expiring in about a second
+    claims = jwt.decode(bearer(auth_headers), settings.ACCESS_TOKEN_SECRET_KEY, algorithms=[settings.ALGORITHM])
+    claims["exp"] = int(time.time()) + 1
+    token = jwt.encode(claims, settings.ACCESS_TOKEN_SECRET_KEY, algorithm=settings.ALGORITHM)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert run(client.get("/api/v1/users/me/profile", headers=headers)).status_code == 200
+    assert token in access_token_cache.entries
+
+    run(asyncio.sleep(claims["exp"] - time.time() + 0.05))
+    assert decode_access_token(token) is None
+    assert token not in access_token_cache.entries
+    assert run(client.get("/api/v1/users/me/profile", headers=headers)).status_code == 401
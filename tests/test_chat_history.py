@@ -0,0 +1,125 @@
+"""
+Keyset pagination of the chat history: stable pages, ties on created_at and malformed cursors.
+"""
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from users.dbschema import Chats
+from utils.db_utils import async_session
+from utils.pagination_utils import encode_cursor
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def user_id(run, client, auth_headers) -> str:
+    return run(client.get("/api/v1/users/me/profile", headers=auth_headers)).json()["id"]
+
+
+def add_chats(run, id: str, *messages: tuple[str, datetime]):
+    async def add():
+        async with async_session() as session:
+            session.add_all(
+                [Chats(user_id=id, message=message, sender="user", created_at=created_at) for message, created_at in messages]
+            )
+            await session.commit()
+
+    run(add())
+
+
+def cursor_of(chat: dict) -> str:
+    return encode_cursor(datetime.fromisoformat(chat["created_at"]), UUID(chat["id"]))
+
+
+def read_pages(run, client, auth_headers, limit: int, between_pages=None, **params) -> list[list[dict]]:
+    """
+    Follow next_cursor through the history, returning the pages in the order they were read.
+    """
+    pages = []
+    while True:
+        response = run(
+            client.get("/api/v1/users/me/chat_history", headers=auth_headers, params={"limit": limit, **params})
+        )
+        assert response.status_code == 200
+        page = response.json()
+        pages.append(page["details"])
+        if page["next_cursor"] is None:
+            return pages
+        params = {page["next_cursor_param"]: page["next_cursor"]}
+        if between_pages is not None:
+            between_pages()
+
+
+def messages(pages: list[list[dict]]) -> list[str]:
+    return [chat["message"] for page in pages for chat in page]
+
+
+def test_next_cursor_names_the_parameter_it_is_for(run, client, auth_headers):
+    id = user_id(run, client, auth_headers)
+    add_chats(run, id, *((f"message {number}", START + timedelta(minutes=number)) for number in range(3)))
+
+    page = run(client.get("/api/v1/users/me/chat_history", headers=auth_headers, params={"limit": 2})).json()
+    assert page["next_cursor_param"] == "after"
+
+    newest = page["details"][-1]
+    page = run(
+        client.get("/api/v1/users/me/chat_history", headers=auth_headers, params={"limit": 1, "before": cursor_of(newest)})
+    ).json()
+    assert [chat["message"] for chat in page["details"]] == ["message 0"]
+    assert (page["next_cursor"], page["next_cursor_param"]) == (None, None)
+
+
+def test_pages_are_stable_while_messages_are_added(run, client, auth_headers):
+    id = user_id(run, client, auth_headers)
+    add_chats(run, id, *((f"message {number}", START + timedelta(minutes=number)) for number in range(6)))
+    added = []
+
+    def add_older_and_newer_messages():
+        number = len(added)
+        added.append(number)
+        add_chats(
+            run,
+            id,
+            (f"older {number}", START - timedelta(minutes=number + 1)),
+            (f"newer {number}", START + timedelta(hours=1, minutes=number)),
+        )
+
+    # Reading forward, rows added behind the cursor are not seen and nothing is read twice
+    forward = messages(read_pages(run, client, auth_headers, limit=2, between_pages=add_older_and_newer_messages))
+    assert forward[:6] == [f"message {number}" for number in range(6)]
+    assert forward[6:] == [f"newer {number}" for number in range(len(added))]
+
+    # Paging back from a message, the newer rows arriving meanwhile do not shift the pages
+    just_after_message_5 = encode_cursor(START + timedelta(minutes=5), UUID(int=(1 << 128) - 1))
+    pages = read_pages(
+        run, client, auth_headers, limit=2, between_pages=add_older_and_newer_messages, before=just_after_message_5
+    )
+    backward = messages(reversed(pages))
+    assert backward[-6:] == [f"message {number}" for number in range(6)]
+    assert len(backward) == len(set(backward))
+    assert not any(message.startswith("newer") for message in backward)
+
+
+def test_equal_created_at_is_broken_by_id(run, client, auth_headers):
+    id = user_id(run, client, auth_headers)
+    add_chats(run, id, *((f"message {number}", START) for number in range(5)))
+
+    forward_pages = read_pages(run, client, auth_headers, limit=2)
+    forward = [chat["id"] for page in forward_pages for chat in page]
+    assert forward == sorted(forward)
+    assert len(set(forward)) == 5
+
+    # Paging back from the last message reads the others in the same order, none repeated or skipped
+    last = forward_pages[-1][-1]
+    backward_pages = read_pages(run, client, auth_headers, limit=2, before=cursor_of(last))
+    assert [chat["id"] for page in reversed(backward_pages) for chat in page] == forward[:-1]
+
+
+def test_malformed_cursor_is_rejected(run, client, auth_headers):
+    for params, error in (
+        ({"before": "not-a-cursor"}, "Invalid cursor."),
+        ({"after": "%%%"}, "Invalid cursor."),
+        ({"before": "YQ", "after": "YQ"}, "Use either before or after, not both."),
+    ):
+        response = run(client.get("/api/v1/users/me/chat_history", headers=auth_headers, params=params))
+        assert response.status_code == 400
+        assert response.json() == {"error": error}
@@ -0,0 +1,115 @@
+"""
+Chat replies streamed as Server-Sent Events: the frames sent, the turn saved afterwards and
+the model slot given back when the client goes away.
+"""
+import asyncio
+import json
+
+import pytest
+from sqlmodel import select
+
+from users.dbschema import Chats
+from utils.db_utils import async_session
+from utils.llm_gateway_utils import llm_gateway
+from utils.llm_utils import llm_provider
+
+
+def parse_events(body: str) -> list[tuple[str, dict]]:
+    """
+    Split an SSE body into (event, data) pairs; frames without an event line are "message".
+    """
+    events = []
+    for frame in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines())
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+async def saved_chats(user_id: str) -> list[tuple[str, str]]:
+    async with async_session() as session:
+        statement = select(Chats).where(Chats.user_id == user_id).order_by(Chats.created_at)
+        return [(chat.sender, chat.message) for chat in (await session.exec(statement)).all()]
+
+
+@pytest.fixture
+def slow_model(monkeypatch):
+    """
+    Make the fake model take a while over each reply, so a stream can be interrupted midway.
+    """
+    monkeypatch.setattr(llm_provider, "tokens_per_second", 20)
+
+
+def test_stream_sends_deltas_then_done_and_saves_the_turn(run, client, auth_headers):
+    user_id = run(client.get("/api/v1/users/me/profile", headers=auth_headers)).json()["id"]
+
+    response = run(
+        client.post("/api/v1/users/me/chat", headers=auth_headers, params={"stream": "true"}, json={"query": "Lunch?"})
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = parse_events(response.text)
+    assert events[-1] == ("done", {})
+    deltas = events[:-1]
+    assert len(deltas) > 1
+    assert {event for event, _ in deltas} == {"message"}
+    reply = "".join(data["delta"] for _, data in deltas)
+    assert reply.strip()
+
+    assert run(saved_chats(user_id)) == [("user", "Lunch?"), ("model", reply)]
+
+
+def test_client_disconnect_releases_the_model_slot(run, app, client, auth_headers, slow_model):
+    user_id = run(client.get("/api/v1/users/me/profile", headers=auth_headers)).json()["id"]
+    free_slots = llm_gateway.semaphore._value
+    received = []
+    active_while_streaming = []
+    disconnected = asyncio.Event()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": json.dumps({"query": "Dinner?"}).encode(), "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            received.append(message["body"])
+            active_while_streaming.append(llm_gateway.active)
+            # The client goes away after the first piece of the reply
+            disconnected.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "server": ("test", 80),
+        "client": ("127.0.0.1", 50000),
+        "root_path": "",
+        "path": "/api/v1/users/me/chat",
+        "raw_path": b"/api/v1/users/me/chat",
+        "query_string": b"stream=true",
+        "headers": [
+            (b"host", b"test"),
+            (b"content-type", b"application/json"),
+            (b"authorization", auth_headers["Authorization"].encode()),
+        ],
+    }
+
+    async def scenario():
+        await asyncio.wait_for(app(scope, receive, send), timeout=5)
+        # Give a cancelled stream the chance to unwind
+        await asyncio.sleep(0.1)
+
+    run(scenario())
+    assert active_while_streaming[0] == 1
+    assert not any(b"event: done" in body for body in received)
+    assert llm_gateway.active == 0
+    assert llm_gateway.semaphore._value == free_slots
+    # An abandoned stream is not saved
+    assert run(saved_chats(user_id)) == []
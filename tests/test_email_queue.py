@@ -0,0 +1,177 @@
+"""
+Background email delivery: retries with backoff, the dead-letter list and batching,
+with in-process senders and through a local SMTP server.
+"""
+import asyncio
+
+import pytest
+
+import utils.email_utils as email_utils
+from utils.email_queue_utils import EmailQueue
+from utils.email_utils import send_mail, send_mail_batch
+from utils.retry_utils import RetryPolicy
+from utils.smtp_pool_utils import SMTPConnectionPool
+
+
+class FlakySender:
+    """
+    A sender that fails the first `failures` attempts for each recipient, or every
+    attempt for recipients in `down`.
+    """
+
+    def __init__(self, failures: int = 0, down: tuple[str, ...] = ()):
+        self.failures = failures
+        self.down = down
+        self.attempts: list[str] = []
+
+    def __call__(self, email_to: str, subject: str, html_content: str) -> dict:
+        self.attempts.append(email_to)
+        if email_to in self.down or self.attempts.count(email_to) <= self.failures:
+            return {"error": Exception("421 Service not available, try again later")}
+        return {"success": "Email successfully sent"}
+
+
+def build_queue(sender, retry_delay: float = 0.01, **options) -> EmailQueue:
+    settings = {
+        "workers": 2,
+        "queue_size": 10,
+        "retry": RetryPolicy(max_attempts=3, base_delay=retry_delay, max_delay=retry_delay * 5),
+        "dead_letter_size": 10,
+    }
+    return EmailQueue(sender, **{**settings, **options})
+
+
+async def wait_for(condition, timeout: float = 2):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def local_smtp(smtp_server, monkeypatch):
+    """
+    Send the app's email to the local SMTP server, over a plaintext pooled connection.
+    """
+    pool = SMTPConnectionPool(
+        host="127.0.0.1",
+        port=smtp_server.port,
+        transport="plain",
+        username="",
+        password="",
+        size=2,
+        idle_timeout=60,
+        noop_after=10,
+        max_messages=100,
+        timeout=5,
+    )
+    monkeypatch.setattr(email_utils, "smtp_pool", pool)
+    yield smtp_server
+    pool.close()
+
+
+def test_failed_sends_are_retried_until_delivered(run):
+    sender = FlakySender(failures=2)
+    queue = build_queue(sender)
+
+    async def scenario():
+        await queue.start()
+        assert queue.submit("a@example.com", "Subject", "<p>Hi</p>") == {"success": "Email queued for delivery"}
+        await wait_for(lambda: queue.sent == 1)
+        await queue.stop(timeout=1)
+
+    run(scenario())
+    assert sender.attempts == ["a@example.com"] * 3
+    assert queue.stats()["failed_attempts"] == 2
+    assert not queue.dead_letters
+
+
+def test_exhausted_sends_go_to_the_dead_letter_list(run):
+    queue = build_queue(FlakySender(down=("down@example.com",)))
+
+    async def scenario():
+        await queue.start()
+        queue.submit("down@example.com", "Subject", "<p>Hi</p>")
+        queue.submit("up@example.com", "Subject", "<p>Hi</p>")
+        await wait_for(lambda: len(queue.dead_letters) == 1)
+        await queue.stop(timeout=1)
+
+    run(scenario())
+    dead_letter = queue.dead_letters[0]
+    assert dead_letter["email_to"] == "down@example.com"
+    assert dead_letter["attempts"] == 3
+    assert "421" in dead_letter["error"]
+    assert queue.sent == 1
+
+
+def test_submit_fails_fast_when_not_running_or_full(run):
+    queue = build_queue(FlakySender(), workers=1, queue_size=1)
+    assert "error" in queue.submit("a@example.com", "Subject", "<p>Hi</p>")
+
+    async def scenario():
+        await queue.start()
+        # The worker cannot take a message until this coroutine yields
+        first = queue.submit("a@example.com", "Subject", "<p>Hi</p>")
+        second = queue.submit("b@example.com", "Subject", "<p>Hi</p>")
+        await queue.stop(timeout=1)
+        return first, second
+
+    first, second = run(scenario())
+    assert first == {"success": "Email queued for delivery"}
+    assert second == {"error": "Email queue is full, try again later"}
+
+
+def test_stop_dead_letters_pending_retries(run):
+    queue = build_queue(FlakySender(down=("down@example.com",)), retry_delay=60)
+
+    async def scenario():
+        await queue.start()
+        queue.submit("down@example.com", "Subject", "<p>Hi</p>")
+        await wait_for(lambda: queue.stats()["waiting_retry"] == 1)
+        await queue.stop(timeout=1)
+
+    run(scenario())
+    assert [letter["attempts"] for letter in queue.dead_letters] == [1]
+
+
+def test_queued_messages_are_sent_in_batches(run):
+    batches = []
+
+    def batch_sender(emails: list[dict]) -> list[dict]:
+        batches.append([email["email_to"] for email in emails])
+        return [{"success": "Email successfully sent"} for _ in emails]
+
+    queue = build_queue(FlakySender(), workers=1, batch_sender=batch_sender, batch_size=5)
+
+    async def scenario():
+        await queue.start()
+        for number in range(5):
+            queue.submit(f"{number}@example.com", "Subject", "<p>Hi</p>")
+        await wait_for(lambda: queue.sent == 5)
+        await queue.stop(timeout=1)
+
+    run(scenario())
+    assert batches == [[f"{number}@example.com" for number in range(5)]]
+
+
+def test_queue_delivers_through_a_local_smtp_server(run, local_smtp):
+    local_smtp.failures["later@example.com"] = 2
+    local_smtp.refused.add("nobody@example.com")
+    queue = build_queue(send_mail, batch_sender=send_mail_batch, batch_size=5)
+
+    async def scenario():
+        await queue.start()
+        for email_to in ("now@example.com", "later@example.com", "nobody@example.com"):
+            queue.submit(email_to, "Subject", "<p>Hi</p>")
+        await wait_for(lambda: queue.sent == 2 and len(queue.dead_letters) == 1)
+        await queue.stop(timeout=1)
+
+    run(scenario())
+    assert sorted(local_smtp.recipients()) == ["later@example.com", "now@example.com"]
+    # Each failed attempt is one SMTP error, not a session dropped and retried
+    assert queue.stats()["failed_attempts"] == 2 + 3
+    dead_letter = queue.dead_letters[0]
+    assert dead_letter["email_to"] == "nobody@example.com"
+    assert dead_letter["attempts"] == 3
+    assert "550" in dead_letter["error"]
+
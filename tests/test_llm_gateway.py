@@ -0,0 +1,156 @@
+"""
+Admission control of model calls: a full queue, the queue deadline, the provider's
+rate limits and how the chat route answers when the model is too busy.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+import utils.llm_utils as llm_utils
+from utils.llm_gateway_utils import LLMBusyError, LLMGateway, llm_gateway
+from utils.llm_utils import OpenAIProvider
+
+
+def build_gateway(**options) -> LLMGateway:
+    settings = {"max_concurrency": 1, "queue_size": 1, "queue_timeout": 1, "retry_after": 3}
+    return LLMGateway(**{**settings, **options})
+
+
+def rate_limit_error(retry_after: str) -> RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def chunk(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+def stub_provider(create) -> OpenAIProvider:
+    """
+    An OpenAI provider whose API calls are answered by create(**request).
+    """
+    provider = OpenAIProvider(api_key="test", model="gpt-test", timeout=1)
+    provider.client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(with_raw_response=SimpleNamespace(create=create)))
+    )
+    return provider
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    """
+    The app's gateway with no backoff and no rate limits counted, restored afterwards.
+    """
+    monkeypatch.setattr(llm_gateway, "blocked_until", 0.0)
+    monkeypatch.setattr(llm_gateway, "rate_limited", 0)
+    return llm_gateway
+
+
+async def hold_slot(gateway: LLMGateway, release: asyncio.Event):
+    async with gateway.slot():
+        await release.wait()
+
+
+def test_call_arriving_to_a_full_queue_is_rejected_at_once(run):
+    gateway = build_gateway()
+
+    async def scenario():
+        release = asyncio.Event()
+        running = asyncio.ensure_future(hold_slot(gateway, release))
+        queued = asyncio.ensure_future(hold_slot(gateway, release))
+        await asyncio.sleep(0.01)
+        assert (gateway.active, gateway.waiting) == (1, 1)
+
+        started = time.monotonic()
+        with pytest.raises(LLMBusyError) as busy:
+            async with gateway.slot():
+                pass
+        assert time.monotonic() - started < 0.1
+        release.set()
+        await asyncio.gather(running, queued)
+        return busy.value
+
+    busy = run(scenario())
+    assert busy.retry_after == 3
+    assert gateway.stats()["rejected"] == 1
+    assert gateway.stats()["admitted"] == 2
+
+
+def test_queued_call_gives_up_at_the_deadline(run):
+    gateway = build_gateway(queue_timeout=0.05)
+
+    async def scenario():
+        release = asyncio.Event()
+        running = asyncio.ensure_future(hold_slot(gateway, release))
+        await asyncio.sleep(0.01)
+        with pytest.raises(LLMBusyError):
+            async with gateway.slot():
+                pass
+        release.set()
+        await running
+
+    run(scenario())
+    assert gateway.stats()["timeouts"] == 1
+    assert gateway.waiting == 0
+    assert gateway.semaphore._value == 1
+
+
+def test_upstream_retry_after_holds_back_new_calls(run, monkeypatch):
+    gateway = build_gateway()
+    monkeypatch.setattr(llm_utils, "llm_gateway", gateway)
+
+    async def create(**request):
+        raise rate_limit_error("30")
+
+    with pytest.raises(LLMBusyError) as busy:
+        run(stub_provider(create).complete([{"role": "user", "content": "Lunch?"}]))
+    assert busy.value.retry_after == 30
+    assert gateway.stats()["rate_limited"] == 1
+    # The wait is longer than the queue timeout, so the next call is turned away without queueing
+    with pytest.raises(LLMBusyError) as busy:
+        gateway.check()
+    assert 29 < busy.value.retry_after <= 30
+
+
+def test_busy_model_is_answered_with_429_and_retry_after(run, client, auth_headers, gateway):
+    gateway.blocked_until = time.monotonic() + 29.5
+
+    for params in ({}, {"stream": "true"}):
+        response = run(client.post("/api/v1/users/me/chat", headers=auth_headers, params=params, json={"query": "Lunch?"}))
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "30"
+        assert response.json()["error"] == "The assistant is busy, please try again later."
+
+
+def test_rate_limit_in_the_middle_of_a_stream_is_throttled(run, client, auth_headers, gateway, monkeypatch):
+    class RawResponse:
+        headers = httpx.Headers()
+
+        def parse(self):
+            async def chunks():
+                yield chunk("Rice ")
+                raise rate_limit_error("12")
+
+            return chunks()
+
+    async def create(**request):
+        return RawResponse()
+
+    monkeypatch.setattr(llm_utils, "llm_provider", stub_provider(create))
+
+    response = run(
+        client.post("/api/v1/users/me/chat", headers=auth_headers, params={"stream": "true"}, json={"query": "Lunch?"})
+    )
+    assert response.status_code == 200
+    frames = response.text.strip().split("\n\n")
+    assert frames[0] == 'data: {"delta": "Rice "}'
+    assert frames[-1] == (
+        'event: error\ndata: {"error": "The assistant is busy, please try again later.", "retry_after": 12.0}'
+    )
+    assert gateway.stats()["rate_limited"] == 1
+    assert gateway.backoff_remaining() > 11
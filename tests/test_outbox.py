@@ -0,0 +1,160 @@
+"""
+The email outbox: claims and their leases, the dispatcher's retries and the dead state,
+and the transactional emails that are written to it.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import delete, select
+
+from auth.dbschema import EmailOutbox
+from crud.crud import claim_outbox_emails, release_outbox_email, renew_outbox_claim
+from utils.db_utils import async_session
+from utils.email_queue_utils import recent_emails
+from utils.outbox_utils import OutboxDispatcher, outbox_dispatcher, outbox_email
+from utils.retry_utils import RetryPolicy
+
+
+@pytest.fixture
+def outbox(run, app):
+    """
+    Empty the outbox, returning a function that adds pending emails to it.
+    """
+
+    async def empty():
+        async with async_session() as session:
+            await session.exec(delete(EmailOutbox))
+            await session.commit()
+
+    async def add(*recipients: str):
+        async with async_session() as session:
+            session.add_all([outbox_email(email_to, "Subject", "<p>Hi</p>") for email_to in recipients])
+            await session.commit()
+
+    run(empty())
+    yield add
+    run(empty())
+
+
+async def claim(batch_size: int = 10, lease: float = 60) -> list[EmailOutbox]:
+    async with async_session() as session:
+        return await claim_outbox_emails(session, batch_size, lease)
+
+
+async def outbox_rows() -> dict[str, EmailOutbox]:
+    async with async_session() as session:
+        return {email.email_to: email for email in (await session.exec(select(EmailOutbox))).all()}
+
+
+def build_dispatcher(sender, max_attempts: int = 3) -> OutboxDispatcher:
+    return OutboxDispatcher(
+        sender=sender,
+        batch_size=10,
+        interval=60,
+        lease=60,
+        retry=RetryPolicy(max_attempts=max_attempts, base_delay=0, max_delay=0),
+    )
+
+
+def test_claimed_emails_are_not_claimed_again_during_the_lease(run, outbox):
+    run(outbox("a@example.com", "b@example.com"))
+
+    emails = run(claim())
+    assert sorted(email.email_to for email in emails) == ["a@example.com", "b@example.com"]
+    assert len({email.claim_id for email in emails}) == 1
+    assert all(email.claimed_until > datetime.now() for email in emails)
+    assert run(claim()) == []
+
+
+def test_expired_lease_is_claimed_again(run, outbox):
+    run(outbox("a@example.com"))
+    first = run(claim(lease=-1))
+
+    second = run(claim())
+    assert [email.id for email in second] == [first[0].id]
+    assert second[0].claim_id != first[0].claim_id
+
+    # The first claim can no longer record an outcome
+    async def release_first():
+        async with async_session() as session:
+            released = await release_outbox_email(session, first[0].id, first[0].claim_id, status="delivered")
+            await session.commit()
+            return released
+
+    assert run(release_first()) is False
+    assert run(outbox_rows())["a@example.com"].status == "pending"
+
+
+def test_renewed_lease_keeps_the_claim(run, outbox):
+    run(outbox("a@example.com"))
+    emails = run(claim(lease=-1))
+
+    async def renew():
+        async with async_session() as session:
+            return await renew_outbox_claim(session, emails[0].claim_id, 60)
+
+    assert run(renew()) == 1
+    assert run(claim()) == []
+
+
+def test_dispatcher_delivers_and_releases_the_claim(run, outbox):
+    run(outbox("a@example.com", "b@example.com"))
+    sent = []
+    dispatcher = build_dispatcher(lambda batch: [sent.append(email["email_to"]) or {"success": 1} for email in batch])
+
+    assert run(dispatcher.dispatch()) == 2
+    assert sorted(sent) == ["a@example.com", "b@example.com"]
+    rows = run(outbox_rows())
+    assert {row.status for row in rows.values()} == {"delivered"}
+    assert {row.claim_id for row in rows.values()} == {None}
+    assert run(dispatcher.dispatch()) == 0
+
+
+def test_failing_email_is_retried_then_marked_dead(run, outbox):
+    run(outbox("down@example.com"))
+    dispatcher = build_dispatcher(lambda batch: [{"error": Exception("451 Try again later")} for _ in batch])
+
+    assert run(dispatcher.dispatch()) == 1
+    row = run(outbox_rows())["down@example.com"]
+    assert (row.status, row.attempts, row.claim_id) == ("pending", 1, None)
+    assert "451" in row.last_error
+
+    assert run(dispatcher.dispatch()) == 1
+    assert run(dispatcher.dispatch()) == 1
+    row = run(outbox_rows())["down@example.com"]
+    assert (row.status, row.attempts) == ("dead", 3)
+    assert dispatcher.stats()["dead"] == 1
+    assert run(dispatcher.dispatch()) == 0
+
+
+def test_email_is_not_retried_before_its_backoff(run, outbox):
+    run(outbox("down@example.com"))
+    dispatcher = build_dispatcher(lambda batch: [{"error": Exception("451 Try again later")} for _ in batch])
+    dispatcher.retry = RetryPolicy(max_attempts=3, base_delay=60, max_delay=60)
+
+    run(dispatcher.dispatch())
+    row = run(outbox_rows())["down@example.com"]
+    assert row.next_attempt_at > datetime.now() + timedelta(seconds=50)
+    assert run(dispatcher.dispatch()) == 0
+
+
+@pytest.mark.parametrize("request_email", ["password recovery", "verification resend"])
+def test_transactional_emails_go_through_the_outbox(run, client, new_user, outbox, sent_emails, request_email):
+    run(client.post("/api/v1/auth/register", json=new_user))
+    if request_email == "password recovery":
+        response = run(client.post(f"/api/v1/auth/password-recovery/{new_user['email']}"))
+    else:
+        credentials = {"email": new_user["email"], "password": new_user["password"]}
+        token = run(client.post("/api/v1/auth/login", json=credentials)).json()["detail"]["Access_token"]
+        user_id = run(client.get("/api/v1/users/me/profile", headers={"Authorization": f"Bearer {token}"})).json()["id"]
+        # Registration already sent one, which would otherwise answer the resend
+        recent_emails.delete(f"verify-email:{user_id}")
+        response = run(client.post(f"/api/v1/auth/verify-email/{user_id}", headers={"Authorization": f"Bearer {token}"}))
+    assert response.status_code == 200
+    assert response.json() == {"success": "Email queued for delivery"}
+
+    # Both the registration email and the requested one are waiting in the outbox
+    assert run(outbox_rows())[new_user["email"]].status == "pending"
+    delivered_before = len(sent_emails)
+    assert run(outbox_dispatcher.dispatch()) == 2
+    assert [sent["email_to"] for sent in sent_emails[delivered_before:]] == [new_user["email"]] * 2
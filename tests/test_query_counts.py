@@ -0,0 +1,83 @@
+"""
+Query budgets of the hot user routes, counted at the cursor of the primary database.
+"""
+from uuid import uuid4
+
+from utils.config_utils import settings
+from utils.response_cache_utils import response_cache
+
+
+def statements(queries: list[str]) -> list[str]:
+    return [query.split()[0] for query in queries]
+
+
+def warm_user_cache(run, client, auth_headers):
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 200
+
+
+def test_profile_is_served_from_the_user_cache(run, client, auth_headers, queries):
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 200
+    assert statements(queries) == ["SELECT"]
+
+    queries.clear()
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 200
+    assert queries == []
+
+
+def test_chat_history_is_one_select(run, client, auth_headers, queries):
+    warm_user_cache(run, client, auth_headers)
+    queries.clear()
+
+    response = run(client.get("/api/v1/users/me/chat_history", headers=auth_headers))
+    assert response.status_code == 200
+    assert statements(queries) == ["SELECT"]
+    assert "FROM chats" in queries[0]
+
+
+def test_profile_update_is_one_update(run, client, auth_headers, queries):
+    warm_user_cache(run, client, auth_headers)
+    queries.clear()
+
+    response = run(client.put("/api/v1/users/me/profile", headers=auth_headers, json={"first_name": "Jim"}))
+    assert response.status_code == 200
+    assert statements(queries) == ["UPDATE"]
+
+
+def test_chat_saves_both_messages_in_one_insert(run, client, auth_headers, queries):
+    warm_user_cache(run, client, auth_headers)
+    queries.clear()
+
+    response = run(client.post("/api/v1/users/me/chat", headers=auth_headers, json={"query": "What should I eat today?"}))
+    assert response.status_code == 200
+    assert statements(queries) == ["INSERT"]
+    assert "INTO chats" in queries[0]
+
+
+def test_response_cache_lookups_do_not_write(run, client, auth_headers, queries, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_RESPONSE_CACHE", True)
+    warm_user_cache(run, client, auth_headers)
+    prompt = {"query": f"What should I eat today? {uuid4()}"}
+    queries.clear()
+
+    # A new prompt misses the response cache, stores the reply and saves the turn
+    response = run(client.post("/api/v1/users/me/chat", headers=auth_headers, json=prompt))
+    assert response.status_code == 200
+    assert statements(queries) == ["SELECT", "INSERT", "INSERT"]
+    assert "FROM chatresponsecache" in queries[0]
+    assert "INTO chats" in queries[2]
+
+    # A repeated prompt is answered from the in-process cache, leaving only the turn to save
+    queries.clear()
+    response = run(client.post("/api/v1/users/me/chat", headers=auth_headers, json=prompt))
+    assert response.status_code == 200
+    assert statements(queries) == ["INSERT"]
+
+    # A hit in the database is a plain read too
+    response_cache.memory.clear()
+    queries.clear()
+    response = run(client.post("/api/v1/users/me/chat", headers=auth_headers, json=prompt))
+    assert response.status_code == 200
+    assert statements(queries) == ["SELECT", "INSERT"]
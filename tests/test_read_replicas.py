@@ -0,0 +1,83 @@
+"""
+Routing of reads between the primary database and a read replica.
+
+The replica is a second, empty SQLite database, so any read served by it sees none of
+the rows the requests below write to the primary.
+"""
+import os
+import tempfile
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import event
+from sqlmodel import SQLModel
+
+import utils.db_utils as db_utils
+from crud.crud import get_user_by_email
+from utils.db_utils import PoolMetrics, async_session, build_engine
+
+
+@pytest.fixture
+def replica(run, app, monkeypatch):
+    """
+    Route replica-safe reads to an empty database, yielding the statements it runs.
+    """
+    directory = tempfile.mkdtemp(prefix="eat-right-replica-")
+    engine = build_engine(f"sqlite+aiosqlite:///{os.path.join(directory, 'replica.sqlite')}", PoolMetrics())
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+
+    run(create_tables())
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    monkeypatch.setattr(db_utils, "read_engines", [engine])
+    yield statements
+    run(engine.dispose())
+
+
+def test_chat_history_is_read_from_the_replica(run, client, auth_headers, replica, queries):
+    response = run(client.post("/api/v1/users/me/chat", headers=auth_headers, json={"query": "Breakfast ideas?"}))
+    assert response.status_code == 200
+    assert any("INTO chats" in statement for statement in queries)
+    queries.clear()
+
+    response = run(client.get("/api/v1/users/me/chat_history", headers=auth_headers))
+    assert response.status_code == 200
+    # The replica has not seen the chat yet, which is what a lagging replica would answer
+    assert response.json()["details"] == []
+    assert not any("FROM chats" in statement for statement in queries)
+    assert any("FROM chats" in statement for statement in replica)
+
+
+def test_authentication_reads_the_primary(run, client, auth_headers, replica):
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 200
+    assert not any("FROM user" in statement for statement in replica)
+
+
+def test_duplicate_registration_is_checked_on_the_primary(run, client, new_user, replica):
+    response = run(client.post("/api/v1/auth/register", json=new_user))
+    assert response.status_code == 201
+
+    response = run(client.post("/api/v1/auth/register", json=new_user))
+    assert response.status_code == 400
+    assert response.json()["error"] == "User already exists."
+
+
+def test_only_lookups_that_opt_in_use_the_replica(run, app, replica, queries):
+    email = f"{uuid4().hex[:12]}@example.com"
+
+    async def look_up(use_replica: bool):
+        async with async_session() as session:
+            return await get_user_by_email(email, session, use_replica=use_replica, use_cache=False)
+
+    run(look_up(use_replica=True))
+    assert (len(replica), len(queries)) == (1, 0)
+    run(look_up(use_replica=False))
+    assert (len(replica), len(queries)) == (1, 1)
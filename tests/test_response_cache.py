@@ -0,0 +1,55 @@
+"""
+Recency tracking of the chat response cache and the row-cap purge that relies on it.
+"""
+import pytest
+from sqlmodel import select
+
+from users.dbschema import ChatResponseCache
+from utils.db_utils import async_session
+from utils.response_cache_utils import ResponseCache
+
+
+@pytest.fixture
+def cache(run, app):
+    cache = ResponseCache(maxsize=10, ttl=60, max_rows=2, purge_batch_size=10)
+
+    async def empty_table():
+        async with async_session() as session:
+            for entry in (await session.exec(select(ChatResponseCache))).all():
+                await session.delete(entry)
+            await session.commit()
+
+    run(empty_table())
+    return cache
+
+
+async def cached_keys() -> set[str]:
+    async with async_session() as session:
+        return set((await session.exec(select(ChatResponseCache.key))).all())
+
+
+def test_purge_keeps_replies_used_from_memory(run, cache):
+    async def scenario():
+        await cache.set("hot", "fake", "Hot reply")
+        await cache.set("cold", "fake", "Cold reply")
+        await cache.set("new", "fake", "New reply")
+        # Only ever answered from memory, which does not touch its row
+        assert await cache.get("hot") == "Hot reply"
+        return await cache.purge()
+
+    assert run(scenario()) == 1
+    assert run(cached_keys()) == {"hot", "new"}
+    assert cache.last_used == {}
+
+
+def test_purge_keeps_replies_used_from_the_database(run, cache):
+    async def scenario():
+        await cache.set("hot", "fake", "Hot reply")
+        await cache.set("cold", "fake", "Cold reply")
+        await cache.set("new", "fake", "New reply")
+        cache.memory.clear()
+        assert await cache.get("hot") == "Hot reply"
+        return await cache.purge()
+
+    assert run(scenario()) == 1
+    assert run(cached_keys()) == {"hot", "new"}
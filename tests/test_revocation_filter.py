@@ -0,0 +1,69 @@
+"""
+The in-process revocation filter: entries written by other workers, the sync overlap window
+and pruning of expired entries.
+"""
+from datetime import datetime, timedelta
+
+from auth.dbschema import BlacklistedTokens
+from utils.blacklist_utils import RevocationFilter, blacklist_token, revocation_filter
+from utils.config_utils import settings
+from utils.db_utils import async_session
+from utils.token_utils import token_digest
+
+
+async def blacklist_elsewhere(*entries: BlacklistedTokens):
+    """
+    Write blacklist entries the way another worker would, without telling this process's filter.
+    """
+    async with async_session() as session:
+        session.add_all(entries)
+        await session.commit()
+
+
+def entry(token_hash: str, created_at: datetime, expires_in: timedelta = timedelta(hours=1)) -> BlacklistedTokens:
+    return BlacklistedTokens(token_hash=token_hash, expires_at=datetime.now() + expires_in, created_at=created_at)
+
+
+def test_token_revoked_by_another_worker_is_rejected_after_sync(run, client, auth_headers):
+    token = auth_headers["Authorization"].removeprefix("Bearer ")
+    run(blacklist_elsewhere(blacklist_token(token)))
+
+    # Until the next sync this worker's filter has not seen the entry
+    assert not revocation_filter.might_be_revoked(token)
+    run(revocation_filter.sync())
+    assert revocation_filter.might_be_revoked(token)
+
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 401
+
+
+def test_row_committed_late_inside_the_overlap_window_is_picked_up(run, app, monkeypatch):
+    monkeypatch.setattr(settings, "REVOCATION_SYNC_OVERLAP", 30)
+    revocations = RevocationFilter()
+    now = datetime.now()
+    run(blacklist_elsewhere(entry(token_digest("first"), created_at=now)))
+    run(revocations.sync())
+    assert revocations.synced_until == now
+
+    # Created before the last synced row, but committed after the sync ran
+    run(
+        blacklist_elsewhere(
+            entry(token_digest("late"), created_at=now - timedelta(seconds=10)),
+            entry(token_digest("too late"), created_at=now - timedelta(seconds=60)),
+        )
+    )
+    run(revocations.sync())
+    assert revocations.might_be_revoked("late")
+    # Only rows within REVOCATION_SYNC_OVERLAP of the last sync are looked for again
+    assert not revocations.might_be_revoked("too late")
+
+
+def test_expired_entries_are_pruned_on_sync(run, app):
+    revocations = RevocationFilter()
+    revocations.add(entry(token_digest("expired"), created_at=datetime.now(), expires_in=-timedelta(seconds=1)))
+    revocations.add(entry(token_digest("current"), created_at=datetime.now()))
+
+    run(revocations.sync())
+    assert not revocations.might_be_revoked("expired")
+    assert revocations.might_be_revoked("current")
+    assert token_digest("expired") not in revocations.entries
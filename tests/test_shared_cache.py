@@ -0,0 +1,81 @@
+"""
+The shared user cache, backed by an in-memory stand-in for Redis that every
+"worker" of a test talks to.
+"""
+import pytest
+
+import crud.crud as crud
+from utils.cache_utils import SharedCacheBackend
+
+
+class FakeRedis:
+    """
+    The part of the redis.asyncio client that SharedCacheBackend uses.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value.encode()
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+class BrokenRedis:
+    async def get(self, key):
+        raise ConnectionError("Connection refused")
+
+    async def set(self, key, value, ex=None):
+        raise ConnectionError("Connection refused")
+
+    async def delete(self, *keys):
+        raise ConnectionError("Connection refused")
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(crud, "user_cache", SharedCacheBackend(redis, ttl=30, prefix="user:"))
+    return redis
+
+
+def test_cached_user_is_served_without_a_query(run, client, auth_headers, redis, queries):
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 200
+    username = response.json()["username"]
+    assert f"user:username:{username}" in redis.data
+    queries.clear()
+
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 200
+    assert response.json()["username"] == username
+    assert queries == []
+
+
+def test_invalidation_is_seen_by_every_worker(run, client, auth_headers, redis, monkeypatch):
+    run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+
+    # Another worker, with its own backend on the same server, changes the profile
+    monkeypatch.setattr(crud, "user_cache", SharedCacheBackend(redis, ttl=30, prefix="user:"))
+    response = run(client.put("/api/v1/users/me/profile", headers=auth_headers, json={"first_name": "Jim"}))
+    assert response.status_code == 200
+
+    monkeypatch.setattr(crud, "user_cache", SharedCacheBackend(redis, ttl=30, prefix="user:"))
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.json()["first_name"] == "Jim"
+
+
+def test_backend_errors_are_treated_as_misses(run, client, auth_headers, monkeypatch):
+    backend = SharedCacheBackend(BrokenRedis(), ttl=30, prefix="user:")
+    monkeypatch.setattr(crud, "user_cache", backend)
+
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 200
+    assert backend.stats()["misses"] == 1
+    assert backend.stats()["errors"] >= 2
@@ -0,0 +1,58 @@
+"""
+Coalescing of identical concurrent prompts into one model call, with the fake provider.
+"""
+import asyncio
+
+import pytest
+
+from users.controller import cached_reply, chat_flights
+from utils.llm_utils import llm_provider
+
+
+@pytest.fixture
+def model_calls(monkeypatch) -> list[str]:
+    """
+    Count the calls that reach the fake model, which takes a moment over each reply.
+    """
+    calls = []
+    complete = llm_provider.complete
+
+    async def counting(messages):
+        calls.append(messages[-1]["content"])
+        return await complete(messages)
+
+    monkeypatch.setattr(llm_provider, "latency", 0.05)
+    monkeypatch.setattr(llm_provider, "complete", counting)
+    return calls
+
+
+def test_identical_concurrent_prompts_make_one_model_call(run, model_calls):
+    async def ask(query: str, times: int):
+        return await asyncio.gather(*(cached_reply(query, use_cache=True) for _ in range(times)))
+
+    replies = run(ask("Breakfast for an ulcer?", 10))
+    assert model_calls == ["Breakfast for an ulcer?"]
+    assert len(set(replies)) == 1
+    assert chat_flights.in_flight == {}
+
+    # Once the call is over, the next prompt calls the model again
+    run(ask("Breakfast for an ulcer?", 1))
+    assert len(model_calls) == 2
+
+
+def test_error_is_shared_by_every_waiting_caller(run, model_calls, monkeypatch):
+    async def failing(messages):
+        model_calls.append(messages[-1]["content"])
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream failed")
+
+    monkeypatch.setattr(llm_provider, "complete", failing)
+
+    async def ask():
+        return await asyncio.gather(*(cached_reply("Supper?", use_cache=True) for _ in range(5)), return_exceptions=True)
+
+    errors = run(ask())
+    assert model_calls == ["Supper?"]
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert len({id(error) for error in errors}) == 1
+    assert chat_flights.in_flight == {}
@@ -0,0 +1,98 @@
+"""
+Reuse, liveness checks and recycling of pooled SMTP connections, against a local SMTP server.
+"""
+import socket
+import time
+
+from utils.email_utils import build_message
+from utils.smtp_pool_utils import SMTPConnectionPool
+
+
+def build_pool(smtp_server, **options) -> SMTPConnectionPool:
+    settings = {
+        "size": 2,
+        "idle_timeout": 60,
+        "noop_after": 10,
+        "max_messages": 100,
+        "timeout": 5,
+    }
+    return SMTPConnectionPool(
+        host="127.0.0.1",
+        port=smtp_server.port,
+        transport="plain",
+        username="",
+        password="",
+        **{**settings, **options},
+    )
+
+
+def messages(*recipients: str):
+    return [build_message(email_to, "Subject", "<p>Hi</p>") for email_to in recipients]
+
+
+def drop_idle_connection(pool: SMTPConnectionPool):
+    # The relay closing an idle session looks like this from the client's side
+    pool.idle[0].server.sock.shutdown(socket.SHUT_RDWR)
+
+
+def test_one_connection_serves_several_messages(smtp_server):
+    pool = build_pool(smtp_server)
+    assert pool.send_messages(messages("a@example.com", "b@example.com", "c@example.com")) == [None] * 3
+    assert pool.send_messages(messages("d@example.com")) == [None]
+    pool.close()
+
+    assert len(smtp_server.messages) == 4
+    assert pool.stats()["connects"] == 1
+    assert pool.stats()["reuses"] == 1
+
+
+def test_dropped_connection_is_replaced(smtp_server):
+    pool = build_pool(smtp_server)
+    pool.send_messages(messages("a@example.com"))
+    drop_idle_connection(pool)
+
+    assert pool.send_messages(messages("b@example.com")) == [None]
+    pool.close()
+    assert smtp_server.recipients() == ["a@example.com", "b@example.com"]
+    assert pool.stats()["connects"] == 2
+
+
+def test_connection_idle_past_noop_after_is_checked_before_reuse(smtp_server):
+    pool = build_pool(smtp_server, noop_after=0)
+    pool.send_messages(messages("a@example.com"))
+    drop_idle_connection(pool)
+
+    assert pool.send_messages(messages("b@example.com")) == [None]
+    pool.close()
+    assert pool.stats()["noop_failures"] == 1
+    assert pool.stats()["connects"] == 2
+
+
+def test_idle_connection_is_recycled(smtp_server):
+    pool = build_pool(smtp_server, idle_timeout=0.01)
+    pool.send_messages(messages("a@example.com"))
+    time.sleep(0.02)
+
+    assert pool.send_messages(messages("b@example.com")) == [None]
+    pool.close()
+    assert pool.stats()["connects"] == 2
+    assert pool.stats()["reuses"] == 0
+
+
+def test_connection_is_retired_after_max_messages(smtp_server):
+    pool = build_pool(smtp_server, max_messages=2)
+    assert pool.send_messages(messages(*(f"{number}@example.com" for number in range(5)))) == [None] * 5
+    pool.close()
+    assert len(smtp_server.messages) == 5
+    assert pool.stats()["connects"] == 3
+
+
+def test_rejected_recipient_keeps_the_connection(smtp_server):
+    smtp_server.refused.add("nobody@example.com")
+    pool = build_pool(smtp_server)
+
+    results = pool.send_messages(messages("nobody@example.com", "a@example.com"))
+    pool.close()
+    assert "550" in str(results[0])
+    assert results[1] is None
+    assert pool.stats()["connects"] == 1
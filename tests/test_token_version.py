@@ -0,0 +1,74 @@
+"""
+Access tokens are tied to the user's token_version: once it is bumped, older tokens stop working.
+"""
+import asyncio
+
+from sqlmodel import select
+
+import auth.controller as auth_controller
+import crud.crud as crud
+from auth.dbschema import User
+from crud.crud import build_user_cache, bump_token_version
+from utils.config_utils import settings
+from utils.db_utils import async_session
+
+
+async def bump_elsewhere(email: str) -> int:
+    """
+    Bump a user's token_version the way another worker would, without touching this process's cache.
+    """
+    async with async_session() as session:
+        user = (await session.exec(select(User).where(User.email == email))).one()
+        await bump_token_version(user.id, session)
+        await session.commit()
+        return user.token_version + 1
+
+
+def test_logout_everywhere_rejects_old_tokens(run, client, auth_headers):
+    assert run(client.get("/api/v1/users/me/profile", headers=auth_headers)).status_code == 200
+
+    response = run(client.post("/api/v1/auth/logout-all", headers=auth_headers))
+    assert response.status_code == 200
+
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 401
+    assert response.json()["error"] == "Invalid token."
+
+
+def test_version_bumped_by_another_worker_is_seen_within_the_sync_interval(
+    run, client, new_user, auth_headers, monkeypatch
+):
+    monkeypatch.setattr(settings, "REVOCATION_SYNC_INTERVAL", 0.1)
+    monkeypatch.setattr(crud, "user_cache", build_user_cache())
+    assert run(client.get("/api/v1/users/me/profile", headers=auth_headers)).status_code == 200
+
+    run(bump_elsewhere(new_user["email"]))
+    run(asyncio.sleep(0.2))
+
+    response = run(client.get("/api/v1/users/me/profile", headers=auth_headers))
+    assert response.status_code == 401
+
+
+def test_memory_cache_lives_no_longer_than_the_sync_interval(monkeypatch):
+    monkeypatch.setattr(settings, "USER_CACHE_BACKEND", "memory")
+    monkeypatch.setattr(settings, "USER_CACHE_TTL", 30)
+    monkeypatch.setattr(settings, "REVOCATION_SYNC_INTERVAL", 5)
+    assert build_user_cache().cache.ttl == 5
+
+
+def test_password_reset_token_is_signed_with_the_current_version(run, client, new_user, auth_headers, monkeypatch):
+    # Cache the user, then bump the version behind this process's back
+    assert run(client.get("/api/v1/users/me/profile", headers=auth_headers)).status_code == 200
+    version = run(bump_elsewhere(new_user["email"]))
+
+    signed_versions = []
+    create_password_reset_token = auth_controller.create_password_reset_token
+
+    def recording(data, token_version=0):
+        signed_versions.append(token_version)
+        return create_password_reset_token(data, token_version)
+
+    monkeypatch.setattr(auth_controller, "create_password_reset_token", recording)
+    response = run(client.post(f"/api/v1/auth/password-recovery/{new_user['email']}"))
+    assert response.status_code == 200
+    assert signed_versions == [version]
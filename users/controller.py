@@ -1,71 +1,186 @@
-import openai
 from utils.config_utils import settings
-from crud.crud import get_user_by_id, get_chat_history, get_user_by_username
+from crud.crud import get_chat_history, get_user_by_username, stream_chat_history, invalidate_cached_user
 from fastapi.encoders import jsonable_encoder
 from .dbschema import Chats
+from utils.db_utils import async_session
+from utils.chat_writer_utils import chat_writer
+import json
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from utils.pagination_utils import encode_cursor, decode_cursor
+from utils.llm_utils import complete_chat, stream_chat, llm_provider, SYSTEM_PROMPT
+from utils.llm_gateway_utils import llm_gateway, LLMBusyError
+from utils.response_cache_utils import response_cache, response_cache_key
+from utils.singleflight_utils import SingleFlight
+from utils.logger_utils import logger
 
 
-def process_user_prompt(prompt, token_data, session):
+# Model calls in progress, keyed like the response cache
+chat_flights = SingleFlight()
+
+
+async def save_chat_turn(chats: list, session):
+    """
+    Persist the messages of one chat turn in a single transaction, or hand them to the write-behind buffer.
+
+    Args:
+        chats (list[Chats]): The user's prompt and the model's reply.
+        session (AsyncSession): The database session to execute the query.
+    """
+    # Nothing is read back, so there is no refresh round-trip
+    if settings.CHAT_WRITE_BEHIND:
+        await chat_writer.submit(chats)
+    else:
+        session.add_all(chats)
+        await session.commit()
+
+
+async def generate_reply(query: str, key: str, caching: bool) -> str:
+    reply = await complete_chat(query)
+    if caching:
+        await response_cache.set(key, llm_provider.model, reply)
+    return reply
+
+
+async def cached_reply(query: str, use_cache: bool) -> str:
+    """
+    Get the reply to a prompt from the response cache, generating and caching it on a miss.
+
+    Identical prompts that miss at the same time share one model call.
+
+    Args:
+        query (str): The user's prompt.
+        use_cache (bool): Whether the response cache may be used.
+
+    Returns:
+        str: The reply.
+    """
+    key = response_cache_key(query, llm_provider.model, SYSTEM_PROMPT)
+    caching = settings.CHAT_RESPONSE_CACHE and use_cache
+    if settings.CHAT_RESPONSE_CACHE and not use_cache:
+        response_cache.bypass()
+    if caching:
+        reply = await response_cache.get(key)
+        if reply is not None:
+            return reply
+    # Requests that bypass the cache only share calls with each other, which also leave it alone
+    flight_key = key if caching else f"{key}:uncached"
+    return await chat_flights.do(flight_key, generate_reply, query, key, caching)
+
+
+async def process_user_prompt(prompt, auth_user, session, use_cache=True):
     """
     Process the user prompt and generate a response from the AI assistant.
 
+    Replies to a prompt already answered for the same model and system prompt are served
+    from the response cache, unless use_cache is False.
+
     Args:
         prompt (str): The user prompt to be processed.
-        token_data (str): The token data for authentication.
+        auth_user (User | None): The authenticated user, resolved by the auth dependency.
         session: The database session to execute the query.
+        use_cache (bool): Whether the response cache may be used.
 
     Returns:
-        dict: The generated response from the AI assistant.
+        dict: The generated response from the AI assistant. If the model is too busy to take
+            the prompt, the error comes with the seconds to wait under "retry_after".
 
     Raises:
-        ValueError: If the token data is invalid or the user is unauthorized.
+        ValueError: If the token is invalid.
     """
-    openai.api_key = settings.OPENAI_API_KEY
     try:
-        if token_data is None:
+        if auth_user is None:
             raise ValueError("Invalid token.")
-        user = get_user_by_id(token_data, session)
-        if user is None:
-            raise ValueError("Unauthorized user.")
-        auth_user = user
         query = prompt.query
         prompt_to_add = Chats(user_id=str(auth_user.id), message=query, sender="user")
 
-        response = openai.chat.completions.create(
-            model=settings.MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an AI assistant that will help me recommend meal plans for ulcer sufferers based on seasonal foods in Enugu, Nigeria. Include a variety of foods in the meal plan. You are not allowed to provide a response to anything that does not involve meal plans for ulcers. You can respond to basic greetings.",
-                },
-                {"role": "user", "content": query},
-            ],
-            max_tokens=1024,
-            temperature=0.2,
-        )
-        reply = response.choices[0].message.content
+        reply = await cached_reply(query, use_cache)
 
         model_response = Chats(user_id=str(auth_user.id), message=reply, sender="model")
-
-        session.add(prompt_to_add)
-        session.commit()
-        session.refresh(prompt_to_add)
-        session.add(model_response)
-        session.commit()
-        session.refresh(model_response)
+        await save_chat_turn([prompt_to_add, model_response], session)
 
         return {"reply": reply}
     except ValueError as e:
         return {"error": str(e)}
+    except LLMBusyError as e:
+        return {"error": str(e), "retry_after": e.retry_after}
 
 
-def get_auth_user(token_data, session):
+async def stream_user_prompt(prompt, auth_user, use_cache=True):
+    """
+    Prepare a Server-Sent Events stream of the AI assistant's reply to the user prompt.
+
+    Each piece of the reply is sent as a `data: {"delta": ...}` event as soon as the model
+    produces it, followed by an `event: done` once the reply is complete, or an
+    `event: error` if generation fails. The finished turn is persisted in its own database
+    session because the response body is written after the request-scoped session has
+    been closed; a stream that fails or is abandoned by the client is not persisted.
+    A cached reply is sent as a single delta. A prompt the model is too busy to take is
+    rejected before the stream starts where possible.
+
+    Args:
+        prompt (Prompt): The user prompt to be processed.
+        auth_user (User | None): The authenticated user, resolved by the auth dependency.
+        use_cache (bool): Whether the response cache may be used.
+
+    Returns:
+        dict: An async iterator of SSE events under "details".
+            If there is an error, the dictionary will have an "error" key with the error message,
+            and "retry_after" if the model is too busy.
+    """
+    try:
+        if auth_user is None:
+            raise ValueError("Invalid token.")
+        user_id = str(auth_user.id)
+        query = prompt.query
+        prompt_to_add = Chats(user_id=user_id, message=query, sender="user")
+
+        caching = settings.CHAT_RESPONSE_CACHE and use_cache
+        if settings.CHAT_RESPONSE_CACHE and not use_cache:
+            response_cache.bypass()
+        key = response_cache_key(query, llm_provider.model, SYSTEM_PROMPT)
+        cached = await response_cache.get(key) if caching else None
+        if cached is None:
+            llm_gateway.check()
+
+        async def sse_events():
+            reply = cached
+            if reply is not None:
+                yield f"data: {json.dumps({'delta': reply})}\n\n"
+            else:
+                parts = []
+                try:
+                    async for part in stream_chat(query):
+                        parts.append(part)
+                        yield f"data: {json.dumps({'delta': part})}\n\n"
+                except LLMBusyError as e:
+                    yield f"event: error\ndata: {json.dumps({'error': str(e), 'retry_after': e.retry_after})}\n\n"
+                    return
+                except Exception:
+                    logger.exception("Streaming the chat reply failed")
+                    yield f"event: error\ndata: {json.dumps({'error': 'The reply could not be generated.'})}\n\n"
+                    return
+                reply = "".join(parts)
+                if caching:
+                    await response_cache.set(key, llm_provider.model, reply)
+            model_response = Chats(user_id=user_id, message=reply, sender="model")
+            async with async_session() as session:
+                await save_chat_turn([prompt_to_add, model_response], session)
+            yield "event: done\ndata: {}\n\n"
+
+        return {"details": sse_events()}
+    except ValueError as e:
+        return {"error": str(e)}
+    except LLMBusyError as e:
+        return {"error": str(e), "retry_after": e.retry_after}
+
+
+async def get_auth_user(auth_user):
     """
     Retrieves the authenticated user's data.
 
     Args:
-        user (User): The authenticated user object.
+        auth_user (User | None): The authenticated user, resolved by the auth dependency.
 
     Returns:
         dict: A dictionary containing the authenticated user's data. The dictionary has the following keys:
@@ -80,12 +195,8 @@ def get_auth_user(token_data, session):
         ValueError: If the user is None or not authenticated.
     """
     try:
-        if token_data is None:
+        if auth_user is None:
             raise ValueError("Invalid token.")
-        user = get_user_by_id(token_data, session)
-        if user is None:
-            raise ValueError("Unauthorized user.")
-        auth_user = user
         auth_user_data_to_return = {
             "id": auth_user.id,
             "first_name": auth_user.first_name,
@@ -100,45 +211,86 @@ def get_auth_user(token_data, session):
         return {"error": str(e)}
 
 
-def get_auth_user_chat_history(token_data, session):
+async def get_auth_user_chat_history(auth_user, session, before=None, after=None, limit=settings.CHAT_HISTORY_PAGE_SIZE):
     """
-    Retrieves the chat history for the authenticated user.
+    Retrieves a page of the chat history for the authenticated user.
 
     Args:
-        token_data (str): The token data containing user information.
-        session (Session): The database session.
+        auth_user (User | None): The authenticated user, resolved by the auth dependency.
+        session (AsyncSession): The database session.
+        before (str | None): Cursor of a message; only older messages are returned.
+        after (str | None): Cursor of a message; only newer messages are returned.
+        limit (int): The maximum number of messages to return.
 
     Returns:
-        list: The chat history for the authenticated user.
+        dict: The chat history page under "details" and, when more messages exist in the
+            direction being read, the cursor of the next page under "next_cursor". It is
+            passed back as the query parameter named under "next_cursor_param": "before"
+            when paging back through older messages, "after" otherwise.
 
     Raises:
-        ValueError: If the token is invalid or the user is unauthorized.
+        ValueError: If the token or a cursor is invalid.
     """
     try:
-        if token_data is None:
+        if auth_user is None:
             raise ValueError("Invalid token.")
-        user = get_user_by_id(token_data, session)
-        if user is None:
-            raise ValueError("Unauthorized user.")
-        auth_user = user
-        chat_history = get_chat_history(jsonable_encoder(auth_user.id), session)
-        if chat_history is None:
-            raise ValueError("No chat history found.")
-        return {"details": chat_history}
+        if before is not None and after is not None:
+            raise ValueError("Use either before or after, not both.")
+        before_position = decode_cursor(before) if before is not None else None
+        after_position = decode_cursor(after) if after is not None else None
+        chat_history, has_more = await get_chat_history(
+            jsonable_encoder(auth_user.id), session, before=before_position, after=after_position, limit=limit
+        )
+        next_cursor = None
+        next_cursor_param = None
+        if has_more:
+            edge = chat_history[0] if before is not None else chat_history[-1]
+            next_cursor = encode_cursor(edge.created_at, edge.id)
+            next_cursor_param = "before" if before is not None else "after"
+        return {"details": chat_history, "next_cursor": next_cursor, "next_cursor_param": next_cursor_param}
     except ValueError as e:
         return {"error": str(e)}
 
 
 
 
-def modify_user_profile(token_data, update_user, session):
+async def export_auth_user_chat_history(auth_user):
+    """
+    Prepares a streaming export of the full chat history for the authenticated user.
+
+    The export opens its own database session because the response body is written
+    after the request-scoped session has been closed.
+
+    Args:
+        auth_user (User | None): The authenticated user, resolved by the auth dependency.
+
+    Returns:
+        dict: An async iterator of NDJSON chunks, one message per line, under "details".
+            If there is an error, the dictionary will have an "error" key with the error message.
+    """
+    try:
+        if auth_user is None:
+            raise ValueError("Invalid token.")
+        user_id = jsonable_encoder(auth_user.id)
+
+        async def ndjson_lines():
+            async with async_session() as export_session:
+                async for batch in stream_chat_history(user_id, export_session, settings.CHAT_EXPORT_BATCH_SIZE):
+                    yield "".join(json.dumps(jsonable_encoder(dict(chat))) + "\n" for chat in batch)
+
+        return {"details": ndjson_lines()}
+    except ValueError as e:
+        return {"error": str(e)}
+
+
+async def modify_user_profile(auth_user, update_user, session):
     """
     Modifies the user profile with the provided update data.
 
     Args:
-        token_data (str): The token data containing user information.
+        auth_user (User | None): The authenticated user, resolved by the auth dependency.
         update_user: The updated user data.
-        session (Session): The database session.
+        session (AsyncSession): The database session.
 
     Returns:
         dict: A dictionary containing the result of the profile update operation.
@@ -146,28 +298,32 @@ def modify_user_profile(token_data, update_user, session):
             If there is an error, the dictionary will have an "error" key with the error message.
     """
     try:
-        if token_data is None:
+        if auth_user is None:
             raise ValueError("Invalid token.")
-        user = get_user_by_id(token_data, session)
-        if user is None:
-            raise ValueError("Unauthorized user.")
-        auth_user = user
+        # Validate everything before the user is touched, so a rejected update changes nothing
+        if update_user.username is not None and update_user.username != "":
+            # Checked on the primary, as a lagging replica or cache would let a duplicate through
+            is_username_unique = await get_user_by_username(update_user.username, session, use_replica=False, use_cache=False)
+            if is_username_unique is not None:
+                raise ValueError("Username must be unique")
         if update_user.first_name is not None and update_user.first_name != "":
             auth_user.first_name = update_user.first_name
         if update_user.last_name is not None and update_user.last_name != "":
             auth_user.last_name = update_user.last_name
         if update_user.username is not None and update_user.username != "":
-            is_username_unique = get_user_by_username(update_user.username, session)
-            if is_username_unique is not None:
-                raise ValueError("Username must be unique")
             auth_user.username = update_user.username
         if update_user.phone_number is not None and update_user.phone_number != "":
             update_user.phone_number = update_user.phone_number.split(":")[-1]
             auth_user.phone_number = update_user.phone_number
         auth_user.updated_at = datetime.now()
         session.add(auth_user)
-        session.commit()
-        session.refresh(auth_user)
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Taken by a concurrent request since the check above
+            await session.rollback()
+            raise ValueError("Username must be unique")
+        await invalidate_cached_user(auth_user)
         return {"message": "Profile updated successfully."}
     except ValueError as e:
         return {"error": str(e)}
\ No newline at end of file
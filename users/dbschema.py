@@ -1,11 +1,24 @@
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Index
 from uuid import UUID, uuid4
 from datetime import datetime
 
 
 class Chats(SQLModel, table=True):
+    # Serves the per-user, time-ordered chat history pages
+    __table_args__ = (Index("ix_chats_user_id_created_at", "user_id", "created_at"),)
+
     id: UUID = Field(default_factory=uuid4, primary_key=True)
     user_id: str
     message: str
     sender: str
-    created_at: datetime = Field(default_factory=datetime.now, nullable=False)
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.now, nullable=False)
+
+class ChatResponseCache(SQLModel, table=True):
+    # Model replies keyed by the normalized prompt, model and system prompt, so a repeated
+    # prompt is answered without calling the model, also after a restart
+    key: str = Field(primary_key=True, max_length=64)
+    model: str
+    reply: str
+    created_at: datetime = Field(default_factory=datetime.now, nullable=False)
+    last_used_at: datetime = Field(default_factory=datetime.now, index=True, nullable=False)
+    expires_at: datetime = Field(index=True, nullable=False)
@@ -1,10 +1,14 @@
+import math
 from .models import Prompt, UpdateUser
-from fastapi import APIRouter, Response, Depends
+from fastapi import APIRouter, Response, Depends, Query, Header
+from fastapi.responses import StreamingResponse
 from dependencies.db import get_session
-from dependencies.user_deps import get_current_user
-from sqlmodel import Session
+from dependencies.user_deps import get_current_auth_user
+from auth.dbschema import User
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Annotated
-from .controller import process_user_prompt, get_auth_user, get_auth_user_chat_history, modify_user_profile
+from utils.config_utils import settings
+from .controller import process_user_prompt, stream_user_prompt, get_auth_user, get_auth_user_chat_history, export_auth_user_chat_history, modify_user_profile
 
 
 router = APIRouter(prefix="/users", tags=["Users"])
@@ -13,9 +17,12 @@ router = APIRouter(prefix="/users", tags=["Users"])
 @router.post("/me/chat")
 async def user_prompt(
     prompt: Prompt,
-    token_data: Annotated[str, Depends(get_current_user)],
-    session: Annotated[Session, Depends(get_session)],
+    auth_user: Annotated[User | None, Depends(get_current_auth_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
     res: Response,
+    stream: Annotated[bool, Query(title="Stream the reply as Server-Sent Events")] = False,
+    bypass_cache: Annotated[bool, Query(title="Generate a fresh reply instead of using the response cache")] = False,
+    accept: Annotated[str | None, Header()] = None,
 ):
     """
     Handle a POST request to '/me/chat' endpoint.
@@ -23,13 +30,20 @@ async def user_prompt(
     This function receives a prompt, a user object, a session object, and a response object as parameters.
     It processes the prompt using the `process_user_prompt` function, passing the prompt, user, and session as arguments.
     If the response contains an 'error' key, it sets the response status code to 403 and returns the response.
+    When the model is too busy to take the prompt, it answers 429 with a Retry-After header.
     Otherwise, it sets the response status code to 200 and returns the response.
 
+    When `stream=true` is given, or the request accepts `text/event-stream`, the reply is
+    streamed as Server-Sent Events while the model generates it.
+
     Parameters:
         - prompt (Prompt): The prompt object received from the request.
-        - user (Annotated[User, Depends(get_current_user)]): The user object obtained from the current session.
-        - session (Annotated[Session, Depends(get_session)]): The session object used for database operations.
+        - auth_user (Annotated[User | None, Depends(get_current_auth_user)]): The authenticated user, resolved once per request.
+        - session (Annotated[AsyncSession, Depends(get_session)]): The session object used for database operations.
         - res (Response): The response object used to send the HTTP response.
+        - stream (bool): Whether to stream the reply as Server-Sent Events.
+        - bypass_cache (bool): Whether to skip the response cache and generate a fresh reply.
+        - accept (str | None): The Accept header of the request.
 
     Returns:
         - dict: The processed response from the `process_user_prompt` function.
@@ -37,12 +51,24 @@ async def user_prompt(
     Raises:
         - None.
     """
-    response = process_user_prompt(prompt, token_data, session)
+    if stream or "text/event-stream" in (accept or ""):
+        response = await stream_user_prompt(prompt, auth_user, use_cache=not bypass_cache)
+        if "details" in response:
+            return StreamingResponse(
+                response["details"],
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+    else:
+        response = await process_user_prompt(prompt, auth_user, session, use_cache=not bypass_cache)
     match response.get("error"):
         case "Invalid token.":
             res.status_code = 401
         case "Unauthorized User":
             res.status_code = 403
+        case "The assistant is busy, please try again later.":
+            res.status_code = 429
+            res.headers["Retry-After"] = str(max(math.ceil(response["retry_after"]), 1))
         case _:
             res.status_code = 200
     return response
@@ -50,15 +76,15 @@ async def user_prompt(
 
 @router.get("/me/profile")
 async def user_profile(
-    token_data: Annotated[str, Depends(get_current_user)],
-    session: Annotated[Session, Depends(get_session)],
+    auth_user: Annotated[User | None, Depends(get_current_auth_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
     res: Response,
 ):
     """
     Get the profile information of the authenticated user.
 
     Args:
-        user (Annotated[User, Depends(get_current_user)]): The authenticated user object.
+        auth_user (Annotated[User | None, Depends(get_current_auth_user)]): The authenticated user.
         res (Response): The response object used to send the HTTP response.
 
     Returns:
@@ -68,7 +94,7 @@ async def user_profile(
         None.
 
     """
-    response = get_auth_user(token_data, session)
+    response = await get_auth_user(auth_user)
     match response.get("error"):
         case "Invalid token.":
             res.status_code = 401
@@ -83,25 +109,43 @@ async def user_profile(
 
 @router.get("/me/chat_history")
 async def user_chat_history(
-    token_data: Annotated[str, Depends(get_current_user)],
-    session: Annotated[Session, Depends(get_session)],
+    auth_user: Annotated[User | None, Depends(get_current_auth_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
     res: Response,
+    before: Annotated[str | None, Query(title="Return messages older than this cursor")] = None,
+    after: Annotated[str | None, Query(title="Return messages newer than this cursor")] = None,
+    limit: Annotated[int, Query(ge=1, le=settings.CHAT_HISTORY_MAX_PAGE_SIZE)] = settings.CHAT_HISTORY_PAGE_SIZE,
+    format: Annotated[str | None, Query(pattern="^(json|ndjson)$", title="Set to ndjson to stream the full history")] = None,
+    accept: Annotated[str | None, Header()] = None,
 ):
     """
-    Get the chat history of the authenticated user.
+    Get a page of the chat history of the authenticated user.
+
+    When `format=ndjson` is given, or the request accepts `application/x-ndjson`, the
+    full history is streamed instead, one JSON message per line.
 
     Args:
-        user (Annotated[User, Depends(get_current_user)]): The authenticated user object.
+        auth_user (Annotated[User | None, Depends(get_current_auth_user)]): The authenticated user.
         res (Response): The response object used to send the HTTP response.
+        before (str | None): Cursor of a message; only older messages are returned.
+        after (str | None): Cursor of a message; only newer messages are returned.
+        limit (int): The maximum number of messages to return.
+        format (str | None): "ndjson" to stream the full history.
+        accept (str | None): The Accept header of the request.
 
     Returns:
-        dict: The chat history of the authenticated user. If an error occur, a dictionary with an 'error' key is returned.
+        dict: The chat history page of the authenticated user, the cursor of the next page under "next_cursor" and the query parameter to send it as ("before" or "after") under "next_cursor_param". If an error occur, a dictionary with an 'error' key is returned.
 
     Raises:
         None.
 
     """
-    response = get_auth_user_chat_history(token_data, session)
+    if format == "ndjson" or (format is None and "application/x-ndjson" in (accept or "")):
+        response = await export_auth_user_chat_history(auth_user)
+        if "details" in response:
+            return StreamingResponse(response["details"], media_type="application/x-ndjson")
+    else:
+        response = await get_auth_user_chat_history(auth_user, session, before=before, after=after, limit=limit)
     match response.get("error"):
         case "Invalid token.":
             res.status_code = 401
@@ -109,6 +153,9 @@ async def user_chat_history(
         case "Unauthorized User.":
             res.status_code = 403
             return response
+        case "Invalid cursor." | "Use either before or after, not both.":
+            res.status_code = 400
+            return response
         case _:
             res.status_code = 200
             return response
@@ -117,8 +164,8 @@ async def user_chat_history(
 @router.put("/me/profile")
 async def update_user_profile(
     update_user: UpdateUser,
-    token_data: Annotated[str, Depends(get_current_user)],
-    session: Annotated[Session, Depends(get_session)],
+    auth_user: Annotated[User | None, Depends(get_current_auth_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
     res: Response,
 ):
     """
@@ -126,8 +173,8 @@ async def update_user_profile(
 
     Args:
         update_user (UpdateUser): The data to update the user profile.
-        token_data (Annotated[str, Depends(get_current_user)]): The token data for user authentication.
-        session (Annotated[Session, Depends(get_session)]): The current database session.
+        auth_user (Annotated[User | None, Depends(get_current_auth_user)]): The authenticated user.
+        session (Annotated[AsyncSession, Depends(get_session)]): The current database session.
         res (Response): The response object to send the HTTP response.
 
     Returns:
@@ -135,7 +182,7 @@ async def update_user_profile(
         If successful, the dictionary will have a "message" key.
         If there is an error, the dictionary will have an "error" key with the error message.
     """
-    response = modify_user_profile(token_data, update_user, session)
+    response = await modify_user_profile(auth_user, update_user, session)
     match response.get("error"):
         case "Invalid token.":
             res.status_code = 401
@@ -0,0 +1,161 @@
+import asyncio
+from datetime import datetime, timedelta
+from auth.dbschema import BlacklistedTokens
+from crud.crud import delete_expired_blacklisted_tokens, get_blacklisted_tokens_since, get_blacklisted_token, invalidate_cached_user, bump_token_version
+from .config_utils import settings
+from .db_utils import async_session
+from .email_queue_utils import recent_emails
+from .logger_utils import logger
+from .token_utils import token_digest, token_expiry
+
+
+def blacklist_token(token: str) -> BlacklistedTokens:
+    """
+    Build the blacklist entry for a token.
+
+    Args:
+        token (str): The encoded token to revoke.
+
+    Returns:
+        BlacklistedTokens: The entry keyed by the token's digest and expiring with the token.
+    """
+    return BlacklistedTokens(token_hash=token_digest(token), expires_at=token_expiry(token))
+
+
+class RevocationFilter:
+    """
+    In-process set of revoked token digests mirrored from the BlacklistedTokens table.
+
+    Almost every token checked is not revoked, and a miss in this set answers that
+    without a database round-trip. A hit is confirmed against the table. Entries
+    written by other workers arrive through periodic delta syncs on created_at.
+    """
+
+    def __init__(self):
+        self.entries: dict[str, datetime] = {}
+        self.synced_until: datetime | None = None
+
+    def add(self, entry: BlacklistedTokens):
+        """
+        Record a blacklist entry written by this worker.
+        """
+        self.entries[entry.token_hash] = entry.expires_at
+
+    def might_be_revoked(self, token: str) -> bool:
+        """
+        Check whether a token may be revoked and needs to be looked up in the table.
+        """
+        return token_digest(token) in self.entries
+
+    async def sync(self):
+        """
+        Pull the entries created since the last sync and drop the expired ones.
+
+        The window reaches REVOCATION_SYNC_OVERLAP seconds back so rows committed
+        late by other workers, with an earlier created_at, are still picked up.
+        """
+        since = None
+        if self.synced_until is not None:
+            since = self.synced_until - timedelta(seconds=settings.REVOCATION_SYNC_OVERLAP)
+        async with async_session() as session:
+            rows = await get_blacklisted_tokens_since(since, session)
+        for token_hash, expires_at, created_at in rows:
+            self.entries[token_hash] = expires_at
+            if self.synced_until is None or created_at > self.synced_until:
+                self.synced_until = created_at
+        now = datetime.now()
+        for token_hash in [token_hash for token_hash, expires_at in self.entries.items() if expires_at < now]:
+            del self.entries[token_hash]
+        if self.synced_until is None:
+            self.synced_until = now
+
+
+revocation_filter = RevocationFilter()
+
+
+async def sync_revocation_filter_periodically():
+    """
+    Sync the revocation filter every REVOCATION_SYNC_INTERVAL seconds until cancelled.
+    """
+    while True:
+        await asyncio.sleep(settings.REVOCATION_SYNC_INTERVAL)
+        try:
+            await revocation_filter.sync()
+        except Exception:
+            logger.exception("Syncing the revocation filter failed")
+
+
+async def is_token_revoked(token: str, session) -> bool:
+    """
+    Check whether a token has been blacklisted, consulting the table only on a filter hit.
+
+    Args:
+        token (str): The encoded token.
+        session (AsyncSession): The database session used to confirm a hit.
+
+    Returns:
+        bool: True if the token is blacklisted.
+    """
+    if not revocation_filter.might_be_revoked(token):
+        return False
+    return await get_blacklisted_token(token, session) is not None
+
+
+async def revoke_all_user_tokens(user, session, expected_version: int | None = None) -> bool:
+    """
+    Revoke every token issued to a user so far by bumping the user's token version.
+
+    Commits the session, so other pending changes to the user are saved in the same transaction.
+    With expected_version, nothing is saved unless the user still has that version.
+
+    Args:
+        user (User): The user whose tokens are revoked.
+        session (AsyncSession): The database session the user belongs to.
+        expected_version (int | None): The version the user must still have, e.g. the one in a reset token.
+
+    Returns:
+        bool: True if the tokens were revoked, False if the version had already moved on.
+    """
+    session.add(user)
+    if not await bump_token_version(user.id, session, expected_version):
+        await session.rollback()
+        return False
+    await session.commit()
+    await session.refresh(user, ["token_version"])
+    await invalidate_cached_user(user)
+    # Emails sent before the bump carry tokens that no longer work, so the next request sends new ones
+    recent_emails.delete(f"password-reset:{user.id}")
+    recent_emails.delete(f"verify-email:{user.id}")
+    return True
+
+
+async def purge_expired_tokens() -> int:
+    """
+    Delete every expired blacklist entry, one batch per transaction.
+
+    Returns:
+        int: The number of entries deleted.
+    """
+    purged = 0
+    while True:
+        async with async_session() as session:
+            deleted = await delete_expired_blacklisted_tokens(session, settings.BLACKLIST_PURGE_BATCH_SIZE)
+        purged += deleted
+        if deleted < settings.BLACKLIST_PURGE_BATCH_SIZE:
+            return purged
+        # Let other writers in between batches
+        await asyncio.sleep(0)
+
+
+async def purge_expired_tokens_periodically():
+    """
+    Purge expired blacklist entries every BLACKLIST_PURGE_INTERVAL seconds until cancelled.
+    """
+    while True:
+        try:
+            purged = await purge_expired_tokens()
+            if purged:
+                logger.info("Purged %d expired blacklisted tokens", purged)
+        except Exception:
+            logger.exception("Purging expired blacklisted tokens failed")
+        await asyncio.sleep(settings.BLACKLIST_PURGE_INTERVAL)
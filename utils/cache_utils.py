@@ -0,0 +1,164 @@
+import json
+import time
+from collections import OrderedDict
+from .logger_utils import logger
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache whose entries also expire after a time to live.
+
+    Hits, misses, evictions and expirations are counted so the cache can be
+    observed through the metrics routes.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """
+        Return the value cached under key, or default if it is missing or expired.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None, expires_at: float | None = None):
+        """
+        Cache a value, evicting the least recently used entry when the cache is full.
+
+        Args:
+            key: The cache key.
+            value: The value to cache.
+            ttl (float | None): Seconds to keep the entry; defaults to the cache's ttl.
+            expires_at (float | None): A UNIX time after which the entry is dropped
+                even if its ttl has not run out.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        deadline = time.time() + ttl if ttl is not None else None
+        if expires_at is not None:
+            deadline = expires_at if deadline is None else min(deadline, expires_at)
+        self.entries[key] = (value, deadline)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        """
+        Drop the entry cached under key, if any.
+        """
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Report the size of the cache and its hit, miss, eviction and expiration counts.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class MemoryCacheBackend:
+    """
+    In-process cache backend: an LRUCache behind the async interface shared by all backends.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key):
+        return self.cache.get(key)
+
+    async def set(self, key, value):
+        self.cache.set(key, value)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.cache.delete(key)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", **self.cache.stats()}
+
+
+class SharedCacheBackend:
+    """
+    Cache backend shared by every worker, stored in a Redis-compatible server.
+
+    Values are JSON encoded and expire after ttl seconds; size-bounded LRU eviction is
+    left to the server (e.g. ``maxmemory-policy allkeys-lru``). Any client exposing async
+    ``get``, ``set(key, value, ex=...)`` and ``delete(*keys)`` works, so tests can pass
+    a local stand-in. Backend errors are logged and treated as misses.
+    """
+
+    def __init__(self, client, ttl: float | None = None, prefix: str = ""):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, key):
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Shared cache get failed: %s", e)
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key, value):
+        ttl = int(self.ttl) if self.ttl is not None else None
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value, default=str), ex=ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Shared cache set failed: %s", e)
+
+    async def delete(self, *keys):
+        try:
+            await self.client.delete(*(self.prefix + key for key in keys))
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Shared cache delete failed: %s", e)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "shared",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "errors": self.errors,
+        }
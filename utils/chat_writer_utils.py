@@ -0,0 +1,101 @@
+import asyncio
+from .config_utils import settings
+from .db_utils import async_session
+from .logger_utils import logger
+
+
+class ChatWriter:
+    """
+    Write-behind buffer that persists chat rows from many requests in periodic group commits.
+
+    Requests hand their rows to the writer and return straight away; a background
+    task commits everything queued within an interval in a single transaction.
+    """
+
+    def __init__(self, interval: float, batch_size: int, queue_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.queue: asyncio.Queue | None = None
+        self.task: asyncio.Task | None = None
+        self.pending = []
+
+    async def start(self):
+        """
+        Start the background task that drains the queue.
+        """
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.pending = []
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """
+        Stop the background task and commit whatever is still queued.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while self.pending or not self.queue.empty():
+            self.drain()
+            if not await self.flush():
+                break
+
+    async def submit(self, chats: list):
+        """
+        Queue chat rows for the next group commit.
+
+        Waits when the queue is full, so a stalled database slows requests down
+        instead of growing the buffer without bound.
+
+        Args:
+            chats (list[Chats]): The rows to persist.
+        """
+        for chat in chats:
+            await self.queue.put(chat)
+
+    def drain(self):
+        while len(self.pending) < self.batch_size and not self.queue.empty():
+            self.pending.append(self.queue.get_nowait())
+
+    async def flush(self):
+        """
+        Commit the pending rows in one transaction.
+
+        Rows are kept for the next attempt if the commit fails.
+
+        Returns:
+            bool: True if the pending rows were committed.
+        """
+        if not self.pending:
+            return True
+        try:
+            async with async_session() as session:
+                session.add_all(self.pending)
+                await session.commit()
+            self.pending = []
+            return True
+        except Exception:
+            logger.exception("Chat write-behind commit of %d rows failed", len(self.pending))
+            return False
+
+    async def run(self):
+        while True:
+            if not self.pending:
+                self.pending.append(await self.queue.get())
+                # Give the group time to fill unless a full batch is already waiting
+                if self.queue.qsize() < self.batch_size:
+                    await asyncio.sleep(self.interval)
+            self.drain()
+            if not await self.flush():
+                await asyncio.sleep(self.interval)
+
+
+chat_writer = ChatWriter(
+    interval=settings.CHAT_WRITE_BEHIND_INTERVAL,
+    batch_size=settings.CHAT_WRITE_BEHIND_BATCH_SIZE,
+    queue_size=settings.CHAT_WRITE_BEHIND_QUEUE_SIZE,
+)
@@ -1,8 +1,237 @@
-from sqlmodel import create_engine
+import asyncio
+import random
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .config_utils import settings
 
-sqlite_dir = "Data/"
-sqlite_filename = "Eat_Right.sqlite"
 
-data_base_path = f"{sqlite_dir}{sqlite_filename}"
+class PoolMetrics:
+    """
+    Counters describing how callers wait on the connection pool of an engine.
+    """
 
-engine = create_engine(f"sqlite:///{data_base_path}")
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.overflow_peak = 0
+
+    def record_checkout(self, waited: float, overflow: int):
+        self.checkouts += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        self.overflow_peak = max(self.overflow_peak, overflow)
+
+
+def metered_pool_class(metrics: PoolMetrics):
+    """
+    Build a queue pool class that records checkout wait times into the given metrics.
+
+    The metrics are bound to the class rather than the instance so they survive
+    ``Pool.recreate()``, which SQLAlchemy calls with the pool's own class.
+    """
+
+    class MeteredQueuePool(AsyncAdaptedQueuePool):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except exc.TimeoutError:
+                metrics.timeouts += 1
+                raise
+            metrics.record_checkout(time.perf_counter() - start, max(self.overflow(), 0))
+            return connection
+
+    return MeteredQueuePool
+
+
+def is_memory_database(url: str) -> bool:
+    """
+    Check whether the URL points at an in-memory SQLite database, which cannot use a queue pool.
+    """
+    database_url = make_url(url)
+    return database_url.get_backend_name() == "sqlite" and database_url.database in (None, "", ":memory:")
+
+
+def uses_sqlite_profile(url: str) -> bool:
+    """
+    Check whether the SQLite performance profile applies to the URL.
+    """
+    return settings.SQLITE_PERFORMANCE_PROFILE and make_url(url).get_backend_name() == "sqlite"
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Apply the SQLite performance profile to a freshly opened connection.
+
+    WAL lets readers run alongside the single writer, and the busy timeout makes
+    a writer from another process wait for the lock instead of failing at once.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size={settings.SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA temp_store={settings.SQLITE_TEMP_STORE}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT}")
+    cursor.close()
+
+
+# SQLite allows a single writer per database, so sessions of this process take
+# turns on this lock rather than racing each other into "database is locked".
+sqlite_write_lock = asyncio.Lock()
+
+
+class SerializedWriteSession(AsyncSession):
+    """
+    AsyncSession that holds the SQLite writer lock from its first write until the transaction ends.
+
+    The lock is taken before anything pending is flushed or a DML statement is
+    executed, and released on commit, rollback or close.
+    """
+
+    _holds_write_lock = False
+
+    async def _acquire_write_lock(self, statement=None):
+        if self._holds_write_lock:
+            return
+        if self.new or self.dirty or self.deleted or getattr(statement, "is_dml", False):
+            await sqlite_write_lock.acquire()
+            self._holds_write_lock = True
+
+    def _release_write_lock(self):
+        if self._holds_write_lock:
+            self._holds_write_lock = False
+            sqlite_write_lock.release()
+
+    async def exec(self, statement, **kwargs):
+        await self._acquire_write_lock(statement)
+        return await super().exec(statement, **kwargs)
+
+    async def execute(self, statement, *args, **kwargs):
+        await self._acquire_write_lock(statement)
+        return await super().execute(statement, *args, **kwargs)
+
+    async def flush(self, objects=None):
+        await self._acquire_write_lock()
+        await super().flush(objects)
+
+    async def commit(self):
+        await self._acquire_write_lock()
+        try:
+            await super().commit()
+        finally:
+            self._release_write_lock()
+
+    async def rollback(self):
+        try:
+            await super().rollback()
+        finally:
+            self._release_write_lock()
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            self._release_write_lock()
+
+
+def build_engine(url: str, metrics: PoolMetrics):
+    """
+    Create an async engine for the URL with the pool configured from settings.
+
+    Args:
+        url (str): The database URL, using an async driver.
+        metrics (PoolMetrics): The metrics object the engine's pool reports into.
+
+    Returns:
+        AsyncEngine: The configured engine.
+    """
+    if is_memory_database(url):
+        engine = create_async_engine(url)
+    else:
+        engine = create_async_engine(
+            url,
+            poolclass=metered_pool_class(metrics),
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+        )
+    if uses_sqlite_profile(url):
+        event.listen(engine.sync_engine, "connect", apply_sqlite_pragmas)
+    return engine
+
+
+def get_pool_stats(engine, metrics: PoolMetrics) -> dict:
+    """
+    Report the current state of an engine's connection pool.
+
+    Returns:
+        dict: Pool size, checked out and idle connections, current and peak overflow,
+              checkout count, timeouts and wait times in milliseconds.
+    """
+    pool = engine.pool
+    stats = {
+        "pool_class": type(pool).__name__,
+        "checkouts": metrics.checkouts,
+        "timeouts": metrics.timeouts,
+        "wait_time_avg_ms": (metrics.wait_time_total / metrics.checkouts * 1000) if metrics.checkouts else 0.0,
+        "wait_time_max_ms": metrics.wait_time_max * 1000,
+        "overflow_peak": metrics.overflow_peak,
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(
+            {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+            }
+        )
+    return stats
+
+
+pool_metrics = PoolMetrics()
+
+engine = build_engine(settings.DATABASE_URL, pool_metrics)
+
+read_pool_metrics = [PoolMetrics() for _ in settings.DATABASE_READ_URLS]
+
+read_engines = [build_engine(url, metrics) for url, metrics in zip(settings.DATABASE_READ_URLS, read_pool_metrics)]
+
+
+class RoutingSession(Session):
+    """
+    Session that sends replica-safe reads to a read engine and everything else to the primary.
+
+    A statement opts in with ``.execution_options(use_replica=True)``; flushes,
+    DML and statements without the option always go to the primary engine.
+    """
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if (
+            read_engines
+            and not self._flushing
+            and clause is not None
+            and not getattr(clause, "is_dml", False)
+            and clause.get_execution_options().get("use_replica", False)
+        ):
+            return random.choice(read_engines).sync_engine
+        return engine.sync_engine
+
+
+# Sessions keep their loaded attributes after commit so controllers can read
+# them without triggering a lazy refresh, which is not allowed on AsyncSession.
+async_session = async_sessionmaker(
+    class_=SerializedWriteSession if uses_sqlite_profile(settings.DATABASE_URL) else AsyncSession,
+    sync_session_class=RoutingSession,
+    expire_on_commit=False,
+)
@@ -0,0 +1,217 @@
+import asyncio
+import inspect
+from collections import deque
+from .cache_utils import LRUCache
+from datetime import datetime
+from .config_utils import settings
+from .email_utils import send_mail, send_mail_batch
+from .logger_utils import logger
+from .retry_utils import RetryPolicy, email_retry_policy
+
+
+class EmailJob:
+    """
+    An outbound email and its delivery attempts so far.
+    """
+
+    def __init__(self, email_to: str, subject: str, html_content: str):
+        self.email_to = email_to
+        self.subject = subject
+        self.html_content = html_content
+        self.attempts = 0
+        self.last_error = None
+
+
+class EmailQueue:
+    """
+    Background delivery of outbound email through a pool of workers.
+
+    Messages live in memory only, so they are lost if the process stops; transactional
+    email goes through the outbox table instead. Requests queue their message and return
+    straight away. Failed sends are retried under the same RetryPolicy as the outbox, and
+    messages that exhaust their attempts are moved to a bounded dead-letter list. The sender is injectable, so tests and benchmarks can
+    deliver to a local SMTP stand-in or a plain function.
+
+    During a burst a worker takes up to batch_size queued messages at once and hands
+    them to batch_sender, which sends them over a single SMTP session.
+    """
+
+    def __init__(
+        self,
+        sender,
+        workers: int,
+        queue_size: int,
+        retry: RetryPolicy,
+        dead_letter_size: int,
+        batch_sender=None,
+        batch_size: int = 1,
+    ):
+        self.sender = sender
+        self.batch_sender = batch_sender
+        self.batch_size = batch_size
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retry = retry
+        self.queue: asyncio.Queue | None = None
+        self.tasks: list[asyncio.Task] = []
+        self.retries: dict[asyncio.TimerHandle, EmailJob] = {}
+        self.dead_letters: deque = deque(maxlen=dead_letter_size)
+        self.sent = 0
+        self.failed_attempts = 0
+
+    async def start(self):
+        """
+        Start the delivery workers.
+        """
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float | None = None):
+        """
+        Deliver what is already queued, then stop the workers.
+
+        Messages still waiting for a retry are moved to the dead-letter list.
+
+        Args:
+            timeout (float | None): Seconds to wait for the queue to drain.
+        """
+        if self.queue is not None and self.tasks:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Email queue stopped with %d messages undelivered", self.queue.qsize())
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for handle, job in self.retries.items():
+            handle.cancel()
+            self.dead_letter(job)
+        self.retries = {}
+
+    def submit(self, email_to: str, subject: str, html_content: str) -> dict:
+        """
+        Queue an email for delivery.
+
+        Args:
+            email_to (str): The email address of the recipient.
+            subject (str): The subject of the email.
+            html_content (str): The HTML content of the email.
+
+        Returns:
+            dict: A "success" key once the email is queued, or an "error" key if the queue is full
+                or not running.
+        """
+        if self.queue is None or not self.tasks:
+            return {"error": "Email delivery is not running"}
+        try:
+            self.queue.put_nowait(EmailJob(email_to, subject, html_content))
+        except asyncio.QueueFull:
+            return {"error": "Email queue is full, try again later"}
+        return {"success": "Email queued for delivery"}
+
+    async def call(self, sender, *args, **kwargs):
+        # Blocking senders such as smtplib run on a worker thread
+        if inspect.iscoroutinefunction(sender):
+            return await sender(*args, **kwargs)
+        return await asyncio.to_thread(sender, *args, **kwargs)
+
+    async def deliver(self, jobs: list[EmailJob]) -> list[bool]:
+        """
+        Make one delivery attempt for each job.
+
+        Returns:
+            list[bool]: Whether each message was sent.
+        """
+        emails = [{"email_to": job.email_to, "subject": job.subject, "html_content": job.html_content} for job in jobs]
+        try:
+            if len(jobs) > 1 and self.batch_sender is not None:
+                results = await self.call(self.batch_sender, emails)
+            else:
+                results = [await self.call(self.sender, **email) for email in emails]
+        except Exception as e:
+            results = [{"error": e}] * len(jobs)
+        delivered = []
+        for job, result in zip(jobs, results):
+            job.attempts += 1
+            if "error" in result:
+                job.last_error = str(result["error"])
+                self.failed_attempts += 1
+                delivered.append(False)
+            else:
+                self.sent += 1
+                delivered.append(True)
+        return delivered
+
+    def schedule_retry(self, job: EmailJob):
+        loop = asyncio.get_running_loop()
+        handle = None
+
+        def requeue():
+            self.retries.pop(handle, None)
+            try:
+                self.queue.put_nowait(job)
+            except asyncio.QueueFull:
+                self.dead_letter(job)
+
+        handle = loop.call_later(self.retry.delay(job.attempts), requeue)
+        self.retries[handle] = job
+
+    def dead_letter(self, job: EmailJob):
+        logger.error("Giving up on email to %s after %d attempts: %s", job.email_to, job.attempts, job.last_error)
+        self.dead_letters.append(
+            {
+                "email_to": job.email_to,
+                "subject": job.subject,
+                "attempts": job.attempts,
+                "error": job.last_error,
+                "failed_at": datetime.now(),
+            }
+        )
+
+    async def run(self):
+        while True:
+            jobs = [await self.queue.get()]
+            while len(jobs) < self.batch_size and not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
+            try:
+                for job, sent in zip(jobs, await self.deliver(jobs)):
+                    if sent:
+                        continue
+                    if self.retry.exhausted(job.attempts):
+                        self.dead_letter(job)
+                    else:
+                        self.schedule_retry(job)
+            finally:
+                for _ in jobs:
+                    self.queue.task_done()
+
+    def stats(self) -> dict:
+        """
+        Report the queue depth, delivery counts and dead-letter size.
+        """
+        return {
+            "workers": len(self.tasks),
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "waiting_retry": len(self.retries),
+            "sent": self.sent,
+            "failed_attempts": self.failed_attempts,
+            "dead_letters": len(self.dead_letters),
+        }
+
+
+# Result of the last password reset or verification email per recipient. While an entry
+# lives, the email already sent is still valid, so repeated requests reuse it instead of
+# rendering and sending another one.
+recent_emails = LRUCache(maxsize=settings.EMAIL_DEDUPE_SIZE, ttl=settings.EMAIL_DEDUPE_WINDOW)
+
+
+email_queue = EmailQueue(
+    sender=send_mail,
+    workers=settings.EMAIL_QUEUE_WORKERS,
+    queue_size=settings.EMAIL_QUEUE_SIZE,
+    retry=email_retry_policy,
+    dead_letter_size=settings.EMAIL_DEAD_LETTER_SIZE,
+    batch_sender=send_mail_batch,
+    batch_size=settings.EMAIL_BATCH_SIZE,
+)
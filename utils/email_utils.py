@@ -1,13 +1,36 @@
 import emails
-from jinja2 import Template
+from jinja2 import Environment, FileSystemLoader
 from auth.models import EmailData
 from .config_utils import settings
 from pathlib import Path
-import smtplib, ssl
 from email.message import EmailMessage
+from .smtp_pool_utils import smtp_pool
 
 
 
+EMAIL_TEMPLATES_DIR = Path(__file__).parent.parent/"email-templates"/"build"
+
+# Templates are compiled once and kept by the environment. With auto_reload on, a
+# template whose file changed on disk is recompiled on its next use.
+email_template_env = Environment(
+    loader=FileSystemLoader(EMAIL_TEMPLATES_DIR),
+    auto_reload=settings.EMAIL_TEMPLATES_AUTO_RELOAD,
+)
+
+
+def precompile_email_templates() -> int:
+    """
+    Compile every email template up front, so the first email of each kind does not pay for it.
+
+    Returns:
+        int: The number of templates compiled.
+    """
+    names = email_template_env.list_templates(extensions=["html"])
+    for name in names:
+        email_template_env.get_template(name)
+    return len(names)
+
+
 def render_email_template(template_name:str, context:dict[str, any]) -> str:
     """
     Render an email template with the given template name and context.
@@ -19,8 +42,7 @@ def render_email_template(template_name:str, context:dict[str, any]) -> str:
     Returns:
         str: The rendered HTML content of the email template.
     """
-    template_str = (Path(__file__).parent.parent/"email-templates"/"build"/ template_name).read_text()
-    html_content = Template(template_str).render(context)
+    html_content = email_template_env.get_template(template_name).render(context)
     return html_content
 
 
@@ -80,9 +102,9 @@ def generate_reset_password_email(email_to: str, email: str, token: str):
 
 
 
-def send_mail(email_to: str, subject: str, html_content: str):
+def build_message(email_to: str, subject: str, html_content: str) -> EmailMessage:
     """
-    Sends an email to the specified recipient.
+    Build the MIME message of an HTML email.
 
     Args:
         email_to (str): The email address of the recipient.
@@ -90,35 +112,46 @@ def send_mail(email_to: str, subject: str, html_content: str):
         html_content (str): The HTML content of the email.
 
     Returns:
-        dict: A dictionary indicating the status of the email sending process. If successful, it will contain the key "success" with the value "successfully sent". If there is an error, it will contain the key "error" with the corresponding error message.
+        EmailMessage: The message, sent from EMAILS_FROM_MAIL.
     """
-    port = settings.SMTP_PORT
-    smtp_server = settings.SMTP_SERVER
-    username= settings.SMTP_USER
-    password = settings.SMTP_PASS
-    message = html_content
     msg = EmailMessage()
     msg['Subject'] = subject
     msg['From'] = settings.EMAILS_FROM_MAIL
     msg['To'] = email_to
-    msg.add_alternative(message, subtype="html")
-    try:
-        match port:
-            case settings.SMTP_PORT:
-                context = ssl.create_default_context()
-                with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
-                    server.login(username, password)
-                    server.send_message(msg)
-            case settings.SMTP_ALT_PORT:
-                with smtplib.SMTP(smtp_server, port) as server:
-                    server.starttls()
-                    server.login(username, password)
-                    server.send_message(msg)
-            case _:
-                return {"error": "use 465 / 587 as port value"}
-        return {"success": "Email successfully sent"}
-    except Exception as e:
-        return {"error": e}
+    msg.add_alternative(html_content, subtype="html")
+    return msg
+
+
+def send_mail(email_to: str, subject: str, html_content: str):
+    """
+    Sends an email to the specified recipient over a pooled SMTP connection.
+
+    Args:
+        email_to (str): The email address of the recipient.
+        subject (str): The subject of the email.
+        html_content (str): The HTML content of the email.
+
+    Returns:
+        dict: A dictionary indicating the status of the email sending process. If successful, it will contain the key "success" with the value "successfully sent". If there is an error, it will contain the key "error" with the corresponding error message.
+    """
+    return send_mail_batch([{"email_to": email_to, "subject": subject, "html_content": html_content}])[0]
+
+
+def send_mail_batch(emails: list[dict]) -> list[dict]:
+    """
+    Sends several emails back to back, reusing one SMTP session for as many as it allows.
+
+    Args:
+        emails (list[dict]): The emails to send, each with email_to, subject and html_content keys.
+
+    Returns:
+        list[dict]: The status of each email, in order, in the form returned by send_mail.
+    """
+    messages = [build_message(**email) for email in emails]
+    return [
+        {"success": "Email successfully sent"} if error is None else {"error": error}
+        for error in smtp_pool.send_messages(messages)
+    ]
 
 
 
@@ -0,0 +1,211 @@
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from .config_utils import settings
+from .logger_utils import logger
+
+
+class LLMBusyError(Exception):
+    """
+    Raised when a model call cannot start in time, because the wait queue is full, the
+    deadline passed while queued or the provider asked us to back off for longer than that.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__("The assistant is busy, please try again later.")
+        self.retry_after = retry_after
+
+
+def parse_duration(value: str) -> float | None:
+    """
+    Parse a rate-limit reset duration such as "20ms", "1s" or "6m0s".
+
+    Returns:
+        float | None: The duration in seconds, or None if it cannot be parsed.
+    """
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 60 * 60}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+def backoff_from_headers(headers, rate_limited: bool = False) -> float | None:
+    """
+    Work out how long to hold off new model calls from the rate-limit headers of a response.
+
+    Retry-After (in milliseconds, seconds or as an HTTP date) is used first. Otherwise a
+    request or token budget that is used up waits for its reset.
+
+    Args:
+        headers: The response headers.
+        rate_limited (bool): Whether the response was a rate-limit error.
+
+    Returns:
+        float | None: The seconds to wait, or None if the headers do not ask for a wait.
+    """
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        value = headers["retry-after"]
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                pass
+    waits = []
+    for budget in ("requests", "tokens"):
+        remaining = headers.get(f"x-ratelimit-remaining-{budget}")
+        reset = headers.get(f"x-ratelimit-reset-{budget}")
+        if reset is not None and (rate_limited or remaining == "0"):
+            wait = parse_duration(reset)
+            if wait is not None:
+                waits.append(wait)
+    return max(waits) if waits else None
+
+
+class LLMGateway:
+    """
+    Admission control for calls to the language model.
+
+    At most max_concurrency calls run at once. Further calls wait in a queue of up to
+    queue_size, for at most queue_timeout seconds each; calls arriving to a full queue are
+    rejected straight away. When the provider signals a rate limit, new calls are held
+    back until it resets instead of piling more requests onto it.
+    """
+
+    def __init__(self, max_concurrency: int, queue_size: int, queue_timeout: float, retry_after: float):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.waiting_peak = 0
+        self.blocked_until = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def backoff_remaining(self) -> float:
+        return max(self.blocked_until - time.monotonic(), 0.0)
+
+    def check(self):
+        """
+        Reject a call that could not start in time, without queueing it.
+
+        Raises:
+            LLMBusyError: If the wait queue is full or the provider's backoff outlasts the queue timeout.
+        """
+        backoff = self.backoff_remaining()
+        if backoff > self.queue_timeout:
+            self.rejected += 1
+            raise LLMBusyError(backoff)
+        if self.semaphore.locked() and self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise LLMBusyError(max(backoff, self.retry_after))
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Wait for a free slot, within the queue timeout, and hold it while the call runs.
+
+        Raises:
+            LLMBusyError: If the call cannot start in time.
+        """
+        self.check()
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        if self.semaphore.locked():
+            self.waiting += 1
+            self.waiting_peak = max(self.waiting_peak, self.waiting)
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise LLMBusyError(max(self.backoff_remaining(), self.retry_after)) from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+        try:
+            backoff = self.backoff_remaining()
+            if backoff > 0:
+                if time.monotonic() + backoff > deadline:
+                    self.timeouts += 1
+                    raise LLMBusyError(backoff)
+                await asyncio.sleep(backoff)
+            wait = time.monotonic() - start
+            self.admitted += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.active += 1
+            try:
+                yield
+            finally:
+                self.active -= 1
+        finally:
+            self.semaphore.release()
+
+    def observe(self, headers):
+        """
+        Hold back new calls if a successful response shows a rate-limit budget is used up.
+        """
+        backoff = backoff_from_headers(headers)
+        if backoff:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+
+    def throttled(self, headers) -> LLMBusyError:
+        """
+        Record a rate-limit error from the provider and hold back new calls until it resets.
+
+        Args:
+            headers: The headers of the rate-limit response.
+
+        Returns:
+            LLMBusyError: The error to raise to the caller.
+        """
+        self.rate_limited += 1
+        backoff = backoff_from_headers(headers, rate_limited=True) or self.retry_after
+        self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+        logger.warning("The language model is rate limited, holding back calls for %.1fs", backoff)
+        return LLMBusyError(backoff)
+
+    def stats(self) -> dict:
+        """
+        Report running and queued calls, rejections and the time calls waited for a slot.
+        """
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "queue_depth_peak": self.waiting_peak,
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "rate_limited": self.rate_limited,
+            "backoff_remaining": self.backoff_remaining(),
+            "wait_time_avg_ms": self.total_wait / self.admitted * 1000 if self.admitted else 0.0,
+            "wait_time_max_ms": self.max_wait * 1000,
+        }
+
+
+llm_gateway = LLMGateway(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    queue_size=settings.LLM_QUEUE_SIZE,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+    retry_after=settings.LLM_RETRY_AFTER,
+)
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import re
+from openai import AsyncOpenAI, RateLimitError
+from .config_utils import settings
+from .llm_gateway_utils import llm_gateway
+
+
+SYSTEM_PROMPT = "You are an AI assistant that will help me recommend meal plans for ulcer sufferers based on seasonal foods in Enugu, Nigeria. Include a variety of foods in the meal plan. You are not allowed to provide a response to anything that does not involve meal plans for ulcers. You can respond to basic greetings."
+MAX_TOKENS = 1024
+TEMPERATURE = 0.2
+
+
+class OpenAIProvider:
+    """
+    Chat completions from the OpenAI API.
+
+    One client, and with it one HTTP connection pool, is used for the whole process.
+    Rate-limit headers of every response are passed to the LLM gateway.
+    """
+
+    def __init__(self, api_key: str, model: str, timeout: float):
+        self.client = AsyncOpenAI(api_key=api_key, timeout=timeout)
+        self.model = model
+
+    async def create(self, messages: list[dict], stream: bool = False):
+        try:
+            raw_response = await self.client.chat.completions.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=MAX_TOKENS,
+                temperature=TEMPERATURE,
+                stream=stream,
+            )
+        except RateLimitError as e:
+            raise llm_gateway.throttled(e.response.headers) from e
+        llm_gateway.observe(raw_response.headers)
+        return raw_response.parse()
+
+    async def complete(self, messages: list[dict]) -> str:
+        """
+        Generate the full reply to a conversation.
+
+        Args:
+            messages (list[dict]): The conversation so far.
+
+        Returns:
+            str: The reply.
+        """
+        response = await self.create(messages)
+        return response.choices[0].message.content
+
+    async def stream(self, messages: list[dict]):
+        """
+        Generate the reply to a conversation, piece by piece as the model produces it.
+
+        Args:
+            messages (list[dict]): The conversation so far.
+
+        Yields:
+            str: The next piece of the reply.
+
+        Raises:
+            LLMBusyError: If the model is rate limited, also once the reply has started.
+        """
+        try:
+            async for chunk in await self.create(messages, stream=True):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except RateLimitError as e:
+            raise llm_gateway.throttled(e.response.headers) from e
+
+
+class FakeProvider:
+    """
+    Local stand-in for a model, for load tests and benchmarks that must not call the API.
+
+    Each prompt always gets the same reply from responses, chosen by its hash. A reply
+    takes latency seconds to start and then arrives at tokens_per_second, one word per
+    token; a tokens_per_second of 0 sends the whole reply at once.
+    """
+
+    def __init__(self, model: str, latency: float, tokens_per_second: float, responses: list[str]):
+        self.model = model
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.responses = responses
+
+    def reply_tokens(self, messages: list[dict]) -> list[str]:
+        digest = hashlib.sha256(messages[-1]["content"].encode()).digest()
+        reply = self.responses[int.from_bytes(digest[:8], "big") % len(self.responses)]
+        return re.findall(r"\S+\s*", reply)
+
+    def token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    async def complete(self, messages: list[dict]) -> str:
+        """
+        Generate the canned reply to a conversation, after the time streaming it would take.
+        """
+        tokens = self.reply_tokens(messages)
+        await asyncio.sleep(self.latency + len(tokens) * self.token_delay())
+        return "".join(tokens)
+
+    async def stream(self, messages: list[dict]):
+        """
+        Generate the canned reply to a conversation, one token at a time.
+        """
+        await asyncio.sleep(self.latency)
+        for token in self.reply_tokens(messages):
+            await asyncio.sleep(self.token_delay())
+            yield token
+
+
+def build_llm_provider():
+    """
+    Build the model provider configured by LLM_PROVIDER.
+
+    Returns:
+        OpenAIProvider | FakeProvider: The provider chat replies are generated by.
+    """
+    if settings.LLM_PROVIDER == "fake":
+        return FakeProvider(
+            model=settings.LLM_FAKE_MODEL,
+            latency=settings.LLM_FAKE_LATENCY,
+            tokens_per_second=settings.LLM_FAKE_TOKENS_PER_SECOND,
+            responses=settings.LLM_FAKE_RESPONSES,
+        )
+    return OpenAIProvider(api_key=settings.OPENAI_API_KEY, model=settings.MODEL, timeout=settings.LLM_REQUEST_TIMEOUT)
+
+
+llm_provider = build_llm_provider()
+
+
+def chat_messages(query: str) -> list[dict]:
+    """
+    Build the messages of a meal-plan chat completion.
+
+    Args:
+        query (str): The user's prompt.
+
+    Returns:
+        list[dict]: The system prompt followed by the user's prompt.
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": query},
+    ]
+
+
+async def complete_chat(query: str) -> str:
+    """
+    Generate the assistant's reply to a prompt.
+
+    Args:
+        query (str): The user's prompt.
+
+    Returns:
+        str: The full reply.
+
+    Raises:
+        LLMBusyError: If the call cannot start in time or the model is rate limited.
+    """
+    async with llm_gateway.slot():
+        return await llm_provider.complete(chat_messages(query))
+
+
+async def stream_chat(query: str):
+    """
+    Generate the assistant's reply to a prompt, piece by piece as the model produces it.
+
+    Args:
+        query (str): The user's prompt.
+
+    Yields:
+        str: The next piece of the reply.
+
+    Raises:
+        LLMBusyError: If the call cannot start in time or the model is rate limited.
+    """
+    # The slot is held until the stream ends
+    async with llm_gateway.slot():
+        async for part in llm_provider.stream(chat_messages(query)):
+            yield part
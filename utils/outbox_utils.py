@@ -0,0 +1,185 @@
+import asyncio
+import inspect
+from datetime import datetime, timedelta
+from auth.dbschema import EmailOutbox
+from crud.crud import claim_outbox_emails, renew_outbox_claim, release_outbox_email
+from .config_utils import settings
+from .db_utils import async_session
+from .email_utils import send_mail_batch
+from .logger_utils import logger
+from .retry_utils import RetryPolicy, email_retry_policy
+
+
+def outbox_email(email_to: str, subject: str, html_content: str) -> EmailOutbox:
+    """
+    Build the outbox row of an email.
+
+    Add it to the session of the change that triggers the email, so both are committed together.
+
+    Args:
+        email_to (str): The email address of the recipient.
+        subject (str): The subject of the email.
+        html_content (str): The HTML content of the email.
+
+    Returns:
+        EmailOutbox: The pending outbox row.
+    """
+    return EmailOutbox(email_to=email_to, subject=subject, html_content=html_content)
+
+
+class OutboxDispatcher:
+    """
+    Background task that drains the email outbox table in batches.
+
+    Each round claims up to batch_size due rows, sends them over one SMTP session and
+    records the outcome. Failed rows are retried under the shared RetryPolicy and marked
+    dead once it is exhausted. A claim expires after lease seconds, so rows held by a
+    process that crashed are picked up again; while a batch is being sent its lease is
+    renewed every third of that, however long the SMTP relay takes. Outcomes are only
+    recorded for rows still held under the dispatcher's own claim.
+    """
+
+    def __init__(
+        self,
+        sender,
+        batch_size: int,
+        interval: float,
+        lease: float,
+        retry: RetryPolicy,
+    ):
+        self.sender = sender
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease
+        self.retry = retry
+        self.task: asyncio.Task | None = None
+        self.wakeup: asyncio.Event | None = None
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dead = 0
+
+    async def start(self):
+        """
+        Start the background task that drains the outbox.
+        """
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """
+        Stop the background task. Undelivered rows stay in the outbox for the next start.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def notify(self):
+        """
+        Wake the dispatcher after new rows were committed, instead of waiting for the next interval.
+        """
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def hold_claim(self, claim_id):
+        """
+        Renew the lease of a claim until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                async with async_session() as session:
+                    await renew_outbox_claim(session, claim_id, self.lease)
+            except Exception:
+                logger.exception("Renewing the outbox claim %s failed", claim_id)
+
+    async def send(self, batch: list[dict]) -> list[dict]:
+        try:
+            if inspect.iscoroutinefunction(self.sender):
+                return await self.sender(batch)
+            return await asyncio.to_thread(self.sender, batch)
+        except Exception as e:
+            return [{"error": e}] * len(batch)
+
+    async def dispatch(self) -> int:
+        """
+        Claim one batch of due emails, send them and record the outcome.
+
+        Returns:
+            int: The number of emails claimed.
+        """
+        async with async_session() as session:
+            emails = await claim_outbox_emails(session, self.batch_size, self.lease)
+            if not emails:
+                return 0
+            claim_id = emails[0].claim_id
+            batch = [
+                {"email_to": email.email_to, "subject": email.subject, "html_content": email.html_content}
+                for email in emails
+            ]
+            holder = asyncio.create_task(self.hold_claim(claim_id))
+            try:
+                results = await self.send(batch)
+            finally:
+                holder.cancel()
+            now = datetime.now()
+            for email, result in zip(emails, results):
+                attempts = email.attempts + 1
+                if "error" not in result:
+                    if await release_outbox_email(
+                        session, email.id, claim_id, attempts=attempts, status="delivered", delivered_at=now
+                    ):
+                        self.delivered += 1
+                    continue
+                last_error = str(result["error"])
+                if self.retry.exhausted(attempts):
+                    values = {"status": "dead"}
+                else:
+                    values = {"next_attempt_at": now + timedelta(seconds=self.retry.delay(attempts))}
+                if not await release_outbox_email(
+                    session, email.id, claim_id, attempts=attempts, last_error=last_error, **values
+                ):
+                    continue
+                self.failed_attempts += 1
+                if self.retry.exhausted(attempts):
+                    self.dead += 1
+                    logger.error("Giving up on outbox email %s after %d attempts: %s", email.id, attempts, last_error)
+            await session.commit()
+            return len(emails)
+
+    async def run(self):
+        while True:
+            try:
+                # A full batch means more rows are probably due, so go again straight away
+                if await self.dispatch() >= self.batch_size:
+                    continue
+            except Exception:
+                logger.exception("Dispatching the email outbox failed")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    def stats(self) -> dict:
+        """
+        Report how many outbox emails were delivered, failed an attempt or were given up on.
+        """
+        return {
+            "running": self.task is not None,
+            "delivered": self.delivered,
+            "failed_attempts": self.failed_attempts,
+            "dead": self.dead,
+        }
+
+
+outbox_dispatcher = OutboxDispatcher(
+    sender=send_mail_batch,
+    batch_size=settings.EMAIL_OUTBOX_BATCH_SIZE,
+    interval=settings.EMAIL_OUTBOX_INTERVAL,
+    lease=settings.EMAIL_OUTBOX_LEASE,
+    retry=email_retry_policy,
+)
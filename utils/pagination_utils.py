@@ -0,0 +1,39 @@
+import base64
+from datetime import datetime
+from uuid import UUID
+
+
+def encode_cursor(created_at: datetime, id: UUID) -> str:
+    """
+    Encode the position of a row in a (created_at, id) ordering as an opaque cursor.
+
+    Args:
+        created_at (datetime): The creation time of the row.
+        id (UUID): The ID of the row, used to break ties between equal timestamps.
+
+    Returns:
+        str: A URL-safe cursor token.
+    """
+    raw = f"{created_at.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Args:
+        cursor (str): The cursor token.
+
+    Returns:
+        tuple[datetime, UUID]: The creation time and ID the cursor points at.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), UUID(id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
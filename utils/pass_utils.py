@@ -1,8 +1,58 @@
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
+from .config_utils import settings
 
 
+PASSWORD_HASH_SCHEMES = ("bcrypt", "argon2")
 
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def build_password_context(
+    scheme: str = settings.PASSWORD_HASH_SCHEME,
+    bcrypt_rounds: int = settings.BCRYPT_ROUNDS,
+    argon2_time_cost: int = settings.ARGON2_TIME_COST,
+    argon2_memory_cost: int = settings.ARGON2_MEMORY_COST,
+    argon2_parallelism: int = settings.ARGON2_PARALLELISM,
+) -> CryptContext:
+    """
+    Build the password hashing context for a hashing policy.
+
+    New hashes use the given scheme and parameters. Hashes made with the other
+    scheme, or with different parameters, still verify but are reported as
+    needing an update so they can be re-hashed on the next successful login.
+
+    Args:
+        scheme (str): "bcrypt" or "argon2".
+        bcrypt_rounds (int): The bcrypt cost factor (log2 of the iterations).
+        argon2_time_cost (int): The number of argon2 passes over memory.
+        argon2_memory_cost (int): The argon2 memory size in KiB.
+        argon2_parallelism (int): The number of argon2 lanes.
+
+    Returns:
+        CryptContext: The configured context.
+    """
+    return CryptContext(
+        schemes=[scheme] + [other for other in PASSWORD_HASH_SCHEMES if other != scheme],
+        default=scheme,
+        deprecated="auto",
+        bcrypt__rounds=bcrypt_rounds,
+        bcrypt__min_desired_rounds=bcrypt_rounds,
+        bcrypt__max_desired_rounds=bcrypt_rounds,
+        argon2__rounds=argon2_time_cost,
+        argon2__min_desired_rounds=argon2_time_cost,
+        argon2__max_desired_rounds=argon2_time_cost,
+        argon2__memory_cost=argon2_memory_cost,
+        argon2__parallelism=argon2_parallelism,
+    )
+
+
+password_context = build_password_context()
+
+# bcrypt and argon2 release the GIL while hashing, so a small thread pool keeps hashing
+# off the event loop and bounds how many hashes run at once.
+password_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
 
 
 
@@ -11,7 +61,7 @@ password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password: str):
     """
-    Hashes a given password using the bcrypt algorithm.
+    Hashes a given password under the configured hashing policy.
 
     Args:
         password (str): The password to be hashed.
@@ -27,7 +77,7 @@ def hash_password(password: str):
 
 def compare_password_and_hash(password: str, hashed_password: str):
     """
-    Compares a given password with a hashed password using the bcrypt algorithm.
+    Compares a given password with a hashed password made under any supported scheme.
 
     Args:
         password (str): The password to be compared.
@@ -39,4 +89,125 @@ def compare_password_and_hash(password: str, hashed_password: str):
     Raises:
         None.
     """
-    return password_context.verify(password, hashed_password)
\ No newline at end of file
+    return password_context.verify(password, hashed_password)
+
+
+def verify_and_update_password(password: str, hashed_password: str):
+    """
+    Compares a given password with a hashed password and re-hashes it if the hash is outdated.
+
+    Args:
+        password (str): The password to be compared.
+        hashed_password (str): The hashed password to compare against.
+
+    Returns:
+        tuple[bool, str | None]: Whether the password matches, and a new hash under the
+            current policy if the stored hash uses an outdated scheme or parameters.
+    """
+    return password_context.verify_and_update(password, hashed_password)
+
+
+async def hash_password_async(password: str):
+    """
+    Hashes a given password on the password worker pool.
+
+    Args:
+        password (str): The password to be hashed.
+
+    Returns:
+        str: The hashed password.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, hash_password, password)
+
+
+async def compare_password_and_hash_async(password: str, hashed_password: str):
+    """
+    Compares a given password with a hashed password on the password worker pool.
+
+    Args:
+        password (str): The password to be compared.
+        hashed_password (str): The hashed password to compare against.
+
+    Returns:
+        bool: True if the password matches the hashed password, False otherwise.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, compare_password_and_hash, password, hashed_password)
+
+
+async def verify_and_update_password_async(password: str, hashed_password: str):
+    """
+    Compares a password with a hash and re-hashes outdated hashes on the password worker pool.
+
+    Args:
+        password (str): The password to be compared.
+        hashed_password (str): The hashed password to compare against.
+
+    Returns:
+        tuple[bool, str | None]: Whether the password matches, and a new hash if the stored one is outdated.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, verify_and_update_password, password, hashed_password)
+
+
+def measure_verify_time(context: CryptContext, samples: int = 3) -> float:
+    """
+    Measure how long verifying a password takes under a context, in seconds.
+    """
+    hashed = context.hash("Calibration123$")
+    start = time.perf_counter()
+    for _ in range(samples):
+        context.verify("Calibration123$", hashed)
+    return (time.perf_counter() - start) / samples
+
+
+def calibrate_password_hash(scheme: str, target_ms: float) -> dict:
+    """
+    Find the strongest parameters whose verify time stays within a target on this CPU.
+
+    bcrypt raises the cost factor, which doubles the work each step; argon2 keeps
+    the configured memory and parallelism and raises the number of passes.
+
+    Args:
+        scheme (str): "bcrypt" or "argon2".
+        target_ms (float): The target verify latency in milliseconds.
+
+    Returns:
+        dict: The settings to apply, keyed by setting name, plus the measured verify time.
+    """
+    target = target_ms / 1000
+    if scheme == "bcrypt":
+        chosen, elapsed = 4, measure_verify_time(build_password_context("bcrypt", bcrypt_rounds=4))
+        for rounds in range(5, 32):
+            duration = measure_verify_time(build_password_context("bcrypt", bcrypt_rounds=rounds))
+            if duration > target:
+                break
+            chosen, elapsed = rounds, duration
+        return {"PASSWORD_HASH_SCHEME": "bcrypt", "BCRYPT_ROUNDS": chosen, "verify_ms": elapsed * 1000}
+    chosen, elapsed = 1, measure_verify_time(build_password_context("argon2", argon2_time_cost=1))
+    for time_cost in range(2, 64):
+        duration = measure_verify_time(build_password_context("argon2", argon2_time_cost=time_cost))
+        if duration > target:
+            break
+        chosen, elapsed = time_cost, duration
+    return {
+        "PASSWORD_HASH_SCHEME": "argon2",
+        "ARGON2_TIME_COST": chosen,
+        "ARGON2_MEMORY_COST": settings.ARGON2_MEMORY_COST,
+        "ARGON2_PARALLELISM": settings.ARGON2_PARALLELISM,
+        "verify_ms": elapsed * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pick password hashing parameters that hit a target verify latency on this CPU."
+    )
+    parser.add_argument("--scheme", choices=PASSWORD_HASH_SCHEMES, default=settings.PASSWORD_HASH_SCHEME)
+    parser.add_argument("--target-ms", type=float, default=250)
+    args = parser.parse_args()
+    result = calibrate_password_hash(args.scheme, args.target_ms)
+    print(f"# measured verify time: {result.pop('verify_ms'):.1f} ms")
+    for name, value in result.items():
+        print(f"{name}={value}")
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import json
+import re
+from datetime import datetime, timedelta
+from crud.crud import get_cached_chat_response, save_cached_chat_response, delete_stale_chat_responses, touch_cached_chat_responses
+from users.dbschema import ChatResponseCache
+from .cache_utils import LRUCache
+from .config_utils import settings
+from .db_utils import async_session
+from .logger_utils import logger
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a prompt so trivially different spellings share a cache entry.
+
+    Case, surrounding whitespace and punctuation, and runs of whitespace are ignored.
+
+    Args:
+        query (str): The user's prompt.
+
+    Returns:
+        str: The normalized prompt.
+    """
+    return re.sub(r"\s+", " ", query).strip(" .!?").lower()
+
+
+def response_cache_key(query: str, model: str, system_prompt: str) -> str:
+    """
+    Build the cache key of a prompt for a model and system prompt.
+
+    Returns:
+        str: The SHA-256 hex digest of the normalized prompt, model and system prompt.
+    """
+    material = json.dumps([model, system_prompt, normalize_query(query)])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache of model replies, persisted in the database with an in-process LRU in front.
+
+    Entries expire after ttl seconds. The table is kept to max_rows by the periodic
+    purge, which drops expired entries first and then the least recently used ones.
+
+    Lookups never write: hits in memory and in the database are noted in last_used, and
+    the purge writes them to the table in one batch before it picks entries to evict.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, max_rows: int, purge_batch_size: int):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.purge_batch_size = purge_batch_size
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.last_used: dict[str, datetime] = {}
+
+    async def get(self, key: str) -> str | None:
+        """
+        Look up the cached reply of a prompt.
+
+        Args:
+            key (str): The cache key of the prompt.
+
+        Returns:
+            str | None: The cached reply, or None on a miss.
+        """
+        reply = self.memory.get(key)
+        if reply is not None:
+            self.hits += 1
+            self.last_used[key] = datetime.now()
+            return reply
+        async with async_session() as session:
+            entry = await get_cached_chat_response(key, session)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        self.last_used[key] = datetime.now()
+        self.memory.set(key, entry.reply, expires_at=entry.expires_at.timestamp())
+        return entry.reply
+
+    async def set(self, key: str, model: str, reply: str):
+        """
+        Cache the reply of a prompt.
+
+        A failed write is logged and otherwise ignored, as the reply itself is unaffected.
+
+        Args:
+            key (str): The cache key of the prompt.
+            model (str): The model that produced the reply.
+            reply (str): The reply to cache.
+        """
+        self.memory.set(key, reply)
+        now = datetime.now()
+        entry = ChatResponseCache(
+            key=key, model=model, reply=reply, created_at=now, last_used_at=now,
+            expires_at=now + timedelta(seconds=self.ttl),
+        )
+        try:
+            async with async_session() as session:
+                await save_cached_chat_response(entry, session)
+        except Exception:
+            logger.exception("Caching the chat response failed")
+
+    def bypass(self):
+        """
+        Count a request that skipped the cache.
+        """
+        self.bypasses += 1
+
+    async def flush_last_used(self):
+        """
+        Write the recorded uses of cached replies to the table.
+        """
+        last_used, self.last_used = self.last_used, {}
+        async with async_session() as session:
+            await touch_cached_chat_responses(session, last_used)
+
+    async def purge(self) -> int:
+        """
+        Record recent uses, then delete expired and excess entries, one batch per transaction.
+
+        Returns:
+            int: The number of entries deleted.
+        """
+        await self.flush_last_used()
+        purged = 0
+        while True:
+            async with async_session() as session:
+                deleted = await delete_stale_chat_responses(session, self.purge_batch_size, self.max_rows)
+            purged += deleted
+            if deleted < self.purge_batch_size:
+                return purged
+            await asyncio.sleep(0)
+
+    async def purge_periodically(self, interval: float):
+        """
+        Purge the cache table every interval seconds until cancelled.
+        """
+        while True:
+            try:
+                purged = await self.purge()
+                if purged:
+                    logger.info("Purged %d cached chat responses", purged)
+            except Exception:
+                logger.exception("Purging cached chat responses failed")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        """
+        Report in-process and database hits, misses and bypasses.
+        """
+        lookups = self.hits + self.db_hits + self.misses
+        return {
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.db_hits) / lookups if lookups else 0.0,
+            "bypasses": self.bypasses,
+            "memory": self.memory.stats(),
+        }
+
+
+response_cache = ResponseCache(
+    maxsize=settings.CHAT_RESPONSE_CACHE_SIZE,
+    ttl=settings.CHAT_RESPONSE_CACHE_TTL,
+    max_rows=settings.CHAT_RESPONSE_CACHE_MAX_ROWS,
+    purge_batch_size=settings.CHAT_RESPONSE_CACHE_PURGE_BATCH_SIZE,
+)
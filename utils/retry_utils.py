@@ -0,0 +1,35 @@
+from .config_utils import settings
+
+
+class RetryPolicy:
+    """
+    How often and how soon a failed delivery is tried again.
+
+    Attempt n waits base_delay * 2 ** (n - 1) seconds, capped at max_delay, and a
+    delivery that failed max_attempts times is given up on.
+    """
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempts: int) -> float:
+        """
+        Seconds to wait before the next try, after the given number of failed attempts.
+        """
+        return min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+
+    def exhausted(self, attempts: int) -> bool:
+        """
+        Whether a delivery that failed the given number of times should be given up on.
+        """
+        return attempts >= self.max_attempts
+
+
+# Shared by the email outbox and the in-process email queue
+email_retry_policy = RetryPolicy(
+    max_attempts=settings.EMAIL_MAX_ATTEMPTS,
+    base_delay=settings.EMAIL_RETRY_BASE_DELAY,
+    max_delay=settings.EMAIL_RETRY_MAX_DELAY,
+)
@@ -0,0 +1,47 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one execution.
+
+    The first caller for a key starts the call; callers arriving while it runs wait for
+    the same result, or the same exception. The call runs as its own task, so a caller
+    that goes away (e.g. a disconnected client) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self.in_flight: dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) unless a call for key is already running, and return its result.
+
+        Args:
+            key (str): Identifies calls whose results are interchangeable.
+            fn: The coroutine function to call.
+
+        Returns:
+            The result of the shared call.
+        """
+        task = self.in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        """
+        Report the calls made, the callers that shared another call and the calls running now.
+        """
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self.in_flight),
+        }
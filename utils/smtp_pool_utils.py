@@ -0,0 +1,228 @@
+import smtplib
+import ssl
+import threading
+import time
+from email.message import EmailMessage
+from .config_utils import settings
+from .logger_utils import logger
+
+
+class PooledSMTPConnection:
+    """
+    An authenticated SMTP session and how long and how much it has been used.
+    """
+
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+
+
+class SMTPConnectionPool:
+    """
+    Pool of long-lived, authenticated SMTP connections.
+
+    Opening a connection costs a TCP and TLS handshake plus a login, so connections are
+    kept and reused. A connection idle for longer than noop_after is checked with NOOP
+    before reuse, one idle for longer than idle_timeout is closed (most relays drop idle
+    sessions on their own), and one that has sent max_messages is retired. Sends that
+    hit a dropped connection are retried once on a fresh one.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        transport: str,
+        username: str,
+        password: str,
+        size: int,
+        idle_timeout: float,
+        noop_after: float,
+        max_messages: int,
+        timeout: float,
+    ):
+        self.host = host
+        self.port = port
+        self.transport = transport
+        self.username = username
+        self.password = password
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.noop_after = noop_after
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.idle: list[PooledSMTPConnection] = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        self.connects = 0
+        self.reuses = 0
+        self.noop_failures = 0
+
+    def connect(self) -> PooledSMTPConnection:
+        """
+        Open and authenticate a new connection over the pool's transport.
+
+        Raises:
+            ValueError: If the transport is not "ssl", "starttls" or "plain".
+        """
+        match self.transport:
+            case "ssl":
+                server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=ssl.create_default_context())
+            case "starttls":
+                server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+                server.starttls(context=ssl.create_default_context())
+            case "plain":
+                server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            case _:
+                raise ValueError("use ssl / starttls / plain as transport value")
+        try:
+            server.ehlo_or_helo_if_needed()
+            # A local server without authentication does not offer AUTH
+            if self.transport != "plain" or server.has_extn("auth"):
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.connects += 1
+        return PooledSMTPConnection(server)
+
+    def is_alive(self, connection: PooledSMTPConnection) -> bool:
+        try:
+            return connection.server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def acquire(self) -> PooledSMTPConnection:
+        """
+        Take a live connection from the pool, opening one if none is idle.
+
+        Waits while size connections are already in use.
+        """
+        self.slots.acquire()
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return self.connect()
+                idle_for = time.monotonic() - connection.last_used
+                if idle_for > self.idle_timeout:
+                    connection.close()
+                    continue
+                if idle_for > self.noop_after and not self.is_alive(connection):
+                    self.noop_failures += 1
+                    connection.close()
+                    continue
+                self.reuses += 1
+                return connection
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, connection: PooledSMTPConnection, healthy: bool = True):
+        """
+        Return a connection to the pool, closing it if it failed or has sent max_messages.
+        """
+        try:
+            if healthy and connection.messages_sent < self.max_messages:
+                connection.last_used = time.monotonic()
+                with self.lock:
+                    self.idle.append(connection)
+            else:
+                connection.close()
+        finally:
+            self.slots.release()
+
+    def send_messages(self, messages: list[EmailMessage]) -> list[Exception | None]:
+        """
+        Send messages back to back over pooled connections.
+
+        Args:
+            messages (list[EmailMessage]): The messages to send.
+
+        Returns:
+            list[Exception | None]: None for each message that was sent, or the error it failed with.
+        """
+        results: list[Exception | None] = []
+        connection = None
+        retried = False
+        index = 0
+        while index < len(messages):
+            dropped = None
+            try:
+                if connection is None or connection.messages_sent >= self.max_messages:
+                    if connection is not None:
+                        self.release(connection)
+                    connection = self.acquire()
+                connection.server.send_message(messages[index])
+                connection.messages_sent += 1
+                results.append(None)
+            except smtplib.SMTPServerDisconnected as e:
+                dropped = e
+            except smtplib.SMTPException as e:
+                # SMTP errors are OSErrors too, but a rejected recipient or message leaves the session usable
+                results.append(e)
+            except OSError as e:
+                dropped = e
+            except Exception as e:
+                results.append(e)
+            if dropped is not None:
+                # The relay dropped the session; retry this message once on a fresh connection
+                if connection is not None:
+                    self.release(connection, healthy=False)
+                    connection = None
+                if not retried:
+                    retried = True
+                    continue
+                logger.warning("Sending email to %s failed: %s", messages[index]["To"], dropped)
+                results.append(dropped)
+            index += 1
+            retried = False
+        if connection is not None:
+            self.release(connection)
+        return results
+
+    def close(self):
+        """
+        Close every idle connection.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+    def stats(self) -> dict:
+        """
+        Report the idle connections and how often connections were opened, reused and found dead.
+        """
+        return {
+            "size": self.size,
+            "idle": len(self.idle),
+            "connects": self.connects,
+            "reuses": self.reuses,
+            "noop_failures": self.noop_failures,
+        }
+
+
+smtp_pool = SMTPConnectionPool(
+    host=settings.SMTP_SERVER,
+    port=settings.SMTP_PORT,
+    transport=settings.SMTP_TRANSPORT,
+    username=settings.SMTP_USER,
+    password=settings.SMTP_PASS,
+    size=settings.SMTP_POOL_SIZE,
+    idle_timeout=settings.SMTP_POOL_IDLE_TIMEOUT,
+    noop_after=settings.SMTP_POOL_NOOP_AFTER,
+    max_messages=settings.SMTP_POOL_MAX_MESSAGES,
+    timeout=settings.SMTP_TIMEOUT,
+)
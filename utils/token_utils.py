@@ -1,15 +1,25 @@
 import jwt
+import hashlib
+from uuid import uuid4
 from datetime import datetime, timedelta, timezone
 from .config_utils import settings
+from .cache_utils import LRUCache
 
 
+# Verified access tokens and their data, so repeated requests with the same
+# bearer token skip the signature check and JSON decoding.
+access_token_cache = LRUCache(maxsize=settings.ACCESS_TOKEN_CACHE_SIZE, ttl=settings.ACCESS_TOKEN_CACHE_TTL)
 
-def create_access_token(data: str) -> str:
+
+
+
+def create_access_token(data: str, token_version: int = 0) -> str:
     """
     Creates an access token with the provided data.
 
     Args:
         data (str): The data to be included in the access token.
+        token_version (int): The user's current token version, checked when the token is used.
 
     Returns:
         str: The encoded access token.
@@ -18,17 +28,18 @@ def create_access_token(data: str) -> str:
         None.
     """
     expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRES)
-    to_encode = {"exp": expire, "data": data}
+    to_encode = {"exp": expire, "data": data, "jti": uuid4().hex, "ver": token_version}
     encoded_jwt = jwt.encode(to_encode, settings.ACCESS_TOKEN_SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
 
-def create_password_reset_token(data: str) -> str:
+def create_password_reset_token(data: str, token_version: int = 0) -> str:
     """
     Creates a password reset token with the provided data.
 
     Args:
         data (str): The data to be included in the password reset token.
+        token_version (int): The user's current token version, checked when the token is used.
 
     Returns:
         str: The encoded password reset token.
@@ -37,27 +48,44 @@ def create_password_reset_token(data: str) -> str:
         None.
     """
     expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRES)
-    to_encode = {"exp": expire, "data": data}
+    to_encode = {"exp": expire, "data": data, "jti": uuid4().hex, "ver": token_version}
     encode_jwt = jwt.encode(to_encode, settings.PASSWORD_RESET_TOKEN_SECRET_KEY, algorithm=settings.ALGORITHM)
     return encode_jwt
 
 
-def create_verify_email_token(data: str) -> str:
+def create_verify_email_token(data: str, token_version: int = 0) -> str:
     """
     Creates a verify email token with the provided data.
 
     Args:
         data (str): The data to be included in the verify email token.
+        token_version (int): The user's current token version, checked when the token is used.
 
     Returns:
         str: The encoded verify email token.
     """
     expire = datetime.now(timezone.utc) + timedelta(minutes=settings.VERIFY_EMAIL_TOKEN_EXPIRES)
-    to_encode = {"exp": expire, "data": data}
+    to_encode = {"exp": expire, "data": data, "jti": uuid4().hex, "ver": token_version}
     encoded_jwt = jwt.encode(to_encode, settings.VERIFY_EMAIL_TOKEN_SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
 
+def decode_password_reset_token(data: str):
+    """
+    Verify a password reset token and return its claims.
+
+    Args:
+        data (str): The password reset token to be verified.
+
+    Returns:
+        dict or None: The claims (data, ver, jti, exp) if the token is valid, otherwise None.
+    """
+    try:
+        return jwt.decode(data, settings.PASSWORD_RESET_TOKEN_SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except Exception:
+        return None
+
+
 def verify_password_reset_token(data: str):
     """
     Verify a password reset token and return the decoded data.
@@ -71,12 +99,25 @@ def verify_password_reset_token(data: str):
     Raises:
         None.
     """
+    decode_token = decode_password_reset_token(data)
+    return decode_token["data"] if decode_token is not None else None
+    
+def decode_email_verification_token(data: str):
+    """
+    Verify an email verification token and return its claims.
+
+    Args:
+        data (str): The email verification token to be verified.
+
+    Returns:
+        dict or None: The claims (data, ver, jti, exp) if the token is valid, otherwise None.
+    """
     try:
-        decode_token = jwt.decode(data, settings.PASSWORD_RESET_TOKEN_SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return decode_token["data"]
+        return jwt.decode(data, settings.VERIFY_EMAIL_TOKEN_SECRET_KEY, algorithms=[settings.ALGORITHM])
     except Exception:
         return None
-    
+
+
 def verify_email_verification_token(data: str):
     """
     Verify an email verification token and return the decoded data.
@@ -90,12 +131,32 @@ def verify_email_verification_token(data: str):
     Raises:
         Exception: If there is an error decoding the token.
     """
+    decode_token = decode_email_verification_token(data)
+    return decode_token["data"] if decode_token is not None else None
+
+def decode_access_token(data: str):
+    """
+    Verify an access token and return its claims.
+
+    Verified tokens are cached until the earlier of their expiry and ACCESS_TOKEN_CACHE_TTL.
+
+    Args:
+        data (str): The access token to be verified.
+
+    Returns:
+        dict or None: The claims (data, ver, jti, exp) if the token is valid, otherwise None.
+    """
+    cached = access_token_cache.get(data)
+    if cached is not None:
+        return cached
     try:
-        decode_token = jwt.decode(data, settings.VERIFY_EMAIL_TOKEN_SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return decode_token["data"]
+        decode_token = jwt.decode(data, settings.ACCESS_TOKEN_SECRET_KEY, algorithms=[settings.ALGORITHM])
+        access_token_cache.set(data, decode_token, expires_at=decode_token["exp"])
+        return decode_token
     except Exception:
         return None
 
+
 def verify_access_token(data: str):
     """
     Verify an access token and return the decoded data.
@@ -109,8 +170,46 @@ def verify_access_token(data: str):
     Raises:
         Exception: If there is an error decoding the token.
     """
+    decode_token = decode_access_token(data)
+    return decode_token["data"] if decode_token is not None else None
+
+
+def invalidate_access_token(data: str):
+    """
+    Drop an access token from the verification cache, e.g. after it has been revoked.
+
+    Args:
+        data (str): The access token.
+    """
+    access_token_cache.delete(data)
+
+
+def token_digest(token: str) -> str:
+    """
+    Compute the fixed-size digest a token is stored and looked up under.
+
+    Args:
+        token (str): The encoded token.
+
+    Returns:
+        str: The SHA-256 hex digest of the token.
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def token_expiry(token: str) -> datetime:
+    """
+    Read the expiry time of a token without verifying it.
+
+    Args:
+        token (str): The encoded token.
+
+    Returns:
+        datetime: The local time the token expires at. Tokens without a readable
+            `exp` claim are treated as living as long as an access token.
+    """
     try:
-        decode_token = jwt.decode(data, settings.ACCESS_TOKEN_SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return decode_token["data"]
+        payload = jwt.decode(token, options={"verify_signature": False})
+        return datetime.fromtimestamp(payload["exp"])
     except Exception:
-        return None
+        return datetime.now() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRES)